@@ -406,10 +406,13 @@ def engine_AnisoDorrGPU(sim):
     
     
                 
-def init_AnisoDorrGPU(sim, dim=[200,200], sim_type="seed", number_of_seeds=1, tdb_path="Ni-Cu_Ideal.tdb", temperature_type="isothermal", 
+def init_AnisoDorrGPU(sim, dim=(200,200), sim_type="seed", number_of_seeds=1, tdb_path="Ni-Cu_Ideal.tdb", temperature_type="isothermal", 
                            initial_temperature=1574, temperature_gradient=0, cooling_rate=0, temperature_file_path="T.xdmf", 
-                           initial_concentration_array=[0.40831], cell_spacing=0.0000046, d_ratio=1/0.94, solver="explicit", 
-                           nbc=["periodic", "periodic"], cuda_blocks=(16,16), cuda_threads_per_block=(256,1)):
+                           initial_concentration_array=(0.40831,), cell_spacing=0.0000046, d_ratio=1/0.94, solver="explicit", 
+                           nbc=("periodic", "periodic"), cuda_blocks=(16,16), cuda_threads_per_block=(256,1)):
+    #copy, so neither the immutable defaults nor the caller's lists are modified below
+    dim = list(dim)
+    nbc = list(nbc)
     sim.uses_gpu = True
     sim.cuda_blocks = cuda_blocks
     sim.cuda_threads_per_block = cuda_threads_per_block
@@ -519,13 +522,11 @@ class AnisoDorrGPU(Simulation):
                 try:
                     initial_concentration_array = self.user_data["initial_concentration_array"]
                     assert(len(initial_concentration_array) == 1)
-                    c_n = np.zeros(dim)
-                    c_n += initial_concentration_array[0]
+                    c_n = np.full(dim, initial_concentration_array[0], dtype=np.float64)
                     self.add_field(c_n, "c_CU", colormap=COLORMAP_OTHER)
                         
                 except: #initial_concentration array isnt defined?
-                    c_n = np.zeros(dim)
-                    c_n += 0.5
+                    c_n = np.full(dim, 0.5)
                     self.add_field(c_n, "c_CU", colormap=COLORMAP_OTHER)
                         
             elif(sim_type=="seeds"):
@@ -552,13 +553,11 @@ class AnisoDorrGPU(Simulation):
                 try:
                     initial_concentration_array = self.user_data["initial_concentration_array"]
                     assert(len(initial_concentration_array) == 1)
-                    c_n = np.zeros(dim)
-                    c_n += initial_concentration_array[0]
+                    c_n = np.full(dim, initial_concentration_array[0], dtype=np.float64)
                     self.add_field(c_n, "c_CU", colormap=COLORMAP_OTHER)
                         
                 except: #initial_concentration array isnt defined?
-                    c_n = np.zeros(dim)
-                    c_n += 0.5
+                    c_n = np.full(dim, 0.5)
                     self.add_field(c_n, "c_CU", colormap=COLORMAP_OTHER)
         
         except:
@@ -576,13 +575,11 @@ class AnisoDorrGPU(Simulation):
             try:
                 initial_concentration_array = self.user_data["initial_concentration_array"]
                 assert(len(initial_concentration_array) == 1)
-                c_n = np.zeros(dim)
-                c_n += initial_concentration_array[0]
+                c_n = np.full(dim, initial_concentration_array[0], dtype=np.float64)
                 self.add_field(c_n, "c_CU", colormap=COLORMAP_OTHER)
 
             except: #initial_concentration array isnt defined?
-                c_n = np.zeros(dim)
-                c_n += 0.5
+                c_n = np.full(dim, 0.5)
                 self.add_field(c_n, "c_CU", colormap=COLORMAP_OTHER)
         
     def initialize_fields_and_imported_data(self):
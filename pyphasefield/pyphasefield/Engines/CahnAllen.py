@@ -6,15 +6,27 @@ try:
     from ..field import Field
     from ..simulation import Simulation
     from ..ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+    from .. import ppf_cpu_utils
 except:
     try:
         #import classes from pyphasefield library
         from pyphasefield.field import Field
         from pyphasefield.simulation import Simulation
         from pyphasefield.ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+        from pyphasefield import ppf_cpu_utils
     except:
         raise ImportError("Cannot import from pyphasefield library!")
 
+try:
+    import numba
+    from numba import prange
+    from numba import cuda
+    numba_enabled = True
+except:
+    from .. import jit_placeholder as numba
+    from ..jit_placeholder import prange
+    numba_enabled = False
+
 def implicit_matrix_1d(xsize, centervalue, neighborvalue):
     """
     Creates a matrix for the solution of 1d implicit or crank nickolson discretizations
@@ -148,52 +160,169 @@ def engine_CahnAllenImplicit1D(sim):
     phi_final = np.linalg.solve(matrix1d, phi)
     sim.fields[0].data = phi_final
     
-def engine_CahnAllenImplicit1D_GMRES(sim):
+def engine_CahnAllenImplicit_GMRES(sim):
+    """
+    Implicit Cahn-Allen step solved by GMRES, in any number of dimensions. Each interior cell has the row 
+    (1 + s)*phi - alpha*laplacian(phi) = old phi, with alpha = M*dt*epsilon^2/dx^2, the unscaled laplacian and 
+    s = 16*W*M*dt*(4*phi^2 - 6*phi + 2) from the old values. The matrix is never assembled: GMRES calls the 
+    compiled laplacian stencil, preconditioned by the inverse of the diagonal of the rows. Boundary values 
+    (dirchlet values, neumann fluxes) are constant, so their part of the laplacian is moved to the right hand side
+    """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    phi = sim.fields[0].data
-    dim = sim.get_dimensions()
-    M = user_data["M"]
-    W = user_data["W"]
-    epsilon = user_data["epsilon"]
+    M = sim.user_data["M"]
+    W = sim.user_data["W"]
+    epsilon = sim.user_data["epsilon"]
     alpha = M*dt*(epsilon**2)/(dx**2)
-    matrix_source_term = 16.*W*M*dt*(4.*phi**2 - 6.*phi + 2.)
-    matrix1d = implicit_matrix_1d(dim[0], 1+2*alpha + matrix_source_term, -alpha)
-    phi_final, exitCode = gmres(matrix1d, phi, atol='legacy')
-    sim.fields[0].data = phi_final
+    laplacian = ppf_cpu_utils.homogeneous_laplacian(sim)
+    phi = sim.fields[0].get_cells()
+    center = 1. + 16.*W*M*dt*(4.*phi**2 - 6.*phi + 2.)
+    def operator(x):
+        return center*x - alpha*laplacian(x)
+    rhs = phi + alpha*laplacian.boundary_term(sim)
+    phi_final, exit_code = ppf_cpu_utils.gmres_solve(operator, rhs, center - alpha*laplacian.diagonal(), x0=phi, 
+                                                     restart=sim.user_data["gmres_restart"])
+    phi[...] = phi_final
     
-def engine_CahnAllenImplicit2D_GMRES(sim):
-    dt = sim.dt
-    dx = sim.get_cell_spacing()
-    phi = sim.fields[0].data
-    dim = sim.get_dimensions()
-    M = user_data["M"]
-    W = user_data["W"]
-    epsilon = user_data["epsilon"]
-    alpha = M*dt*(epsilon**2)/(dx**2)
-    matrix_source_term = 16.*W*M*dt*(4.*phi**2 - 6.*phi + 2.)
-    matrix2d = implicit_matrix_2d(dim[0], dim[1], 1.+4.*alpha+matrix_source_term, -alpha)
-    phi_final, exitCode = gmres(matrix2d, phi.flatten(), atol='legacy')
-    sim.fields[0].data = phi_final.reshape(dim)
+def _cahn_allen_line_solve(phi, scratch, m, params, periodic):
+    """
+    Implicit Cahn-Allen solve of the line in column m of phi (along axis 0, cells 1 to n), in place
     
+    Each cell has the row (1 + 2*alpha + s_k)*phi_k - alpha*(phi_{k-1} + phi_{k+1}) = old phi_k, where 
+    s_k = 8*W*M*dt*(4*phi_k^2 - 6*phi_k + 2) uses the old values. Periodic lines are cyclic tridiagonal systems 
+    (solved with the Sherman-Morrison correction), otherwise the ends have no flux. The coefficients are computed 
+    during the forward sweep of the Thomas algorithm: scratch[0, :, m] holds the modified superdiagonal, and 
+    scratch[1, :, m] the correction vector of periodic lines. params = [alpha, 8*W*M*dt]
+    """
+    n = phi.shape[0]-2
+    alpha = params[0]
+    source = params[1]
+    cp = scratch[0]
+    z = scratch[1]
+    gamma = 0.
+    dp_z = 0.
+    cp_previous = 0.
+    dp_previous = 0.
+    for k in range(1, n+1):
+        p = phi[k, m]
+        diagonal = 1. + 2.*alpha + source*(4.*p*p - 6.*p + 2.)
+        if not(periodic):
+            if(k == 1 or k == n):
+                diagonal -= alpha
+        else:
+            if(k == 1):
+                gamma = -diagonal
+                diagonal -= gamma
+            if(k == n):
+                diagonal -= alpha*alpha/gamma
+        denominator = diagonal + alpha*cp_previous
+        cp_previous = -alpha/denominator
+        cp[k, m] = cp_previous
+        dp_previous = (p + alpha*dp_previous)/denominator
+        phi[k, m] = dp_previous
+        if(periodic):
+            #right hand side u = (gamma, 0, ..., 0, -alpha) of the correction
+            u = 0.
+            if(k == 1):
+                u = gamma
+            if(k == n):
+                u = -alpha
+            dp_z = (u + alpha*dp_z)/denominator
+            z[k, m] = dp_z
+    for k in range(n-1, 0, -1):
+        phi[k, m] -= cp[k, m]*phi[k+1, m]
+        if(periodic):
+            z[k, m] -= cp[k, m]*z[k+1, m]
+    if(periodic):
+        #v = (1, 0, ..., 0, -alpha/gamma)
+        factor = (phi[1, m] - alpha*phi[n, m]/gamma)/(1. + z[1, m] - alpha*z[n, m]/gamma)
+        for k in range(1, n+1):
+            phi[k, m] -= factor*z[k, m]
+
+#the same line solve is compiled for the CPU and as a device function for the GPU
+_cahn_allen_line_solve_cpu = numba.njit(cache=True)(_cahn_allen_line_solve)
+
+@numba.njit(parallel=True, cache=True)
+def cahn_allen_adi_sweep(phi, scratch, params, periodic):
+    """Solves every line of phi along axis 0 (one line per column), see _cahn_allen_line_solve"""
+    for m in prange(1, phi.shape[1]-1):
+        _cahn_allen_line_solve_cpu(phi, scratch, m, params, periodic)
+
 def engine_CahnAllenImplicit2D_ADI(sim):
-    dt = sim.dt
-    dx = sim.get_cell_spacing()
+    """
+    Implicit Cahn-Allen step, by alternating direction implicit sweeps: every line along x is solved, then every 
+    line along y. The x lines are solved as columns of a transposed copy of phi, so both sweeps walk down columns
+    """
     phi = sim.fields[0].data
-    dim = sim.get_dimensions()
-    M = user_data["M"]
-    W = user_data["W"]
-    epsilon = user_data["epsilon"]
-    alpha = M*dt*(epsilon**2)/(dx**2)
-    for i in range(dim[0]): #iterate through ADI method in the x direction first
-        matrix_source_term = 8.*W*M*dt*(4.*phi[i]**2 - 6.*phi[i] + 2.)
-        matrix1d_x = implicit_matrix_1d(dim[1], 1.+2.*alpha + matrix_source_term, -alpha)
-        phi[i] = np.linalg.solve(matrix1d_x, phi[i])
-    for i in range(dim[1]): #then iterate through ADI method in the y direction
-        matrix_source_term = 8.*W*M*dt*(4.*phi[:,i]**2 - 6.*phi[:,i] + 2.)
-        matrix1d_y = implicit_matrix_1d(dim[0], 1.+2.*alpha + matrix_source_term, -alpha)
-        phi[:,i] = np.linalg.solve(matrix1d_y, phi[:,i])
-    sim.fields[0].data = phi
+    if(sim._bc_codes is None):
+        sim._bc_codes = ppf_cpu_utils.boundary_condition_codes(sim)
+    params = _cahn_allen_adi_params(sim)
+    phi_t = np.ascontiguousarray(phi.T)
+    scratch = np.empty((2,)+phi_t.shape)
+    cahn_allen_adi_sweep(phi_t, scratch, params, sim._bc_codes[1] == ppf_cpu_utils.BC_PERIODIC)
+    phi[...] = phi_t.T
+    scratch = np.empty((2,)+phi.shape)
+    cahn_allen_adi_sweep(phi, scratch, params, sim._bc_codes[0] == ppf_cpu_utils.BC_PERIODIC)
+    
+def _cahn_allen_adi_params(sim):
+    M = sim.user_data["M"]
+    W = sim.user_data["W"]
+    epsilon = sim.user_data["epsilon"]
+    alpha = M*sim.dt*(epsilon**2)/(sim.get_cell_spacing()**2)
+    return np.array([alpha, 8.*W*M*sim.dt])
+
+if(numba_enabled):
+    _cahn_allen_line_solve_gpu = cuda.jit(device=True)(_cahn_allen_line_solve)
+    
+    @cuda.jit
+    def cahn_allen_adi_sweep_kernel(phi, scratch, params, periodic):
+        """
+        GPU version of cahn_allen_adi_sweep, one thread per line. The lines are columns, so the threads of a warp 
+        read and write consecutive addresses at each step of their sweeps
+        """
+        for m in range(cuda.grid(1)+1, phi.shape[1]-1, cuda.gridsize(1)):
+            _cahn_allen_line_solve_gpu(phi, scratch, m, params, periodic)
+            
+    _TRANSPOSE_TILE = 16
+    
+    @cuda.jit
+    def transpose_kernel(source, destination):
+        """
+        destination = source.T, through a shared memory tile (padded by one column to avoid bank conflicts), so 
+        both the reads and the writes are coalesced. Launched with (16, 16) threads per block
+        """
+        tile = cuda.shared.array((_TRANSPOSE_TILE, _TRANSPOSE_TILE+1), numba.float64)
+        tx = cuda.threadIdx.x
+        ty = cuda.threadIdx.y
+        for tile_y in range(cuda.blockIdx.y, (source.shape[0]+_TRANSPOSE_TILE-1)//_TRANSPOSE_TILE, cuda.gridDim.y):
+            for tile_x in range(cuda.blockIdx.x, (source.shape[1]+_TRANSPOSE_TILE-1)//_TRANSPOSE_TILE, cuda.gridDim.x):
+                i = tile_y*_TRANSPOSE_TILE+ty
+                j = tile_x*_TRANSPOSE_TILE+tx
+                if((i < source.shape[0]) and (j < source.shape[1])):
+                    tile[ty, tx] = source[i, j]
+                cuda.syncthreads()
+                i = tile_x*_TRANSPOSE_TILE+ty
+                j = tile_y*_TRANSPOSE_TILE+tx
+                if((i < destination.shape[0]) and (j < destination.shape[1])):
+                    destination[i, j] = tile[tx, ty]
+                cuda.syncthreads()
+                
+def engine_CahnAllenImplicit2D_ADI_GPU(sim):
+    """
+    GPU version of engine_CahnAllenImplicit2D_ADI: phi is transposed into a scratch array, the x lines are solved 
+    as its columns, it is transposed back, and the y lines are solved in place
+    """
+    phi = sim._fields_gpu_device[0]
+    phi_t = sim.user_data["adi_transpose_gpu_device"]
+    threads = (_TRANSPOSE_TILE, _TRANSPOSE_TILE)
+    transpose_kernel[sim._gpu_blocks_per_grid_2D, threads](phi, phi_t)
+    cahn_allen_adi_sweep_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](phi_t, 
+                                sim.user_data["adi_scratch_x_gpu_device"], sim.user_data["adi_params_gpu_device"], 
+                                sim._bc_codes[1] == ppf_cpu_utils.BC_PERIODIC)
+    transpose_kernel[sim._gpu_blocks_per_grid_2D, threads](phi_t, phi)
+    cahn_allen_adi_sweep_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](phi, 
+                                sim.user_data["adi_scratch_y_gpu_device"], sim.user_data["adi_params_gpu_device"], 
+                                sim._bc_codes[0] == ppf_cpu_utils.BC_PERIODIC)
     
 def engine_CahnAllenCrankNicolson2D_ADI(sim):
     dt = sim.dt
@@ -230,11 +359,11 @@ def engine_CahnAllenImplicit2D_ADI_GMRES(sim):
     for i in range(dim[0]): #iterate through ADI method in the x direction first
         matrix_source_term = 8.*W*M*dt*(4.*phi[i]**2 - 6.*phi[i] + 2.)
         matrix1d_x = implicit_matrix_1d(dim[1], 1.+2.*alpha + matrix_source_term, -alpha)
-        phi[i], exitCode = gmres(matrix1d_x, phi[i], atol='legacy')
+        phi[i], exitCode = gmres(matrix1d_x, phi[i], atol=0.)
     for i in range(dim[1]): #then iterate through ADI method in the y direction
         matrix_source_term = 8.*W*M*dt*(4.*phi[:,i]**2 - 6.*phi[:,i] + 2.)
         matrix1d_y = implicit_matrix_1d(dim[0], 1.+2.*alpha + matrix_source_term, -alpha)
-        phi[:,i], exitCode = gmres(matrix1d_y, phi[:,i], atol='legacy')
+        phi[:,i], exitCode = gmres(matrix1d_y, phi[:,i], atol=0.)
     sim.fields[0].data = phi
     
 def engine_CahnAllenImplicit3D_ADI(sim):
@@ -303,6 +432,8 @@ class CahnAllen(Simulation):
             self.user_data["gmres"] = False
         if not ("adi" in self.user_data):
             self.user_data["adi"] = False
+        if not ("gmres_restart" in self.user_data):
+            self.user_data["gmres_restart"] = 30
             
     def init_fields(self):
         #initialization of fields code goes here
@@ -321,18 +452,34 @@ class CahnAllen(Simulation):
         super().just_before_simulating()
         #additional code to run just before beginning the simulation goes below
         #runs immediately before simulating, no manual changes permitted to changes implemented here
+        if(self._uses_gpu):
+            if not(self._uses_gpu_adi()):
+                raise ValueError("Only the 2D implicit (ADI) Cahn-Allen solver runs on the GPU!")
+            if(self._bc_codes is None):
+                self._bc_codes = ppf_cpu_utils.boundary_condition_codes(self)
+            shape = self._field_stack.shape[1:]
+            self.user_data["adi_params_gpu_device"] = cuda.to_device(_cahn_allen_adi_params(self))
+            self.user_data["adi_transpose_gpu_device"] = cuda.device_array((shape[1], shape[0]))
+            self.user_data["adi_scratch_x_gpu_device"] = cuda.device_array((2, shape[1], shape[0]))
+            self.user_data["adi_scratch_y_gpu_device"] = cuda.device_array((2, shape[0], shape[1]))
+            
+    def _uses_gpu_adi(self):
+        return ((len(self.dimensions) == 2) and (self.user_data["solver"] == "implicit") and not(self.user_data["gmres"]))
         
     def simulation_loop(self):
         #code to run each simulation step goes here
         solver = self.user_data["solver"]
         gmres = self.user_data["gmres"]
         adi = self.user_data["adi"]
-        if (solver == "explicit"):
+        dim = self.dimensions
+        if(self._uses_gpu):
+            engine_CahnAllenImplicit2D_ADI_GPU(self)
+        elif (solver == "explicit"):
             engine_CahnAllenExplicit(self)
         elif (solver == "implicit"):
             if(len(dim) == 1):
                 if(gmres):
-                    engine_CahnAllenImplicit1D_GMRES(self)
+                    engine_CahnAllenImplicit_GMRES(self)
                 else:
                     engine_CahnAllenImplicit1D(self)
             elif(len(dim) == 2):
@@ -340,7 +487,7 @@ class CahnAllen(Simulation):
                     if(adi):
                         engine_CahnAllenImplicit2D_ADI_GMRES(self)
                     else:
-                        engine_CahnAllenImplicit2D_GMRES(self)
+                        engine_CahnAllenImplicit_GMRES(self)
                 else:
                     engine_CahnAllenImplicit2D_ADI(self)
             elif(len(dim) == 3):
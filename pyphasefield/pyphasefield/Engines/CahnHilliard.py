@@ -6,14 +6,24 @@ try:
     from ..field import Field
     from ..simulation import Simulation
     from ..ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+    from .. import ppf_cpu_utils
 except:
     try:
         #import classes from pyphasefield library
         from pyphasefield.field import Field
         from pyphasefield.simulation import Simulation
         from pyphasefield.ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+        from pyphasefield import ppf_cpu_utils
     except:
         raise ImportError("Cannot import from pyphasefield library!")
+
+try:
+    import numba
+    from numba import prange
+    from numba import cuda
+except:
+    from .. import jit_placeholder as numba
+    from ..jit_placeholder import prange
         
 ###### Need to reconciliate use of W term in equations! ######
 
@@ -132,18 +142,195 @@ def implicit_matrix_2d(ysize, xsize, centervalue, neighborvalue, farneighborvalu
     return matrix2d
 
 def engine_CahnHilliardExplicit(sim):
+    """
+    Computes the discretization of the Cahn-Hilliard equation using a purely explicit scheme
+    
+    dc/dt = M*laplacian(mu), with the chemical potential mu = 4c^3 - 6c^2 + 2c - epsilon^2*laplacian(c)
+    
+    The boundary cells of mu are set like those of c on periodic axes, every other axis has no flux of mu 
+    (zero derivative) across the boundary. Valid for 1, 2, or 3D simulations
+    """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    phi = sim.fields[0]
-    M = user_data["M"]
-    W = user_data["W"]
-    epsilon = user_data["epsilon"]
-    dfdphi = -epsilon**2 * phi.laplacian() + (4*phi.data**3 - 6*phi.data**2 + 2*phi.data)
-    deltaphi = 0
-    for i in range(len(sim.get_dimensions())):
-        deltaphi += (np.roll(dfdphi, 1, i) + np.roll(dfdphi, -1, i) - 2*dfdphi)
-    deltaphi /= (dx**2)
-    sim.fields[0].data += M*deltaphi
+    c = sim.fields[0]
+    M = sim.user_data["M"]
+    epsilon = sim.user_data["epsilon"]
+    mu = c.laplacian()
+    mu *= -epsilon**2
+    mu += c.data*(4*c.data*c.data - 6*c.data + 2)
+    if(sim._bc_codes is None):
+        sim._bc_codes = ppf_cpu_utils.boundary_condition_codes(sim)
+    for i in range(len(sim.dimensions)):
+        before = (slice(None),)*i
+        if(sim._bc_codes[i] == ppf_cpu_utils.BC_PERIODIC):
+            mu[before+(0,)] = mu[before+(-2,)]
+            mu[before+(-1,)] = mu[before+(1,)]
+        else:
+            mu[before+(0,)] = mu[before+(1,)]
+            mu[before+(-1,)] = mu[before+(-2,)]
+    dc = np.zeros(c.get_cells().shape)
+    for i in range(len(sim.dimensions)):
+        before = (slice(1, -1),)*i
+        after = (slice(1, -1),)*(len(sim.dimensions)-i-1)
+        dc += mu[before+(slice(2, None),)+after] + mu[before+(slice(None, -2),)+after] - 2*mu[c._slice]
+    dc *= dt*M/(dx*dx)
+    c.data[c._slice] += dc
+
+@numba.njit(inline="always")
+def _ghost_source(index, n, periodic):
+    """Index of the interior cell (1 to n) which the boundary conditions copy into cell index (0 to n+1)"""
+    if(index == 0):
+        return n if periodic else 1
+    if(index == n+1):
+        return 1 if periodic else n
+    return index
+
+@numba.njit(inline="always")
+def _dfdc(c):
+    return c*(4*c*c - 6*c + 2)
+
+#the compiled kernels below compute mu and its laplacian in one sweep over c: each thread takes a block of rows 
+#(planes in 3D), computes mu for them plus one row on each side into a small buffer, then reads its laplacian 
+#from the buffer. Rows of mu in the boundary cells are computed from the interior row the boundary conditions 
+#would copy there, so no second pass over the grid (or full size mu array) is needed
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def explicit_cahn_hilliard_kernel_1D(fields, fields_out, temperature, temperature_offset, params):
+    """
+    Compiled equivalent of engine_CahnHilliardExplicit for 1D simulations, used by ppf_cpu_utils.simulate
+    
+    params = [M, epsilon, dt, dx, block size, bc code of x]
+    """
+    e2 = params[1]*params[1]/(params[3]*params[3])
+    alpha = params[0]*params[2]/(params[3]*params[3])
+    block = int(params[4])
+    periodic_x = (int(params[5]) == ppf_cpu_utils.BC_PERIODIC)
+    c = fields[0]
+    c_out = fields_out[0]
+    nx = c.shape[0]-2
+    tiles = (nx+block-1)//block
+    for tile in prange(tiles):
+        x0 = 1+tile*block
+        x1 = min(x0+block, nx+1)
+        mu = np.empty(x1-x0+2)
+        for i in range(x0-1, x1+1):
+            k = _ghost_source(i, nx, periodic_x)
+            mu[i-x0+1] = _dfdc(c[k]) - e2*(c[k+1] + c[k-1] - 2*c[k])
+        for i in range(x0, x1):
+            m = i-x0+1
+            c_out[i] = c[i] + alpha*(mu[m+1] + mu[m-1] - 2*mu[m])
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def explicit_cahn_hilliard_kernel_2D(fields, fields_out, temperature, temperature_offset, params):
+    """
+    Compiled equivalent of engine_CahnHilliardExplicit for 2D simulations, used by ppf_cpu_utils.simulate
+    
+    params = [M, epsilon, dt, dx, block size (rows), bc code of y, bc code of x]
+    """
+    e2 = params[1]*params[1]/(params[3]*params[3])
+    alpha = params[0]*params[2]/(params[3]*params[3])
+    block = int(params[4])
+    periodic_y = (int(params[5]) == ppf_cpu_utils.BC_PERIODIC)
+    periodic_x = (int(params[6]) == ppf_cpu_utils.BC_PERIODIC)
+    c = fields[0]
+    c_out = fields_out[0]
+    ny = c.shape[0]-2
+    nx = c.shape[1]-2
+    tiles = (ny+block-1)//block
+    for tile in prange(tiles):
+        y0 = 1+tile*block
+        y1 = min(y0+block, ny+1)
+        mu = np.empty((y1-y0+2, nx+2))
+        for i in range(y0-1, y1+1):
+            k = _ghost_source(i, ny, periodic_y)
+            m = mu[i-y0+1]
+            for j in range(1, nx+1):
+                m[j] = _dfdc(c[k, j]) - e2*(c[k+1, j] + c[k-1, j] + c[k, j+1] + c[k, j-1] - 4*c[k, j])
+            m[0] = m[_ghost_source(0, nx, periodic_x)]
+            m[nx+1] = m[_ghost_source(nx+1, nx, periodic_x)]
+        for i in range(y0, y1):
+            m = i-y0+1
+            for j in range(1, nx+1):
+                c_out[i, j] = c[i, j] + alpha*(mu[m+1, j] + mu[m-1, j] + mu[m, j+1] + mu[m, j-1] - 4*mu[m, j])
+                
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def explicit_cahn_hilliard_kernel_3D(fields, fields_out, temperature, temperature_offset, params):
+    """
+    Compiled equivalent of engine_CahnHilliardExplicit for 3D simulations, used by ppf_cpu_utils.simulate
+    
+    params = [M, epsilon, dt, dx, block size (planes), bc code of z, bc code of y, bc code of x]
+    """
+    e2 = params[1]*params[1]/(params[3]*params[3])
+    alpha = params[0]*params[2]/(params[3]*params[3])
+    block = int(params[4])
+    periodic_z = (int(params[5]) == ppf_cpu_utils.BC_PERIODIC)
+    periodic_y = (int(params[6]) == ppf_cpu_utils.BC_PERIODIC)
+    periodic_x = (int(params[7]) == ppf_cpu_utils.BC_PERIODIC)
+    c = fields[0]
+    c_out = fields_out[0]
+    nz = c.shape[0]-2
+    ny = c.shape[1]-2
+    nx = c.shape[2]-2
+    tiles = (nz+block-1)//block
+    for tile in prange(tiles):
+        z0 = 1+tile*block
+        z1 = min(z0+block, nz+1)
+        mu = np.empty((z1-z0+2, ny+2, nx+2))
+        for i in range(z0-1, z1+1):
+            l = _ghost_source(i, nz, periodic_z)
+            m = mu[i-z0+1]
+            for j in range(1, ny+1):
+                for k in range(1, nx+1):
+                    m[j, k] = _dfdc(c[l, j, k]) - e2*(c[l+1, j, k] + c[l-1, j, k] + c[l, j+1, k] + c[l, j-1, k] + 
+                                                      c[l, j, k+1] + c[l, j, k-1] - 6*c[l, j, k])
+                m[j, 0] = m[j, _ghost_source(0, nx, periodic_x)]
+                m[j, nx+1] = m[j, _ghost_source(nx+1, nx, periodic_x)]
+            m[0] = m[_ghost_source(0, ny, periodic_y)]
+            m[ny+1] = m[_ghost_source(ny+1, ny, periodic_y)]
+        for i in range(z0, z1):
+            m = i-z0+1
+            for j in range(1, ny+1):
+                for k in range(1, nx+1):
+                    c_out[i, j, k] = c[i, j, k] + alpha*(mu[m+1, j, k] + mu[m-1, j, k] + mu[m, j+1, k] + mu[m, j-1, k] + 
+                                                         mu[m, j, k+1] + mu[m, j, k-1] - 6*mu[m, j, k])
+
+#like the Diffusion drivers, these call their kernel directly so numba can cache them on disk
+@numba.njit(cache=True)
+def explicit_cahn_hilliard_driver_1D(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        explicit_cahn_hilliard_kernel_1D(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+
+@numba.njit(cache=True)
+def explicit_cahn_hilliard_driver_2D(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        explicit_cahn_hilliard_kernel_2D(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+
+@numba.njit(cache=True)
+def explicit_cahn_hilliard_driver_3D(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        explicit_cahn_hilliard_kernel_3D(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+
+def explicit_cahn_hilliard_block_size(shape, threads=1, itemsize=8):
+    """
+    Rows (planes in 3D) of c handled by each block of the compiled kernels, for an array with the given (padded) shape
+    
+    Chosen so the rows of c a block reads and its mu buffer fit in L2 together, but with at least a few blocks 
+    per thread (of the given number of threads), and at least 8 rows per block (each block computes 2 extra rows of mu)
+    """
+    row_bytes = itemsize
+    for n in shape[1:]:
+        row_bytes *= n
+    block = ppf_cpu_utils.L2_CACHE_SIZE//(2*row_bytes) - 2
+    block = min(block, (shape[0]-2)//(4*threads))
+    return max(8, min(block, shape[0]-2))
     
 def engine_CahnHilliardImplicit1D(sim):
     dt = sim.dt
@@ -161,21 +348,35 @@ def engine_CahnHilliardImplicit1D(sim):
     c_final = np.linalg.solve(matrix1d, c)
     sim.fields[0].data = c_final
     
-def engine_CahnHilliardImplicit1D_GMRES(sim):
-    dt = sim.dt
+def _cahn_hilliard_gmres_solve(sim, c, dt):
+    """
+    Solves the implicit Cahn-Hilliard system for the interior cells c, in place. Each cell has the row 
+    c - alpha*laplacian(m*c) + alpha*epsilon^2/dx^2*laplacian(laplacian(c)) = old c, with alpha = M*dt/dx^2, the 
+    unscaled laplacian and m = 4*c^2 - 6*c + 2 from the old values. The matrix is never assembled: GMRES calls the 
+    compiled laplacian stencil, preconditioned by the inverse of the diagonal of the rows. Only boundaries with 
+    no contribution to the laplacian (periodic, zero flux, zero dirchlet values) are supported, the biharmonic term 
+    has no well defined boundary values otherwise
+    """
     dx = sim.get_cell_spacing()
-    idx2 = 1/dx**2
-    M = user_data["M"]
-    W = user_data["W"]
-    epsilon = user_data["epsilon"]
-    e2 = epsilon**2
-    c = sim.fields[0].data
-    dim = sim.get_dimensions()
-    alpha = M*dt*idx2
-    matrix_source_term = (4*c**2 - 6*c + 2)
-    matrix1d = implicit_matrix_1d(dim[0], 1+alpha*(2*matrix_source_term+6*e2*idx2), -alpha*(matrix_source_term+4*e2*idx2), alpha*e2*idx2)
-    c_final, exitCode = gmres(matrix1d, c, atol='legacy')
-    sim.fields[0].data = c_final
+    M = sim.user_data["M"]
+    epsilon = sim.user_data["epsilon"]
+    alpha = M*dt/dx**2
+    beta = alpha*epsilon**2/dx**2
+    laplacian = ppf_cpu_utils.homogeneous_laplacian(sim)
+    if(np.any(laplacian.boundary_term(sim))):
+        raise ValueError("The GMRES Cahn-Hilliard solver requires periodic, zero flux, or zero valued dirchlet boundaries")
+    m = 4.*c**2 - 6.*c + 2.
+    def operator(x):
+        return x - alpha*laplacian(m*x) + beta*laplacian(laplacian(x))
+    #away from boundaries, the laplacian of the laplacian has 2*dim*(2*dim+1) on its diagonal
+    d = laplacian.diagonal()
+    diagonal = 1. - alpha*d*m + beta*(d*d - d)
+    c_final, exit_code = ppf_cpu_utils.gmres_solve(operator, c, diagonal, restart=sim.user_data["gmres_restart"])
+    c[...] = c_final
+    
+def engine_CahnHilliardImplicit_GMRES(sim):
+    """Implicit Cahn-Hilliard step solved by GMRES, in any number of dimensions, see _cahn_hilliard_gmres_solve"""
+    _cahn_hilliard_gmres_solve(sim, sim.fields[0].get_cells(), sim.dt)
     
 def engine_CahnHilliardCrankNicolson1D(sim):
     dt = sim.dt/2
@@ -205,9 +406,8 @@ def engine_CahnHilliardCrankNicolson1D_GMRES(sim):
     dt = sim.dt/2
     dx = sim.get_cell_spacing()
     phi = sim.fields[0]
-    M = user_data["M"]
-    W = user_data["W"]
-    epsilon = user_data["epsilon"]
+    M = sim.user_data["M"]
+    epsilon = sim.user_data["epsilon"]
     dfdphi = -epsilon**2 * phi.laplacian() + (4*phi.data**3 - 6*phi.data**2 + 2*phi.data)
     deltaphi = 0
     for i in range(len(sim.get_dimensions())):
@@ -215,29 +415,7 @@ def engine_CahnHilliardCrankNicolson1D_GMRES(sim):
     deltaphi /= (dx**2)
     sim.fields[0].data += M*deltaphi
     
-    idx2 = 1/dx**2
-    e2 = epsilon**2
-    c = sim.fields[0].data
-    dim = sim.get_dimensions()
-    alpha = M*dt*idx2
-    matrix_source_term = (4*c**2 - 6*c + 2)
-    matrix1d = implicit_matrix_1d(dim[0], 1+alpha*(2*matrix_source_term+6*e2*idx2), -alpha*(matrix_source_term+4*e2*idx2), alpha*e2*idx2)
-    c_final, exitCode = gmres(matrix1d, c, atol='legacy')
-    sim.fields[0].data = c_final
-    
-def engine_CahnHilliardImplicit2D_GMRES(sim):
-    dt = sim.dt
-    dx = sim.get_cell_spacing()
-    phi = sim.fields[0].data
-    M = user_data["M"]
-    W = user_data["W"]
-    epsilon = user_data["epsilon"]
-    alpha = M*dt*(epsilon**2)/(dx**2)
-    dim = sim.get_dimensions()
-    matrix_source_term = 16*W*M*dt*(4*phi**2 - 6*phi + 2)
-    matrix2d = implicit_matrix_2d(dim[0], dim[1], 1+4*alpha+matrix_source_term, -alpha)
-    phi_final, exitCode = gmres(matrix2d, phi.flatten(), atol='legacy')
-    sim.fields[0].data = phi_final.reshape(dim)
+    _cahn_hilliard_gmres_solve(sim, sim.fields[0].get_cells(), dt)
     
 def engine_CahnHilliardImplicit2D_ADI(sim):
     dt = sim.dt
@@ -291,11 +469,11 @@ def engine_CahnHilliardImplicit2D_ADI_GMRES(sim):
     for i in range(dim[0]): #iterate through ADI method in the x direction first
         matrix_source_term = 8*W*M*dt*(4*phi[i]**2 - 6*phi[i] + 2)
         matrix1d_x = implicit_matrix_1d(dim[1], 1+2*alpha + matrix_source_term, -alpha)
-        phi[i], exitCode = gmres(matrix1d_x, phi[i], atol='legacy')
+        phi[i], exitCode = gmres(matrix1d_x, phi[i], atol=0.)
     for i in range(dim[1]): #then iterate through ADI method in the y direction
         matrix_source_term = 8*W*M*dt*(4*phi[:,i]**2 - 6*phi[:,i] + 2)
         matrix1d_y = implicit_matrix_1d(dim[0], 1+2*alpha + matrix_source_term, -alpha)
-        phi[:,i], exitCode = gmres(matrix1d_y, phi[:,i], atol='legacy')
+        phi[:,i], exitCode = gmres(matrix1d_y, phi[:,i], atol=0.)
     sim.fields[0].data = phi
     
 def engine_CahnHilliardImplicit3D_ADI(sim):
@@ -361,6 +539,8 @@ class CahnHilliard(Simulation):
             self.user_data["gmres"] = False
         if not ("adi" in self.user_data):
             self.user_data["adi"] = False
+        if not ("gmres_restart" in self.user_data):
+            self.user_data["gmres_restart"] = 30
 
     def init_fields(self):
         #initialization of fields code goes here
@@ -378,18 +558,32 @@ class CahnHilliard(Simulation):
         super().just_before_simulating()
         #additional code to run just before beginning the simulation goes below
         #runs immediately before simulating, no manual changes permitted to changes implemented here
+        if((self._framework == "CPU_SERIAL" or self._framework == "CPU_PARALLEL") and (self.user_data["solver"] == "explicit")):
+            #explicit steps can be run entirely in compiled code, see ppf_cpu_utils.simulate
+            kernels = [explicit_cahn_hilliard_kernel_1D, explicit_cahn_hilliard_kernel_2D, explicit_cahn_hilliard_kernel_3D]
+            self._numba_kernel = kernels[len(self.dimensions)-1]
+            drivers = [explicit_cahn_hilliard_driver_1D, explicit_cahn_hilliard_driver_2D, explicit_cahn_hilliard_driver_3D]
+            self._numba_driver = drivers[len(self.dimensions)-1]
+            if(self._bc_codes is None):
+                self._bc_codes = ppf_cpu_utils.boundary_condition_codes(self)
+            params = [self.user_data["M"], self.user_data["epsilon"], self.dt, self.dx, 
+                      explicit_cahn_hilliard_block_size(self._field_stack.shape[1:], 
+                                                                        ppf_cpu_utils.simulation_threads(self) or 1)]
+            params += list(self._bc_codes)
+            self._numba_kernel_params = np.array(params, dtype=np.float64)
         
     def simulation_loop(self):
         #code to run each simulation step goes here
         solver = self.user_data["solver"]
         gmres = self.user_data["gmres"]
         adi = self.user_data["adi"]
+        dim = self.dimensions
         if (solver == "explicit"):
             engine_CahnHilliardExplicit(self)
         elif (solver == "implicit"):
             if(len(dim) == 1):
                 if(gmres):
-                    engine_CahnHilliardImplicit1D_GMRES(self)
+                    engine_CahnHilliardImplicit_GMRES(self)
                 else:
                     engine_CahnHilliardImplicit1D(self)
             elif(len(dim) == 2):
@@ -397,7 +591,7 @@ class CahnHilliard(Simulation):
                     if(adi):
                         engine_CahnHilliardImplicit2D_ADI_GMRES(self)
                     else:
-                        engine_CahnHilliardImplicit2D_GMRES(self)
+                        engine_CahnHilliardImplicit_GMRES(self)
                 else:
                     engine_CahnHilliardImplicit2D_ADI(self)
             elif(len(dim) == 3):
@@ -418,4 +612,192 @@ class CahnHilliard(Simulation):
                 engine_CahnHilliardCrankNicolson2D_ADI(self)
             else:
                 print("Higher dimensional non-explicit Cahn-Hilliard not yet implemented!")
-                return
\ No newline at end of file
+                return
+
+def pentadiagonal_factors(a, b, c, d, e):
+    """
+    LU factorization (without pivoting) of the pentadiagonal matrix with row k: 
+        a[k]*x[k-2] + b[k]*x[k-1] + c[k]*x[k] + d[k]*x[k+1] + e[k]*x[k+2]
+    
+    Returns (l1, l2, u0inv, u1): the two subdiagonals of the unit lower triangular factor, and the inverse diagonal 
+    and first superdiagonal of the upper triangular factor (its second superdiagonal is e itself). Only suitable for 
+    matrices which need no pivoting, e.g. symmetric positive definite ones
+    """
+    n = len(c)
+    l1 = np.zeros(n)
+    l2 = np.zeros(n)
+    u0 = np.zeros(n)
+    u1 = np.zeros(n)
+    for k in range(n):
+        if(k > 1):
+            l2[k] = a[k]/u0[k-2]
+        if(k > 0):
+            l1[k] = (b[k] - (l2[k]*u1[k-2] if k > 1 else 0.))/u0[k-1]
+        u0[k] = c[k] - (l1[k]*u1[k-1] if k > 0 else 0.) - (l2[k]*e[k-2] if k > 1 else 0.)
+        u1[k] = d[k] - (l1[k]*e[k-1] if k > 0 else 0.)
+    return l1, l2, 1./u0, u1
+
+def cahn_hilliard_pentadiagonal_factors(n, beta):
+    """
+    Factors of the matrix (I + beta*D4) used by the batched Cahn-Hilliard solver, see pentadiagonal_factors
+    
+    D4 is the 1D biharmonic stencil [1, -4, 6, -4, 1], with zero flux of c and laplacian(c) through both ends, 
+    which changes the first and last two rows to [2, -3, 1] and [-3, 6, -4, 1]. The matrix is symmetric positive 
+    definite and its columns sum to 1, so the implicit step conserves the total concentration
+    """
+    if(n < 4):
+        raise ValueError("Batched Cahn-Hilliard runs must be at least 4 cells long!")
+    a = np.full(n, beta)
+    b = np.full(n, -4.*beta)
+    c = np.full(n, 1.+6.*beta)
+    d = np.full(n, -4.*beta)
+    e = np.full(n, beta)
+    a[:2] = 0.
+    b[0] = 0.
+    d[-1] = 0.
+    e[-2:] = 0.
+    c[0] = c[-1] = 1.+2.*beta
+    b[1] = d[0] = d[-2] = b[-1] = -3.*beta
+    return pentadiagonal_factors(a, b, c, d, e)
+
+def _pentadiagonal_cahn_hilliard_run(c, c_out, m, params):
+    """
+    One semi-implicit step of the run in column m of c (shape [N+2, batch_size+2]), written to column m of c_out:
+    
+    (I + beta*D4) c_out = c + alpha*D2 f'(c), with alpha = M*dt/dx^2, beta = M*dt*epsilon^2/dx^4
+    
+    The right hand side is computed during the forward sweep, so c is read once, and c_out holds the intermediate 
+    values of the sweep. params = [alpha, beta, l1, l2, u0inv, u1], the factors of each being N long 
+    (see cahn_hilliard_pentadiagonal_factors), and are shared by every run
+    """
+    n = c.shape[0]-2
+    alpha = params[0]
+    beta = params[1]
+    l1 = params[2:2+n]
+    l2 = params[2+n:2+2*n]
+    u0inv = params[2+2*n:2+3*n]
+    u1 = params[2+3*n:2+4*n]
+    #forward sweep, cell i is row i-1 of the matrix. f'(c) is mirrored across both ends (zero flux)
+    f_low = c[1, m]*(4.*c[1, m]*c[1, m] - 6.*c[1, m] + 2.)
+    f_center = f_low
+    z1 = 0.
+    z2 = 0.
+    for i in range(1, n+1):
+        f_high = f_center
+        if(i < n):
+            f_high = c[i+1, m]*(4.*c[i+1, m]*c[i+1, m] - 6.*c[i+1, m] + 2.)
+        r = c[i, m] + alpha*(f_high + f_low - 2.*f_center)
+        z = r - l1[i-1]*z1 - l2[i-1]*z2
+        c_out[i, m] = z
+        z2 = z1
+        z1 = z
+        f_low = f_center
+        f_center = f_high
+    #back substitution
+    x1 = 0.
+    x2 = 0.
+    for i in range(n, 0, -1):
+        x = (c_out[i, m] - u1[i-1]*x1 - (beta*x2 if i < n-1 else 0.))*u0inv[i-1]
+        c_out[i, m] = x
+        x2 = x1
+        x1 = x
+
+#the same sweep is compiled for the CPU kernel and as a device function for the GPU kernel
+_pentadiagonal_cahn_hilliard_run_cpu = numba.njit(cache=True)(_pentadiagonal_cahn_hilliard_run)
+
+@numba.njit(parallel=True, cache=True)
+def batched_cahn_hilliard_kernel(fields, fields_out, temperature, temperature_offset, params):
+    """Compiled step of CahnHilliardBatch on the CPU, used by ppf_cpu_utils.simulate. Each thread solves whole runs"""
+    c = fields[0]
+    c_out = fields_out[0]
+    for m in prange(1, c.shape[1]-1):
+        _pentadiagonal_cahn_hilliard_run_cpu(c, c_out, m, params)
+
+@numba.njit(cache=True)
+def batched_cahn_hilliard_driver(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        batched_cahn_hilliard_kernel(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+
+if(ppf_cpu_utils.numba_enabled):
+    _pentadiagonal_cahn_hilliard_run_gpu = cuda.jit(device=True)(_pentadiagonal_cahn_hilliard_run)
+    
+    @cuda.jit
+    def batched_cahn_hilliard_gpu_kernel(fields, fields_out, params):
+        """
+        GPU step of CahnHilliardBatch, one thread per run. Runs are the last axis of the fields, so the threads of a 
+        warp sweeping along the first axis read and write consecutive addresses
+        """
+        c = fields[0]
+        c_out = fields_out[0]
+        for m in range(cuda.grid(1)+1, c.shape[1]-1, cuda.gridsize(1)):
+            _pentadiagonal_cahn_hilliard_run_gpu(c, c_out, m, params)
+
+class CahnHilliardBatch(Simulation):
+    """
+    batch_size independent 1D Cahn-Hilliard runs of the same length, evolved together (e.g. ensembles or parameter sweeps)
+    
+    dimensions=[N] gives the length of each run. The runs are stored as a single 2D field "c" of shape [N, batch_size], 
+    one run per column, so self.dimensions becomes [N, batch_size]. Each step is semi-implicit, with the stiff 
+    epsilon^2 biharmonic term implicit and f'(c) explicit, which makes the matrix the same constant pentadiagonal 
+    one for every run and step: it is factored once, and each run (one thread) only does the two triangular sweeps
+    
+    Runs always have zero flux boundaries at both ends. Uses the GPU if the framework is GPU_SERIAL or GPU_PARALLEL
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        #additional initialization code goes below
+        #runs *before* tdb, thermal, fields, and boundary conditions are loaded/initialized
+        if not ("M" in self.user_data):
+            self.user_data["M"] = 0.1
+        if not ("epsilon" in self.user_data):
+            self.user_data["epsilon"] = 1.
+        if not ("batch_size" in self.user_data):
+            self.user_data["batch_size"] = 1024
+        if not ("solver" in self.user_data):
+            self.user_data["solver"] = "implicit_pent"
+        if not (self.user_data["solver"] == "implicit_pent"):
+            raise ValueError("CahnHilliardBatch only implements the \"implicit_pent\" solver!")
+        if(len(self.dimensions) == 1):
+            self.dimensions = [self.dimensions[0], self.user_data["batch_size"]]
+        self._boundary_conditions_type = ["NEUMANN", None]
+        
+    def init_fields(self):
+        #initialization of fields code goes here
+        #runs *after* tdb and thermal data is loaded/initialized
+        #runs *before* boundary conditions are initialized
+        c = 0.001*np.random.random(self.dimensions) + 0.4995
+        self.add_field(c, "c")
+        
+    def just_before_simulating(self):
+        super().just_before_simulating()
+        #additional code to run just before beginning the simulation goes below
+        #runs immediately before simulating, no manual changes permitted to changes implemented here
+        dx = self.get_cell_spacing()
+        M = self.user_data["M"]
+        epsilon = self.user_data["epsilon"]
+        alpha = M*self.dt/dx**2
+        beta = M*self.dt*epsilon**2/dx**4
+        factors = cahn_hilliard_pentadiagonal_factors(self.dimensions[0], beta)
+        params = np.concatenate(([alpha, beta],)+factors)
+        if(self._uses_gpu):
+            self.user_data["params_gpu_device"] = cuda.to_device(params)
+        else:
+            self._numba_kernel = batched_cahn_hilliard_kernel
+            self._numba_driver = batched_cahn_hilliard_driver
+            self._numba_kernel_params = params
+        
+    def simulation_loop(self):
+        #code to run each simulation step goes here
+        if(self._uses_gpu):
+            batched_cahn_hilliard_gpu_kernel[self._gpu_blocks_per_grid_1D, self._gpu_threads_per_block_1D](self._fields_gpu_device, 
+                                                                      self._fields_out_gpu_device, self.user_data["params_gpu_device"])
+            self._fields_gpu_device, self._fields_out_gpu_device = self._fields_out_gpu_device, self._fields_gpu_device
+        else:
+            #only used without numba, ppf_cpu_utils.simulate runs the compiled kernel otherwise
+            if(self._field_stack_out is None):
+                self._field_stack_out = self._allocate_field_stack(self._field_stack.shape)
+            batched_cahn_hilliard_kernel(self._field_stack, self._field_stack_out, None, 0., self._numba_kernel_params)
+            self._swap_field_stacks()
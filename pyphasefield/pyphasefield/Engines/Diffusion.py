@@ -6,15 +6,24 @@ try:
     from ..field import Field
     from ..simulation import Simulation
     from ..ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+    from .. import ppf_cpu_utils
 except:
     try:
         #import classes from pyphasefield library
         from pyphasefield.field import Field
         from pyphasefield.simulation import Simulation
         from pyphasefield.ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+        from pyphasefield import ppf_cpu_utils
     except:
         raise ImportError("Cannot import from pyphasefield library!")
 
+try:
+    import numba
+    from numba import prange
+except:
+    from .. import jit_placeholder as numba
+    from ..jit_placeholder import prange
+
 def diffusion_matrix_1d(xsize, centervalue, neighborvalue):
     """
     Creates a matrix for the solution of 1d implicit or crank nickolson discretizations
@@ -203,9 +212,92 @@ def engine_ExplicitDiffusion(sim):
     """
     dt = sim.dt
     c = sim.fields[0]
-    D = self.user_data["D"]
-    dc = dt * (D * c.laplacian())
-    sim.fields[0].data += dc
+    D = sim.user_data["D"]
+    dc = c.laplacian()
+    dc *= dt*D
+    c.data += dc
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def explicit_diffusion_kernel_1D(fields, fields_out, temperature, temperature_offset, params):
+    """
+    Compiled equivalent of engine_ExplicitDiffusion for 1D simulations, used by ppf_cpu_utils.simulate
+    
+    params = [D, dt, dx]
+    """
+    alpha = params[0]*params[1]/(params[2]*params[2])
+    c = fields[0]
+    c_out = fields_out[0]
+    for i in prange(1, c.shape[0]-1):
+        c_out[i] = c[i] + alpha*(c[i+1] + c[i-1] - 2*c[i])
+        
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def explicit_diffusion_kernel_2D(fields, fields_out, temperature, temperature_offset, params):
+    """
+    Compiled equivalent of engine_ExplicitDiffusion for 2D simulations, used by ppf_cpu_utils.simulate
+    
+    params = [D, dt, dx]
+    """
+    alpha = params[0]*params[1]/(params[2]*params[2])
+    c = fields[0]
+    c_out = fields_out[0]
+    for i in prange(1, c.shape[0]-1):
+        for j in range(1, c.shape[1]-1):
+            c_out[i, j] = c[i, j] + alpha*(c[i+1, j] + c[i-1, j] + c[i, j+1] + c[i, j-1] - 4*c[i, j])
+            
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def explicit_diffusion_kernel_3D(fields, fields_out, temperature, temperature_offset, params):
+    """
+    Compiled equivalent of engine_ExplicitDiffusion for 3D simulations, used by ppf_cpu_utils.simulate
+    
+    The grid is swept in (BZ, BY, whole x-row) tiles sized to fit in L2 (see ppf_cpu_utils.stencil_block_sizes), 
+    so cells loaded for one row are reused by the neighboring rows before being evicted
+    
+    params = [D, dt, dx, BZ, BY]
+    """
+    alpha = params[0]*params[1]/(params[2]*params[2])
+    block_z = int(params[3])
+    block_y = int(params[4])
+    c = fields[0]
+    c_out = fields_out[0]
+    nz = c.shape[0]-2
+    ny = c.shape[1]-2
+    tiles_z = (nz+block_z-1)//block_z
+    tiles_y = (ny+block_y-1)//block_y
+    for tile in prange(tiles_z*tiles_y):
+        z0 = 1+(tile//tiles_y)*block_z
+        y0 = 1+(tile%tiles_y)*block_y
+        for i in range(z0, min(z0+block_z, nz+1)):
+            for j in range(y0, min(y0+block_y, ny+1)):
+                for k in range(1, c.shape[2]-1):
+                    c_out[i, j, k] = c[i, j, k] + alpha*(c[i+1, j, k] + c[i-1, j, k] + c[i, j+1, k] + c[i, j-1, k] + 
+                                                         c[i, j, k+1] + c[i, j, k-1] - 6*c[i, j, k])
+
+#the compiled loops below call their kernel directly, rather than receiving it as an argument (as 
+#ppf_cpu_utils.simulate_compiled does), so that numba can cache them on disk: later runs load them 
+#instead of spending seconds compiling the loop at startup
+@numba.njit(cache=True)
+def explicit_diffusion_driver_1D(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        explicit_diffusion_kernel_1D(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+
+@numba.njit(cache=True)
+def explicit_diffusion_driver_2D(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        explicit_diffusion_kernel_2D(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+
+@numba.njit(cache=True)
+def explicit_diffusion_driver_3D(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        explicit_diffusion_kernel_3D(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
     
 def engine_ImplicitDiffusion1D(sim):
     """
@@ -215,13 +307,13 @@ def engine_ImplicitDiffusion1D(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d = diffusion_matrix_1d(dim[0], 1+2*alpha, -alpha)
-    c_final = np.linalg.solve(matrix1d, c.data)
-    sim.fields[0].data = c_final
+    c_final = np.linalg.solve(matrix1d, c)
+    c[...] = c_final.reshape(dim)
     
 def engine_ImplicitDiffusion1D_GMRES(sim):
     """
@@ -232,13 +324,13 @@ def engine_ImplicitDiffusion1D_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d = diffusion_matrix_1d(dim[0], 1+2*alpha, -alpha)
-    c_final, exitCode = gmres(matrix1d, c.data, atol='legacy')
-    sim.fields[0].data = c_final
+    c_final, exitCode = gmres(matrix1d, c, atol=0.)
+    c[...] = c_final.reshape(dim)
     
 def engine_ImplicitDiffusion2D(sim):
     """
@@ -248,13 +340,13 @@ def engine_ImplicitDiffusion2D(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix2d = diffusion_matrix_2d(dim[0], dim[1], 1+4*alpha, -alpha)
-    c_final = np.linalg.solve(matrix2d, c.data.flatten())
-    sim.fields[0].data = c_final.reshape(dim)
+    c_final = np.linalg.solve(matrix2d, c.flatten())
+    c[...] = c_final.reshape(dim)
     
 def engine_ImplicitDiffusion2D_GMRES(sim):
     """
@@ -265,13 +357,13 @@ def engine_ImplicitDiffusion2D_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix2d = diffusion_matrix_2d(dim[0], dim[1], 1+4*alpha, -alpha)
-    c_final, exitCode = gmres(matrix2d, c.data.flatten(), atol='legacy')
-    sim.fields[0].data = c_final.reshape(dim)
+    c_final, exitCode = gmres(matrix2d, c.flatten(), atol=0.)
+    c[...] = c_final.reshape(dim)
     
 def engine_ImplicitDiffusion3D(sim):
     """
@@ -281,13 +373,13 @@ def engine_ImplicitDiffusion3D(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix3d = diffusion_matrix_3d(dim[0], dim[1], dim[2], 1+6*alpha, -alpha)
-    c_final = np.linalg.solve(matrix3d, c.data.flatten())
-    sim.fields[0].data = c_final.reshape(dim)
+    c_final = np.linalg.solve(matrix3d, c.flatten())
+    c[...] = c_final.reshape(dim)
     
 def engine_ImplicitDiffusion3D_GMRES(sim):
     """
@@ -298,13 +390,13 @@ def engine_ImplicitDiffusion3D_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix3d = diffusion_matrix_3d(dim[0], dim[1], dim[2], 1+6*alpha, -alpha)
-    c_final, exitCode = gmres(matrix3d, c.data.flatten(), atol='legacy')
-    sim.fields[0].data = c_final.reshape(dim)
+    c_final, exitCode = gmres(matrix3d, c.flatten(), atol=0.)
+    c[...] = c_final.reshape(dim)
     
 def engine_CrankNicolsonDiffusion1D(sim):
     """
@@ -314,14 +406,14 @@ def engine_CrankNicolsonDiffusion1D(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d = diffusion_matrix_1d(dim[0], 1+2*alpha, -alpha)
-    explicit_c_half = (1-2*alpha)*c.data + alpha*(np.roll(c.data, 1, 0) + np.roll(c.data, -1, 0))
+    explicit_c_half = (1-2*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0))
     c_final = np.linalg.solve(matrix1d, explicit_c_half)
-    sim.fields[0].data = c_final
+    c[...] = c_final.reshape(dim)
     
 def engine_CrankNicolsonDiffusion1D_GMRES(sim):
     """
@@ -332,14 +424,14 @@ def engine_CrankNicolsonDiffusion1D_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d = diffusion_matrix_1d(dim[0], 1+2*alpha, -alpha)
-    explicit_c_half = (1-2*alpha)*c.data + alpha*(np.roll(c.data, 1, 0) + np.roll(c.data, -1, 0))
-    c_final, exitCode = gmres(matrix1d, explicit_c_half, atol='legacy')
-    sim.fields[0].data = c_final
+    explicit_c_half = (1-2*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0))
+    c_final, exitCode = gmres(matrix1d, explicit_c_half, atol=0.)
+    c[...] = c_final.reshape(dim)
     
 def engine_CrankNicolsonDiffusion2D(sim):
     """
@@ -348,14 +440,14 @@ def engine_CrankNicolsonDiffusion2D(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix2d = diffusion_matrix_2d(dim[0], dim[1], 1+4*alpha, -alpha)
-    explicit_c_half = (1-4*alpha)*c.data + alpha*(np.roll(c.data, 1, 0) + np.roll(c.data, -1, 0) + np.roll(c.data, 1, 1) + np.roll(c.data, -1, 1))
+    explicit_c_half = (1-4*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0) + np.roll(c, 1, 1) + np.roll(c, -1, 1))
     c_final = np.linalg.solve(matrix2d, explicit_c_half.flatten())
-    sim.fields[0].data = c_final.reshape(dim)
+    c[...] = c_final.reshape(dim)
     
 def engine_CrankNicolsonDiffusion2D_GMRES(sim):
     """
@@ -366,14 +458,14 @@ def engine_CrankNicolsonDiffusion2D_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix2d = diffusion_matrix_2d(dim[0], dim[1], 1+4*alpha, -alpha)
-    explicit_c_half = (1-4*alpha)*c.data + alpha*(np.roll(c.data, 1, 0) + np.roll(c.data, -1, 0) + np.roll(c.data, 1, 1) + np.roll(c.data, -1, 1))
-    c_final, exitCode = gmres(matrix2d, explicit_c_half.flatten(), atol='legacy')
-    sim.fields[0].data = c_final.reshape(dim)
+    explicit_c_half = (1-4*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0) + np.roll(c, 1, 1) + np.roll(c, -1, 1))
+    c_final, exitCode = gmres(matrix2d, explicit_c_half.flatten(), atol=0.)
+    c[...] = c_final.reshape(dim)
     
 def engine_CrankNicolsonDiffusion3D(sim):
     """
@@ -383,14 +475,14 @@ def engine_CrankNicolsonDiffusion3D(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix3d = diffusion_matrix_3d(dim[0], dim[1], dim[2], 1+6*alpha, -alpha)
-    explicit_c_half = (1-6*alpha)*c.data + alpha*(np.roll(c.data, 1, 0) + np.roll(c.data, -1, 0) + np.roll(c.data, 1, 1) + np.roll(c.data, -1, 1) +  + np.roll(c.data, 1, 2) + np.roll(c.data, -1, 2))
+    explicit_c_half = (1-6*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0) + np.roll(c, 1, 1) + np.roll(c, -1, 1) +  + np.roll(c, 1, 2) + np.roll(c, -1, 2))
     c_final = np.linalg.solve(matrix3d, explicit_c_half.flatten())
-    sim.fields[0].data = c_final.reshape(dim)
+    c[...] = c_final.reshape(dim)
     
 def engine_CrankNicolsonDiffusion3D_GMRES(sim):
     """
@@ -401,14 +493,14 @@ def engine_CrankNicolsonDiffusion3D_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0]
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix3d = diffusion_matrix_3d(dim[0], dim[1], dim[2], 1+6*alpha, -alpha)
-    explicit_c_half = (1-6*alpha)*c.data + alpha*(np.roll(c.data, 1, 0) + np.roll(c.data, -1, 0) + np.roll(c.data, 1, 1) + np.roll(c.data, -1, 1) +  + np.roll(c.data, 1, 2) + np.roll(c.data, -1, 2))
-    c_final, exitCode = gmres(matrix3d, explicit_c_half.flatten(), atol='legacy')
-    sim.fields[0].data = c_final.reshape(dim)
+    explicit_c_half = (1-6*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0) + np.roll(c, 1, 1) + np.roll(c, -1, 1) +  + np.roll(c, 1, 2) + np.roll(c, -1, 2))
+    c_final, exitCode = gmres(matrix3d, explicit_c_half.flatten(), atol=0.)
+    c[...] = c_final.reshape(dim)
     
 def engine_ImplicitDiffusion2D_ADI(sim):
     """
@@ -418,8 +510,8 @@ def engine_ImplicitDiffusion2D_ADI(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[1], 1+2*alpha, -alpha)
@@ -430,7 +522,6 @@ def engine_ImplicitDiffusion2D_ADI(sim):
         c[i] = np.dot(inv_x, c[i])
     for i in range(dim[1]): #then iterate through ADI method in the y direction
         c[:,i] = np.dot(inv_y, c[:,i])
-    sim.fields[0].data = c
     
 def engine_ImplicitDiffusion2D_ADI_GMRES(sim):
     """
@@ -441,17 +532,16 @@ def engine_ImplicitDiffusion2D_ADI_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[1], 1+2*alpha, -alpha)
     matrix1d_y = diffusion_matrix_1d(dim[0], 1+2*alpha, -alpha)
     for i in range(dim[0]): #iterate through ADI method in the x direction first
-        c[i], exitCode = gmres(matrix1d_x, c[i], atol='legacy')
+        c[i], exitCode = gmres(matrix1d_x, c[i], atol=0.)
     for i in range(dim[1]): #then iterate through ADI method in the y direction
-        c[:,i], exitCode = gmres(matrix1d_y, c[:,i], atol='legacy')
-    sim.fields[0].data = c
+        c[:,i], exitCode = gmres(matrix1d_y, c[:,i], atol=0.)
     
 def engine_ImplicitDiffusion3D_ADI(sim):
     """
@@ -461,8 +551,8 @@ def engine_ImplicitDiffusion3D_ADI(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[2], 1+2*alpha, -alpha)
@@ -480,7 +570,6 @@ def engine_ImplicitDiffusion3D_ADI(sim):
     for i in range(dim[1]): #finally, iterate through ADI method in the z direction
         for j in range(dim[2]):
             c[:, i, j] = np.dot(inv_z, c[:, i, j])
-    sim.fields[0].data = c
     
 def engine_ImplicitDiffusion3D_ADI_GMRES(sim):
     """
@@ -491,8 +580,8 @@ def engine_ImplicitDiffusion3D_ADI_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[2], 1+2*alpha, -alpha)
@@ -500,14 +589,13 @@ def engine_ImplicitDiffusion3D_ADI_GMRES(sim):
     matrix1d_z = diffusion_matrix_1d(dim[0], 1+2*alpha, -alpha)
     for i in range(dim[0]): #iterate through ADI method in the x direction first
         for j in range(dim[1]):
-            c[i, j], exitCode = gmres(matrix1d_x, c[i, j], atol='legacy')
+            c[i, j], exitCode = gmres(matrix1d_x, c[i, j], atol=0.)
     for i in range(dim[0]): #then iterate through ADI method in the y direction
         for j in range(dim[2]):
-            c[i, :, j], exitCode = gmres(matrix1d_y, c[i, :, j], atol='legacy')
+            c[i, :, j], exitCode = gmres(matrix1d_y, c[i, :, j], atol=0.)
     for i in range(dim[1]): #finally, iterate through ADI method in the z direction
         for j in range(dim[2]):
-            c[:, i, j], exitCode = gmres(matrix1d_z, c[:, i, j], atol='legacy')
-    sim.fields[0].data = c
+            c[:, i, j], exitCode = gmres(matrix1d_z, c[:, i, j], atol=0.)
     
 def engine_CrankNicolsonDiffusion2D_ADI(sim):
     """
@@ -520,8 +608,8 @@ def engine_CrankNicolsonDiffusion2D_ADI(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[1], 1+2*alpha, -alpha)
@@ -534,7 +622,6 @@ def engine_CrankNicolsonDiffusion2D_ADI(sim):
     c_explicit = (1-2*alpha)*c + alpha*(np.roll(c, 1, 1) + np.roll(c, -1, 1)) #explicit in y
     for i in range(dim[0]): #then iterate through ADI method in the x direction
         c[i] = np.dot(inv_x, c_explicit[i])
-    sim.fields[0].data = c
     
 def engine_CrankNicolsonDiffusion2D_ADI_GMRES(sim):
     """
@@ -548,19 +635,18 @@ def engine_CrankNicolsonDiffusion2D_ADI_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[1], 1+2*alpha, -alpha)
     matrix1d_y = diffusion_matrix_1d(dim[0], 1+2*alpha, -alpha)
     c_explicit = (1-2*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0)) #explicit in x
     for i in range(dim[1]): #iterate through ADI method in the y direction first for P-R
-        c[:,i], exitCode = gmres(matrix1d_y, c_explicit[:,i], atol='legacy')
+        c[:,i], exitCode = gmres(matrix1d_y, c_explicit[:,i], atol=0.)
     c_explicit = (1-2*alpha)*c + alpha*(np.roll(c, 1, 1) + np.roll(c, -1, 1)) #explicit in y
     for i in range(dim[0]): #then iterate through ADI method in the x direction
-        c[i], exitCode = gmres(matrix1d_x, c_explicit[i], atol='legacy')
-    sim.fields[0].data = c
+        c[i], exitCode = gmres(matrix1d_x, c_explicit[i], atol=0.)
     
 def engine_CrankNicolsonDiffusion3D_ADI(sim):
     """
@@ -574,8 +660,8 @@ def engine_CrankNicolsonDiffusion3D_ADI(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[2], 1+2*alpha, -alpha)
@@ -596,7 +682,7 @@ def engine_CrankNicolsonDiffusion3D_ADI(sim):
     for i in range(dim[0]): #finally, iterate through ADI method in the x direction
         for j in range(dim[1]):
             c[i, j] = np.dot(inv_x, c[i, j])
-    sim.fields[0].data = c
+    sim.fields[0].get_cells()[...] = c
     
 def engine_CrankNicolsonDiffusion3D_ADI_GMRES(sim):
     """
@@ -611,8 +697,8 @@ def engine_CrankNicolsonDiffusion3D_ADI_GMRES(sim):
     """
     dt = sim.dt
     dx = sim.get_cell_spacing()
-    c = sim.fields[0].data
-    D = self.user_data["D"]
+    c = sim.fields[0].get_cells()
+    D = sim.user_data["D"]
     alpha = 0.5*D*dt/dx**2
     dim = sim.get_dimensions()
     matrix1d_x = diffusion_matrix_1d(dim[2], 1+2*alpha, -alpha)
@@ -621,22 +707,69 @@ def engine_CrankNicolsonDiffusion3D_ADI_GMRES(sim):
     c = (1-2*alpha)*c + alpha*(np.roll(c, 1, 0) + np.roll(c, -1, 0)) #explicit in x
     for i in range(dim[0]): #iterate through ADI method in the y direction first in extended P-R
         for j in range(dim[2]):
-            c[i, :, j], exitCode = gmres(matrix1d_y, c[i, :, j], atol='legacy')
+            c[i, :, j], exitCode = gmres(matrix1d_y, c[i, :, j], atol=0.)
     c = (1-2*alpha)*c + alpha*(np.roll(c, 1, 1) + np.roll(c, -1, 1)) #explicit in y
     for i in range(dim[1]): #then iterate through ADI method in the z direction
         for j in range(dim[2]):
-            c[:, i, j], exitCode = gmres(matrix1d_z, c[:, i, j], atol='legacy')
+            c[:, i, j], exitCode = gmres(matrix1d_z, c[:, i, j], atol=0.)
     c = (1-2*alpha)*c + alpha*(np.roll(c, 1, 2) + np.roll(c, -1, 2)) #explicit in z
     for i in range(dim[0]): #finally, iterate through ADI method in the x direction
         for j in range(dim[1]):
-            c[i, j], exitCode = gmres(matrix1d_x, c[i, j], atol='legacy')
-    sim.fields[0].data = c     
+            c[i, j], exitCode = gmres(matrix1d_x, c[i, j], atol=0.)
+    sim.fields[0].get_cells()[...] = c
+
+#step function for each (solver, dimensions, gmres, adi) of the non-explicit solvers, see get_step_function
+_STEP_FUNCTIONS = {
+    ("implicit", 1, False, False): engine_ImplicitDiffusion1D,
+    ("implicit", 1, True, False): engine_ImplicitDiffusion1D_GMRES,
+    ("implicit", 2, False, False): engine_ImplicitDiffusion2D,
+    ("implicit", 2, True, False): engine_ImplicitDiffusion2D_GMRES,
+    ("implicit", 2, False, True): engine_ImplicitDiffusion2D_ADI,
+    ("implicit", 2, True, True): engine_ImplicitDiffusion2D_ADI_GMRES,
+    ("implicit", 3, False, False): engine_ImplicitDiffusion3D,
+    ("implicit", 3, True, False): engine_ImplicitDiffusion3D_GMRES,
+    ("implicit", 3, False, True): engine_ImplicitDiffusion3D_ADI,
+    ("implicit", 3, True, True): engine_ImplicitDiffusion3D_ADI_GMRES,
+    ("crank-nicolson", 1, False, False): engine_CrankNicolsonDiffusion1D,
+    ("crank-nicolson", 1, True, False): engine_CrankNicolsonDiffusion1D_GMRES,
+    ("crank-nicolson", 2, False, False): engine_CrankNicolsonDiffusion2D,
+    ("crank-nicolson", 2, True, False): engine_CrankNicolsonDiffusion2D_GMRES,
+    ("crank-nicolson", 2, False, True): engine_CrankNicolsonDiffusion2D_ADI,
+    ("crank-nicolson", 2, True, True): engine_CrankNicolsonDiffusion2D_ADI_GMRES,
+    ("crank-nicolson", 3, False, False): engine_CrankNicolsonDiffusion3D,
+    ("crank-nicolson", 3, True, False): engine_CrankNicolsonDiffusion3D_GMRES,
+    ("crank-nicolson", 3, False, True): engine_CrankNicolsonDiffusion3D_ADI,
+    ("crank-nicolson", 3, True, True): engine_CrankNicolsonDiffusion3D_ADI_GMRES,
+}
+
+def get_step_function(solver, dimensions, gmres, adi):
+    """
+    Returns the engine function which computes one step of the given solver ("explicit", "implicit", or 
+    "crank-nicolson") for a simulation with the given number of dimensions
+    
+    gmres and adi are ignored by the explicit solver, adi is ignored for 1D simulations
+    """
+    if(solver == "explicit"):
+        return engine_ExplicitDiffusion
+    if(dimensions == 1):
+        adi = False
+    key = (solver, dimensions, bool(gmres), bool(adi))
+    if not(key in _STEP_FUNCTIONS):
+        raise ValueError("Unknown diffusion solver: "+str(solver)+" ("+str(dimensions)+"D, gmres="+str(gmres)+", adi="+str(adi)+")")
+    return _STEP_FUNCTIONS[key]
 
 class Diffusion(Simulation):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         if not ("D" in self.user_data):
             self.user_data["D"] = 0.1
+        if not ("solver" in self.user_data):
+            self.user_data["solver"] = "explicit"
+        if not ("gmres" in self.user_data):
+            self.user_data["gmres"] = False
+        if not ("adi" in self.user_data):
+            self.user_data["adi"] = False
+        self._step_function = None #engine function run each step, set in just_before_simulating
             
     def init_fields(self):
         #initialization of fields code goes here
@@ -667,68 +800,19 @@ class Diffusion(Simulation):
         super().just_before_simulating()
         #additional code to run just before beginning the simulation goes below
         #runs immediately before simulating, no manual changes permitted to changes implemented here
+        #the solver is chosen once here, instead of comparing the solver strings every step
+        self._step_function = get_step_function(self.user_data["solver"], len(self.dimensions), self.user_data["gmres"], 
+                                                self.user_data["adi"])
+        if((self._framework == "CPU_SERIAL" or self._framework == "CPU_PARALLEL") and (self.user_data["solver"] == "explicit")):
+            #explicit steps can be run entirely in compiled code, see ppf_cpu_utils.simulate
+            kernels = [explicit_diffusion_kernel_1D, explicit_diffusion_kernel_2D, explicit_diffusion_kernel_3D]
+            self._numba_kernel = kernels[len(self.dimensions)-1]
+            drivers = [explicit_diffusion_driver_1D, explicit_diffusion_driver_2D, explicit_diffusion_driver_3D]
+            self._numba_driver = drivers[len(self.dimensions)-1]
+            params = [self.user_data["D"], self.dt, self.dx]
+            if(len(self.dimensions) == 3):
+                params += ppf_cpu_utils.stencil_block_sizes(self._field_stack.shape[1:])
+            self._numba_kernel_params = np.array(params, dtype=np.float64)
         
     def simulation_loop(self):
-        solver = self.user_data["solver"]
-        gmres = self.user_data["gmres"]
-        adi = self.user_data["adi"]
-        if (solver == "explicit"):
-            engine_ExplicitDiffusion(self)
-        elif (solver == "implicit"):
-            if(len(dim) == 1):
-                if(gmres):
-                    engine_ImplicitDiffusion1D_GMRES(self)
-                else:
-                    engine_ImplicitDiffusion1D(self)
-            elif(len(dim) == 2):
-                if(gmres):
-                    if(adi):
-                        engine_ImplicitDiffusion2D_ADI_GMRES(self)
-                    else:
-                        engine_ImplicitDiffusion2D_GMRES(self)
-                else:
-                    if(adi):
-                        engine_ImplicitDiffusion2D_ADI(self)
-                    else:
-                        engine_ImplicitDiffusion2D(self)
-            elif(len(dim) == 3):
-                if(gmres):
-                    if(adi):
-                        engine_ImplicitDiffusion3D_ADI_GMRES(self)
-                    else:
-                        engine_ImplicitDiffusion3D_GMRES(self)
-                else:
-                    if(adi):
-                        engine_ImplicitDiffusion3D_ADI(self)
-                    else:
-                        engine_ImplicitDiffusion3D(self)
-        elif (solver == "crank-nicolson"):
-            if(len(dim) == 1):
-                if(gmres):
-                    engine_CrankNicolsonDiffusion1D_GMRES(self)
-                else:
-                    engine_CrankNicolsonDiffusion1D(self)
-            elif(len(dim) == 2):
-                if(gmres):
-                    if(adi):
-                        engine_CrankNicolsonDiffusion2D_ADI_GMRES(self)
-                    else:
-                        engine_CrankNicolsonDiffusion2D_GMRES(self)
-                else:
-                    if(adi):
-                        engine_CrankNicolsonDiffusion2D_ADI(self)
-                    else:
-                        engine_CrankNicolsonDiffusion2D(self)
-            elif(len(dim) == 3):
-                if(gmres):
-                    if(adi):
-                        engine_CrankNicolsonDiffusion3D_ADI_GMRES(self)
-                    else:
-                        engine_CrankNicolsonDiffusion3D_GMRES(self)
-                else:
-                    if(adi):
-                        engine_CrankNicolsonDiffusion3D_ADI(self)
-                    else:
-                        engine_CrankNicolsonDiffusion3D(self)
-        
-    
\ No newline at end of file
+        self._step_function(self)
@@ -13,12 +13,14 @@ try:
     from ..field import Field
     from ..simulation import Simulation
     from ..ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+    from .. import ppf_gpu_utils
 except:
     try:
         #import classes from pyphasefield library
         from pyphasefield.field import Field
         from pyphasefield.simulation import Simulation
         from pyphasefield.ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+        from pyphasefield import ppf_gpu_utils
     except:
         raise ImportError("Cannot import from pyphasefield library!")
 
@@ -34,13 +36,14 @@ def divagradb(a, axp, axm, ayp, aym, b, bxp, bxm, byp, bym, idx):
 def f_ori_term(D_q, D_q_xp, D_q_xm, D_q_yp, D_q_ym, mgq_xp, mgq_xm, mgq_yp, mgq_ym, q, q_xp, q_xm, q_yp, q_ym, idx):
     return 0.5*idx*idx*((D_q+D_q_xp)*(q_xp-q)/mgq_xp - (D_q+D_q_xm)*(q-q_xm)/mgq_xm + (D_q+D_q_yp)*(q_yp-q)/mgq_yp - (D_q+D_q_ym)*(q-q_ym)/mgq_ym)
 
-@cuda.jit
-def NComponent_kernel(fields, T, transfer, fields_out, rng_states, params, c_params):
-    
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-    threadId = cuda.grid(1)
+@cuda.jit(device=True)
+def NComponent_point(fields, transfer, fields_out, rng_states, params, c_params, phi, q1, q4, T, pi, pj, i, j, threadId):
+    """
+    Computes the new values of every field for the cell (i, j)
     
+    phi, q1, q4 and T are read at (pi, pj) and its neighbors, these may be the global arrays (pi, pj = i, j) or 
+    tiles of them in shared memory. Concentrations and the transfer arrays are always read from global memory
+    """
     dx = params[0]
     d = params[1]
     v_m = params[2]
@@ -56,12 +59,6 @@ def NComponent_kernel(fields, T, transfer, fields_out, rng_states, params, c_par
     W = c_params[4]
     M = c_params[5]
     
-    phi = fields[0]
-    q1 = fields[1]
-    q4 = fields[2]
-    #c is fields 3 to k, where k equals the number of components +1. 
-    #For N components this is N-1 fields, the last one being implicitly defined
-    
     phi_out = fields_out[0]
     q1_out = fields_out[1]
     q4_out = fields_out[2]
@@ -74,177 +71,249 @@ def NComponent_kernel(fields, T, transfer, fields_out, rng_states, params, c_par
     ebar2 = 6.*math.sqrt(2.)*S[1]*d/T_M[1]
     eqbar2 = 0.25*ebar2
     
+    #interpolating functions
+    g = (phi[pi][pj]**2)*(1-phi[pi][pj])**2
+    h = (phi[pi][pj]**3)*(6.*phi[pi][pj]**2 - 15.*phi[pi][pj] + 10.)
+    hprime = 30.*g
+    gprime = 4.*phi[pi][pj]**3 - 6.*phi[pi][pj]**2 + 2*phi[pi][pj]
+    
+    #gradients
+    idx = 1./dx
+    dphidx = 0.5*(phi[pi][pj+1]-phi[pi][pj-1])*idx
+    dphidx2 = dphidx**2
+    dphidx3 = dphidx2*dphidx
+    dphidy = 0.5*(phi[pi+1][pj]-phi[pi-1][pj])*idx
+    dphidy2 = dphidy**2
+    dphidy3 = dphidy2*dphidy
+    dTdx = 0.5*idx*(T[pi][pj+1]-T[pi][pj-1])
+    dTdy = 0.5*idx*(T[pi+1][pj]-T[pi-1][pj])
+    d2phidx2 = (phi[pi][pj+1]+phi[pi][pj-1]-2.*phi[pi][pj])*idx*idx
+    d2phidy2 = (phi[pi+1][pj]+phi[pi-1][pj]-2.*phi[pi][pj])*idx*idx
+    lphi = d2phidx2 + d2phidy2
+    d2phidxy = 0.25*(phi[pi+1][pj+1]-phi[pi+1][pj-1]-phi[pi-1][pj+1]+phi[pi-1][pj-1])*idx*idx
+    mag_grad_phi2 = dphidx**2 + dphidy**2
+    if(mag_grad_phi2 < 1e-6):
+        mag_grad_phi2 = 1e-6
+    mag_grad_phi4 = mag_grad_phi2**2
+    mag_grad_phi8 = mag_grad_phi4**2
+    
+    dq1dx = 0.5*idx*(q1[pi][pj+1]-q1[pi][pj-1])
+    dq1dy = 0.5*idx*(q1[pi+1][pj]-q1[pi-1][pj])
+    dq4dx = 0.5*idx*(q4[pi][pj+1]-q4[pi][pj-1])
+    dq4dy = 0.5*idx*(q4[pi+1][pj]-q4[pi-1][pj])
+    mgq_xp = idx*math.sqrt((q1[pi][pj+1]-q1[pi][pj])**2 + (q4[pi][pj+1]-q4[pi][pj])**2)
+    mgq_xm = idx*math.sqrt((q1[pi][pj-1]-q1[pi][pj])**2 + (q4[pi][pj-1]-q4[pi][pj])**2)
+    mgq_yp = idx*math.sqrt((q1[pi+1][pj]-q1[pi][pj])**2 + (q4[pi+1][pj]-q4[pi][pj])**2)
+    mgq_ym = idx*math.sqrt((q1[pi-1][pj]-q1[pi][pj])**2 + (q4[pi-1][pj]-q4[pi][pj])**2)
+    mag_grad_q = 0.5*(mgq_xp+mgq_xm+mgq_yp+mgq_ym)
+    if(mgq_xp < beta):
+        mgq_xp = beta
+    if(mgq_xm < beta):
+        mgq_xm = beta
+    if(mgq_yp < beta):
+        mgq_yp = beta
+    if(mgq_ym < beta):
+        mgq_ym = beta
+    
+    #psi terms
+    q2q2 = (q1[pi][pj]**2 - q4[pi][pj]**2)
+    qq2 = 2.*q1[pi][pj]*q4[pi][pj]
+    psix = q2q2*dphidx - qq2*dphidy
+    psiy = qq2*dphidx + q2q2*dphidy
+    psix2 = psix**2
+    psix3 = psix2*psix
+    psix4 = psix2**2
+    psiy2 = psiy**2
+    psiy3 = psiy2*psiy
+    psiy4 = psiy2**2
+    #eta = 1. - 3.*y_e + 4.*y_e*(psix**4 + psiy**4)/mag_grad_phi4
+    dq2q2dx = (2.*q1[pi][pj]*dq1dx - 2.*q4[pi][pj]*dq4dx)
+    dqq2dx = (2.*q4[pi][pj]*dq1dx + 2.*q1[pi][pj]*dq4dx)
+    dq2q2dy = (2*q1[pi][pj]*dq1dy - 2.*q4[pi][pj]*dq4dy)
+    dqq2dy = (2.*q4[pi][pj]*dq1dy + 2.*q1[pi][pj]*dq4dy)
+    dpsixdx = dq2q2dx*dphidx + q2q2*d2phidx2 - dqq2dx*dphidy - qq2*d2phidxy
+    dpsixdy = dq2q2dy*dphidx + q2q2*d2phidxy - dqq2dy*dphidy - qq2*d2phidy2
+    dpsiydx = dq2q2dx*dphidy + q2q2*d2phidxy + dqq2dx*dphidx + qq2*d2phidx2
+    dpsiydy = dq2q2dy*dphidy + q2q2*d2phidy2 + dqq2dy*dphidx + qq2*d2phidxy
+    
+    d_term_dx = dTdx*((2.*psix3*q2q2 + 2.*psiy3*qq2)/mag_grad_phi2 - dphidx*(psix4+psiy4)/mag_grad_phi4)
+    d_term_dx += T[pi][pj]*(6.*psix2*dpsixdx*q2q2 + 2.*psix3*dq2q2dx + 6.*psiy2*dpsiydx*qq2 + 2.*psiy3*dqq2dx)/mag_grad_phi2
+    d_term_dx -= T[pi][pj]*(2.*psix3*q2q2 + 2.*psiy3*qq2)*(2.*dphidx*d2phidx2 + 2.*dphidy*d2phidxy)/mag_grad_phi4
+    d_term_dx -= T[pi][pj]*(d2phidx2*(psix4+psiy4) + dphidx*(4.*psix3*dpsixdx + 4.*psiy3*dpsiydx))/mag_grad_phi4
+    d_term_dx += T[pi][pj]*(dphidx*(psix4+psiy4)*(4.*dphidx3*d2phidx2 + 4.*dphidx*d2phidx2*dphidy2 + 4.*dphidy*d2phidxy*dphidx2 + 4.*dphidy3*d2phidxy))/mag_grad_phi8
+    d_term_dx *= (4.*y_e*ebar2)
+    
+    d_term_dy = dTdy*((-2.*psix3*qq2 + 2.*psiy3*q2q2)/mag_grad_phi2 - dphidy*(psix4+psiy4)/mag_grad_phi4)
+    d_term_dy += T[pi][pj]*(-6.*psix2*dpsixdy*qq2 - 2.*psix3*dqq2dy + 6.*psiy2*dpsiydy*q2q2 + 2.*psiy3*dq2q2dy)/mag_grad_phi2
+    d_term_dy -= T[pi][pj]*(-2.*psix3*qq2 + 2.*psiy3*q2q2)*(2.*dphidx*d2phidxy + 2.*dphidy*d2phidy2)/mag_grad_phi4
+    d_term_dy -= T[pi][pj]*(d2phidy2*(psix4+psiy4) + dphidy*(4.*psix3*dpsixdy + 4.*psiy3*dpsiydy))/mag_grad_phi4
+    d_term_dy += T[pi][pj]*(dphidy*(psix4+psiy4)*(4.*dphidx3*d2phidxy + 4.*dphidx*d2phidxy*dphidy2 + 4.*dphidy*d2phidy2*dphidx2 + 4.*dphidy3*d2phidy2))/mag_grad_phi8
+    d_term_dy *= (4.*y_e*ebar2)
+    
+    #c_N stuff
+    cW = 0.
+    c_N = 1.
+    M_phi = 0.
+    #REACHED HERE
+    for l in range(3, len(fields)):
+        c_i = fields[l][i][j]
+        cW += c_i*W[l-3]
+        c_N -= c_i
+        M_phi += c_i*M[l-3]
+    cW += c_N*W[len(fields)-3]
+    M_phi += c_N*M[len(fields)-3]
+    
+    #mobilities
+    M_q = M_qmax + (1e-6-M_qmax)*h
+    #M_phi *= eta
+    
+    #dphidt
+    dphidt = ebar2*(1.-3.*y_e)*(T[pi][pj]*lphi + dTdx*dphidx + dTdy*dphidy)
+    dphidt += d_term_dx + d_term_dy
+    dphidt -= hprime*(G_S[i][j] - G_L[i][j])/v_m
+    dphidt -= gprime*T[pi][pj]*cW
+    dphidt -= 4.*H*T[pi][pj]*phi[pi][pj]*mag_grad_q
+    dphidt *= M_phi
+    
+    #noise in phi
+    noise_phi = math.sqrt(2.*8.314*T[pi][pj]*M_phi/v_m)*cuda.random.xoroshiro128p_normal_float32(rng_states, threadId)
+    #dphidt += noise_phi
+    
+    #dcidt
+    for l in range(3, len(fields)):
+        c_i_out = fields_out[l]
+        M_c = transfer[l-1]
+        dFdci = transfer[l-1+len(fields)-3]
+        c_i_out[i][j] = (divagradb(M_c[i][j], M_c[i][j+1], M_c[i][j-1], M_c[i+1][j], M_c[i-1][j], 
+                                   dFdci[i][j], dFdci[i][j+1], dFdci[i][j-1], dFdci[i+1][j], dFdci[i-1][j], idx))
+        for m in range(3, len(fields)):
+            c_j = fields[m]
+            dFdcj = transfer[m-1+len(fields)-3]
+            c_i_out[i][j] -= divagradb(M_c[i][j]*c_j[i][j], M_c[i][j+1]*c_j[i][j+1], M_c[i][j-1]*c_j[i][j-1], 
+                                       M_c[i+1][j]*c_j[i+1][j], M_c[i-1][j]*c_j[i-1][j], 
+                                       dFdcj[i][j], dFdcj[i][j+1], dFdcj[i][j-1], dFdcj[i+1][j], dFdcj[i-1][j], idx)
+    
+    #dqdt
+    D_q = 2.*H*T[pi][pj]*(phi[pi][pj]**2)
+    D_q_xp = 2.*H*T[pi][pj+1]*(phi[pi][pj+1]**2)
+    D_q_xm = 2.*H*T[pi][pj-1]*(phi[pi][pj-1]**2)
+    D_q_yp = 2.*H*T[pi+1][pj]*(phi[pi+1][pj]**2)
+    D_q_ym = 2.*H*T[pi-1][pj]*(phi[pi-1][pj]**2)
+        
+    f_ori_1 = f_ori_term(D_q, D_q_xp, D_q_xm, D_q_yp, D_q_ym, mgq_xp, mgq_xm, mgq_yp, mgq_ym,
+                         q1[pi][pj], q1[pi][pj+1], q1[pi][pj-1], q1[pi+1][pj], q1[pi-1][pj], idx)
+    f_ori_4 = f_ori_term(D_q, D_q_xp, D_q_xm, D_q_yp, D_q_ym, mgq_xp, mgq_xm, mgq_yp, mgq_ym,
+                         q4[pi][pj], q4[pi][pj+1], q4[pi][pj-1], q4[pi+1][pj], q4[pi-1][pj], idx)
+    
+    #dfintdq1 = 16.*ebar2*T[pi][pj]*y_e/mag_grad_phi2 * (psix3*(q1[pi][pj]*dphidx - q4[pi][pj]*dphidy) + psiy3*(q4[pi][pj]*dphidx + q1[pi][pj]*dphidy))
+    #dfintdq4 = 16.*ebar2*T[pi][pj]*y_e/mag_grad_phi2 * (psix3*(-q4[pi][pj]*dphidx - q1[pi][pj]*dphidy) + psiy3*(q1[pi][pj]*dphidx - q4[pi][pj]*dphidy))
+    dfintdq1 = 0. #use these blocks to zero out twisting in quaternion fields to lower interfacial energy
+    dfintdq4 = 0.
+    
+    lq1 = (q1[pi][pj+1]+q1[pi][pj-1]+q1[pi+1][pj]+q1[pi-1][pj]-4*q1[pi][pj])*idx*idx
+    lq4 = (q4[pi][pj+1]+q4[pi][pj-1]+q4[pi+1][pj]+q4[pi-1][pj]-4*q4[pi][pj])*idx*idx
+    
+    #noise_q1 = math.sqrt(8.314*T[pi][pj]/v_m)*cuda.random.xoroshiro128p_normal_float32(rng_states, threadId)
+    #noise_q4 = math.sqrt(8.314*T[pi][pj]/v_m)*cuda.random.xoroshiro128p_normal_float32(rng_states, threadId)
+    noise_q1 = 0.
+    noise_q4 = 0.
+    
+    dq1dt = M_q*((1-q1[pi][pj]**2)*(f_ori_1+lq1*eqbar2-dfintdq1+noise_q1) - q1[pi][pj]*q4[pi][pj]*(f_ori_4+lq4*eqbar2-dfintdq4+noise_q4))
+    dq4dt = M_q*((1-q4[pi][pj]**2)*(f_ori_4+lq4*eqbar2-dfintdq4+noise_q4) - q1[pi][pj]*q4[pi][pj]*(f_ori_1+lq1*eqbar2-dfintdq1+noise_q1))
+    phi_out[i][j] = phi[pi][pj] + dt*dphidt
+    if(phi_out[i][j] < 0.000001):
+        phi_out[i][j] = 0.000001
+    if(phi_out[i][j] > 0.999999):
+        phi_out[i][j] = 0.999999
+    q1_out[i][j] = q1[pi][pj] + dt*dq1dt
+    q4_out[i][j] = q4[pi][pj] + dt*dq4dt
+    renorm = math.sqrt((q1_out[i][j]**2+q4_out[i][j]**2))
+    q1_out[i][j] = q1_out[i][j]/renorm
+    q4_out[i][j] = q4_out[i][j]/renorm
+    for l in range(3, len(fields)):
+        c_i = fields[l]
+        c_i_out = fields_out[l]
+        c_i_out[i][j] *= dt
+        c_i_out[i][j] += c_i[i][j]
+
+@cuda.jit(cache=True)
+def NComponent_kernel(fields, T, transfer, fields_out, rng_states, params, c_params):
+    
+    startx, starty = cuda.grid(2)
+    stridex, stridey = cuda.gridsize(2)
+    threadId = cuda.grid(1)
+    
+    phi = fields[0]
+    q1 = fields[1]
+    q4 = fields[2]
+    #c is fields 3 to k, where k equals the number of components +1. 
+    #For N components this is N-1 fields, the last one being implicitly defined
+    
     for i in range(starty+1, phi.shape[0]-1, stridey):
         for j in range(startx+1, phi.shape[1]-1, stridex):
-            #interpolating functions
-            g = (phi[i][j]**2)*(1-phi[i][j])**2
-            h = (phi[i][j]**3)*(6.*phi[i][j]**2 - 15.*phi[i][j] + 10.)
-            hprime = 30.*g
-            gprime = 4.*phi[i][j]**3 - 6.*phi[i][j]**2 + 2*phi[i][j]
-            
-            #gradients
-            idx = 1./dx
-            dphidx = 0.5*(phi[i][j+1]-phi[i][j-1])*idx
-            dphidx2 = dphidx**2
-            dphidx3 = dphidx2*dphidx
-            dphidy = 0.5*(phi[i+1][j]-phi[i-1][j])*idx
-            dphidy2 = dphidy**2
-            dphidy3 = dphidy2*dphidy
-            dTdx = 0.5*idx*(T[i][j+1]-T[i][j-1])
-            dTdy = 0.5*idx*(T[i+1][j]-T[i-1][j])
-            d2phidx2 = (phi[i][j+1]+phi[i][j-1]-2.*phi[i][j])*idx*idx
-            d2phidy2 = (phi[i+1][j]+phi[i-1][j]-2.*phi[i][j])*idx*idx
-            lphi = d2phidx2 + d2phidy2
-            d2phidxy = 0.25*(phi[i+1][j+1]-phi[i+1][j-1]-phi[i-1][j+1]+phi[i-1][j-1])*idx*idx
-            mag_grad_phi2 = dphidx**2 + dphidy**2
-            if(mag_grad_phi2 < 1e-6):
-                mag_grad_phi2 = 1e-6
-            mag_grad_phi4 = mag_grad_phi2**2
-            mag_grad_phi8 = mag_grad_phi4**2
-            
-            dq1dx = 0.5*idx*(q1[i][j+1]-q1[i][j-1])
-            dq1dy = 0.5*idx*(q1[i+1][j]-q1[i-1][j])
-            dq4dx = 0.5*idx*(q4[i][j+1]-q4[i][j-1])
-            dq4dy = 0.5*idx*(q4[i+1][j]-q4[i-1][j])
-            mgq_xp = idx*math.sqrt((q1[i][j+1]-q1[i][j])**2 + (q4[i][j+1]-q4[i][j])**2)
-            mgq_xm = idx*math.sqrt((q1[i][j-1]-q1[i][j])**2 + (q4[i][j-1]-q4[i][j])**2)
-            mgq_yp = idx*math.sqrt((q1[i+1][j]-q1[i][j])**2 + (q4[i+1][j]-q4[i][j])**2)
-            mgq_ym = idx*math.sqrt((q1[i-1][j]-q1[i][j])**2 + (q4[i-1][j]-q4[i][j])**2)
-            mag_grad_q = 0.5*(mgq_xp+mgq_xm+mgq_yp+mgq_ym)
-            if(mgq_xp < beta):
-                mgq_xp = beta
-            if(mgq_xm < beta):
-                mgq_xm = beta
-            if(mgq_yp < beta):
-                mgq_yp = beta
-            if(mgq_ym < beta):
-                mgq_ym = beta
-            
-            #psi terms
-            q2q2 = (q1[i][j]**2 - q4[i][j]**2)
-            qq2 = 2.*q1[i][j]*q4[i][j]
-            psix = q2q2*dphidx - qq2*dphidy
-            psiy = qq2*dphidx + q2q2*dphidy
-            psix2 = psix**2
-            psix3 = psix2*psix
-            psix4 = psix2**2
-            psiy2 = psiy**2
-            psiy3 = psiy2*psiy
-            psiy4 = psiy2**2
-            #eta = 1. - 3.*y_e + 4.*y_e*(psix**4 + psiy**4)/mag_grad_phi4
-            dq2q2dx = (2.*q1[i][j]*dq1dx - 2.*q4[i][j]*dq4dx)
-            dqq2dx = (2.*q4[i][j]*dq1dx + 2.*q1[i][j]*dq4dx)
-            dq2q2dy = (2*q1[i][j]*dq1dy - 2.*q4[i][j]*dq4dy)
-            dqq2dy = (2.*q4[i][j]*dq1dy + 2.*q1[i][j]*dq4dy)
-            dpsixdx = dq2q2dx*dphidx + q2q2*d2phidx2 - dqq2dx*dphidy - qq2*d2phidxy
-            dpsixdy = dq2q2dy*dphidx + q2q2*d2phidxy - dqq2dy*dphidy - qq2*d2phidy2
-            dpsiydx = dq2q2dx*dphidy + q2q2*d2phidxy + dqq2dx*dphidx + qq2*d2phidx2
-            dpsiydy = dq2q2dy*dphidy + q2q2*d2phidy2 + dqq2dy*dphidx + qq2*d2phidxy
-            
-            d_term_dx = dTdx*((2.*psix3*q2q2 + 2.*psiy3*qq2)/mag_grad_phi2 - dphidx*(psix4+psiy4)/mag_grad_phi4)
-            d_term_dx += T[i][j]*(6.*psix2*dpsixdx*q2q2 + 2.*psix3*dq2q2dx + 6.*psiy2*dpsiydx*qq2 + 2.*psiy3*dqq2dx)/mag_grad_phi2
-            d_term_dx -= T[i][j]*(2.*psix3*q2q2 + 2.*psiy3*qq2)*(2.*dphidx*d2phidx2 + 2.*dphidy*d2phidxy)/mag_grad_phi4
-            d_term_dx -= T[i][j]*(d2phidx2*(psix4+psiy4) + dphidx*(4.*psix3*dpsixdx + 4.*psiy3*dpsiydx))/mag_grad_phi4
-            d_term_dx += T[i][j]*(dphidx*(psix4+psiy4)*(4.*dphidx3*d2phidx2 + 4.*dphidx*d2phidx2*dphidy2 + 4.*dphidy*d2phidxy*dphidx2 + 4.*dphidy3*d2phidxy))/mag_grad_phi8
-            d_term_dx *= (4.*y_e*ebar2)
-            
-            d_term_dy = dTdy*((-2.*psix3*qq2 + 2.*psiy3*q2q2)/mag_grad_phi2 - dphidy*(psix4+psiy4)/mag_grad_phi4)
-            d_term_dy += T[i][j]*(-6.*psix2*dpsixdy*qq2 - 2.*psix3*dqq2dy + 6.*psiy2*dpsiydy*q2q2 + 2.*psiy3*dq2q2dy)/mag_grad_phi2
-            d_term_dy -= T[i][j]*(-2.*psix3*qq2 + 2.*psiy3*q2q2)*(2.*dphidx*d2phidxy + 2.*dphidy*d2phidy2)/mag_grad_phi4
-            d_term_dy -= T[i][j]*(d2phidy2*(psix4+psiy4) + dphidy*(4.*psix3*dpsixdy + 4.*psiy3*dpsiydy))/mag_grad_phi4
-            d_term_dy += T[i][j]*(dphidy*(psix4+psiy4)*(4.*dphidx3*d2phidxy + 4.*dphidx*d2phidxy*dphidy2 + 4.*dphidy*d2phidy2*dphidx2 + 4.*dphidy3*d2phidy2))/mag_grad_phi8
-            d_term_dy *= (4.*y_e*ebar2)
-            
-            #c_N stuff
-            cW = 0.
-            c_N = 1.
-            M_phi = 0.
-            #REACHED HERE
-            for l in range(3, len(fields)):
-                c_i = fields[l][i][j]
-                cW += c_i*W[l-3]
-                c_N -= c_i
-                M_phi += c_i*M[l-3]
-            cW += c_N*W[len(fields)-3]
-            M_phi += c_N*M[len(fields)-3]
-            
-            #mobilities
-            M_q = M_qmax + (1e-6-M_qmax)*h
-            #M_phi *= eta
-            
-            #dphidt
-            dphidt = ebar2*(1.-3.*y_e)*(T[i][j]*lphi + dTdx*dphidx + dTdy*dphidy)
-            dphidt += d_term_dx + d_term_dy
-            dphidt -= hprime*(G_S[i][j] - G_L[i][j])/v_m
-            dphidt -= gprime*T[i][j]*cW
-            dphidt -= 4.*H*T[i][j]*phi[i][j]*mag_grad_q
-            dphidt *= M_phi
-            
-            #noise in phi
-            noise_phi = math.sqrt(2.*8.314*T[i][j]*M_phi/v_m)*cuda.random.xoroshiro128p_normal_float32(rng_states, threadId)
-            #dphidt += noise_phi
-            
-            #dcidt
-            for l in range(3, len(fields)):
-                c_i_out = fields_out[l]
-                M_c = transfer[l-1]
-                dFdci = transfer[l-1+len(fields)-3]
-                c_i_out[i][j] = (divagradb(M_c[i][j], M_c[i][j+1], M_c[i][j-1], M_c[i+1][j], M_c[i-1][j], 
-                                           dFdci[i][j], dFdci[i][j+1], dFdci[i][j-1], dFdci[i+1][j], dFdci[i-1][j], idx))
-                for m in range(3, len(fields)):
-                    c_j = fields[m]
-                    dFdcj = transfer[m-1+len(fields)-3]
-                    c_i_out[i][j] -= divagradb(M_c[i][j]*c_j[i][j], M_c[i][j+1]*c_j[i][j+1], M_c[i][j-1]*c_j[i][j-1], 
-                                               M_c[i+1][j]*c_j[i+1][j], M_c[i-1][j]*c_j[i-1][j], 
-                                               dFdcj[i][j], dFdcj[i][j+1], dFdcj[i][j-1], dFdcj[i+1][j], dFdcj[i-1][j], idx)
-            
-            #dqdt
-            D_q = 2.*H*T[i][j]*(phi[i][j]**2)
-            D_q_xp = 2.*H*T[i][j+1]*(phi[i][j+1]**2)
-            D_q_xm = 2.*H*T[i][j-1]*(phi[i][j-1]**2)
-            D_q_yp = 2.*H*T[i+1][j]*(phi[i+1][j]**2)
-            D_q_ym = 2.*H*T[i-1][j]*(phi[i-1][j]**2)
-                
-            f_ori_1 = f_ori_term(D_q, D_q_xp, D_q_xm, D_q_yp, D_q_ym, mgq_xp, mgq_xm, mgq_yp, mgq_ym,
-                                 q1[i][j], q1[i][j+1], q1[i][j-1], q1[i+1][j], q1[i-1][j], idx)
-            f_ori_4 = f_ori_term(D_q, D_q_xp, D_q_xm, D_q_yp, D_q_ym, mgq_xp, mgq_xm, mgq_yp, mgq_ym,
-                                 q4[i][j], q4[i][j+1], q4[i][j-1], q4[i+1][j], q4[i-1][j], idx)
-            
-            #dfintdq1 = 16.*ebar2*T[i][j]*y_e/mag_grad_phi2 * (psix3*(q1[i][j]*dphidx - q4[i][j]*dphidy) + psiy3*(q4[i][j]*dphidx + q1[i][j]*dphidy))
-            #dfintdq4 = 16.*ebar2*T[i][j]*y_e/mag_grad_phi2 * (psix3*(-q4[i][j]*dphidx - q1[i][j]*dphidy) + psiy3*(q1[i][j]*dphidx - q4[i][j]*dphidy))
-            dfintdq1 = 0. #use these blocks to zero out twisting in quaternion fields to lower interfacial energy
-            dfintdq4 = 0.
-            
-            lq1 = (q1[i][j+1]+q1[i][j-1]+q1[i+1][j]+q1[i-1][j]-4*q1[i][j])*idx*idx
-            lq4 = (q4[i][j+1]+q4[i][j-1]+q4[i+1][j]+q4[i-1][j]-4*q4[i][j])*idx*idx
-            
-            #noise_q1 = math.sqrt(8.314*T[i][j]/v_m)*cuda.random.xoroshiro128p_normal_float32(rng_states, threadId)
-            #noise_q4 = math.sqrt(8.314*T[i][j]/v_m)*cuda.random.xoroshiro128p_normal_float32(rng_states, threadId)
-            noise_q1 = 0.
-            noise_q4 = 0.
-            
-            dq1dt = M_q*((1-q1[i][j]**2)*(f_ori_1+lq1*eqbar2-dfintdq1+noise_q1) - q1[i][j]*q4[i][j]*(f_ori_4+lq4*eqbar2-dfintdq4+noise_q4))
-            dq4dt = M_q*((1-q4[i][j]**2)*(f_ori_4+lq4*eqbar2-dfintdq4+noise_q4) - q1[i][j]*q4[i][j]*(f_ori_1+lq1*eqbar2-dfintdq1+noise_q1))
-            phi_out[i][j] = phi[i][j] + dt*dphidt
-            if(phi_out[i][j] < 0.000001):
-                phi_out[i][j] = 0.000001
-            if(phi_out[i][j] > 0.999999):
-                phi_out[i][j] = 0.999999
-            q1_out[i][j] = q1[i][j] + dt*dq1dt
-            q4_out[i][j] = q4[i][j] + dt*dq4dt
-            renorm = math.sqrt((q1_out[i][j]**2+q4_out[i][j]**2))
-            q1_out[i][j] = q1_out[i][j]/renorm
-            q4_out[i][j] = q4_out[i][j]/renorm
-            for l in range(3, len(fields)):
-                c_i = fields[l]
-                c_i_out = fields_out[l]
-                c_i_out[i][j] *= dt
-                c_i_out[i][j] += c_i[i][j]
+            NComponent_point(fields, transfer, fields_out, rng_states, params, c_params, phi, q1, q4, T, i, j, i, j, threadId)
+
+#width of the square tiles used by NComponent_tiled_kernel, which must be launched with (TILE_SIZE, TILE_SIZE) threads per block
+TILE_SIZE = 16
+_TILE_SIZE_HALO = TILE_SIZE+2
+
+@cuda.jit(cache=True)
+def NComponent_tiled_kernel(fields, T, transfer, fields_out, rng_states, params, c_params):
+    """
+    Same as NComponent_kernel, but each block first copies a tile of phi, q1, q4 and T (plus a one cell halo) 
+    into shared memory, so the ~60 neighbor reads of these arrays per cell are served from shared memory 
+    rather than global memory. Blocks stride over the tiles, so any number of blocks per grid may be used
+    """
+    tx = cuda.threadIdx.x
+    ty = cuda.threadIdx.y
+    threadId = cuda.grid(1)
+    
+    phi = fields[0]
+    q1 = fields[1]
+    q4 = fields[2]
+    s_phi = cuda.shared.array((_TILE_SIZE_HALO, _TILE_SIZE_HALO), numba.float64)
+    s_q1 = cuda.shared.array((_TILE_SIZE_HALO, _TILE_SIZE_HALO), numba.float64)
+    s_q4 = cuda.shared.array((_TILE_SIZE_HALO, _TILE_SIZE_HALO), numba.float64)
+    s_T = cuda.shared.array((_TILE_SIZE_HALO, _TILE_SIZE_HALO), numba.float64)
+    
+    tiles_y = (phi.shape[0]-2+TILE_SIZE-1)//TILE_SIZE
+    tiles_x = (phi.shape[1]-2+TILE_SIZE-1)//TILE_SIZE
+    for tile_y in range(cuda.blockIdx.y, tiles_y, cuda.gridDim.y):
+        for tile_x in range(cuda.blockIdx.x, tiles_x, cuda.gridDim.x):
+            #cell (0, 0) of the tile is the boundary/neighboring cell to the upper left of the tile itself
+            i0 = tile_y*TILE_SIZE
+            j0 = tile_x*TILE_SIZE
+            #every thread of the block loads cells of the (tile + halo), the boundary cells of the arrays already 
+            #hold the values from the boundary conditions (periodic or otherwise), so no wrapping is needed
+            for k in range(ty*TILE_SIZE+tx, _TILE_SIZE_HALO*_TILE_SIZE_HALO, TILE_SIZE*TILE_SIZE):
+                a = k // _TILE_SIZE_HALO
+                b = k % _TILE_SIZE_HALO
+                if((i0+a < phi.shape[0]) and (j0+b < phi.shape[1])):
+                    s_phi[a, b] = phi[i0+a, j0+b]
+                    s_q1[a, b] = q1[i0+a, j0+b]
+                    s_q4[a, b] = q4[i0+a, j0+b]
+                    s_T[a, b] = T[i0+a, j0+b]
+            cuda.syncthreads()
+            i = i0+ty+1
+            j = j0+tx+1
+            if((i < phi.shape[0]-1) and (j < phi.shape[1]-1)):
+                NComponent_point(fields, transfer, fields_out, rng_states, params, c_params, s_phi, s_q1, s_q4, s_T, 
+                                 ty+1, tx+1, i, j, threadId)
+            #the tile must not be overwritten by the next one until every thread is done with it
+            cuda.syncthreads()
 
-@numba.jit
-def get_thermodynamics(ufunc, array):
-    return ufunc(array)
+def NComponent_kernel_2D(threads):
+    """Returns the kernel used for 2D simulations launched with the given threads per block"""
+    #the tiled kernel needs one thread per cell of its tiles
+    if(tuple(threads) == (TILE_SIZE, TILE_SIZE)):
+        return NComponent_tiled_kernel
+    return NComponent_kernel
+
+#block shapes tried for 2D simulations when user_data["cuda_threads_per_block"] is None
+AUTOTUNE_THREADS_PER_BLOCK_2D = [(16, 16), (32, 8), (8, 32), (32, 16)]
             
+#not cached: ufunc_g_l and ufunc_g_s are the functions generated from the TDB file of the simulation, a cached 
+#kernel could call the functions of a different TDB file. The other kernels are cached on disk
 @cuda.jit
 def NComponent_helper_kernel(fields, T, transfer, rng_states, ufunc_array, params, c_params):
     #initializes certain arrays that are used in div-grad terms, to avoid recomputing terms 4 or 6 times
@@ -281,13 +350,13 @@ def NComponent_helper_kernel(fields, T, transfer, rng_states, ufunc_array, param
             ufunc_array[i][j][len(fields)-3] = c_N
             ufunc_array[i][j][len(fields)-2] = T[i][j]
             #dGdc = numba.cuda.local.array((2,1), numba.float64)
-            G_L[i][j] = get_thermodynamics(ufunc_g_l, ufunc_array[i][j])
-            G_S[i][j] = get_thermodynamics(ufunc_g_s, ufunc_array[i][j])
+            G_L[i][j] = ufunc_g_l(ufunc_array[i][j])
+            G_S[i][j] = ufunc_g_s(ufunc_array[i][j])
             
             ufunc_array[i][j][len(fields)-3] -= 0.0000001
             ufunc_array[i][j][0] += 0.0000001
-            dGLdc = 10000000.*(get_thermodynamics(ufunc_g_l, ufunc_array[i][j]) - G_L[i][j])
-            dGSdc = 10000000.*(get_thermodynamics(ufunc_g_s, ufunc_array[i][j]) - G_S[i][j])
+            dGLdc = 10000000.*(ufunc_g_l(ufunc_array[i][j]) - G_L[i][j])
+            dGSdc = 10000000.*(ufunc_g_s(ufunc_array[i][j]) - G_S[i][j])
             
             g = (phi[i][j]**2)*(1-phi[i][j])**2
             h = (phi[i][j]**3)*(6.*phi[i][j]**2 - 15.*phi[i][j] + 10.)
@@ -331,7 +400,22 @@ class NCGPU(Simulation):
         super().__init__(**kwargs)
         self.uses_gpu = True
         self._framework = "GPU_SERIAL" #must be this framework for this engine
-        self.user_data["d_ratio"] = 4. #default value
+        if not ("d_ratio" in self.user_data):
+            self.user_data["d_ratio"] = 4.
+        if not ("precision" in self.user_data):
+            self.user_data["precision"] = "fp64"
+        if not ("cuda_threads_per_block" in self.user_data):
+            #None: the default block of the simulation's dimensionality, "auto": benchmark for the fastest block shape (2D only)
+            self.user_data["cuda_threads_per_block"] = None
+        if not (self.user_data["precision"] in ("fp64", "mixed", "fp32")):
+            raise ValueError("Unknown precision \""+str(self.user_data["precision"])+"\", must be \"fp64\", \"mixed\", or \"fp32\"")
+        threads = self.user_data["cuda_threads_per_block"]
+        if not(threads is None or (isinstance(threads, str) and threads == "auto")):
+            threads = np.atleast_1d(threads)
+            #no CUDA device allows more than 1024 threads per block, smaller device limits are applied when simulating
+            if not(threads.ndim == 1 and threads.dtype.kind in "iu" and np.all(threads > 0) and np.prod(threads) <= 1024):
+                raise ValueError("cuda_threads_per_block must be \"auto\" or positive integers whose product is at most 1024, not "+
+                                 str(self.user_data["cuda_threads_per_block"]))
         
     def init_tdb_params(self):
         super().init_tdb_params()
@@ -406,13 +490,11 @@ class NCGPU(Simulation):
                     initial_concentration_array = self.user_data["initial_concentration_array"]
                     assert((len(initial_concentration_array)+1) == len(self._tdb_components))
                     for i in range(len(initial_concentration_array)):
-                        c_n = np.zeros(dim)
-                        c_n += initial_concentration_array[i]
+                        c_n = np.full(dim, initial_concentration_array[i], dtype=np.float64)
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
                 except: #initial_concentration array isnt defined?
                     for i in range(len(self._tdb_components)-1):
-                        c_n = np.zeros(dim)
-                        c_n += 1./len(self._tdb_components)
+                        c_n = np.full(dim, 1./len(self._tdb_components))
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
             elif(sim_type=="seeds"):
                 #initialize phi, q1, q4
@@ -439,13 +521,11 @@ class NCGPU(Simulation):
                     initial_concentration_array = self.user_data["initial_concentration_array"]
                     assert((len(initial_concentration_array)+1) == len(self._tdb_components))
                     for i in range(len(initial_concentration_array)):
-                        c_n = np.zeros(dim)
-                        c_n += initial_concentration_array[i]
+                        c_n = np.full(dim, initial_concentration_array[i], dtype=np.float64)
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
                 except: #initial_concentration array isnt defined?
                     for i in range(len(self._tdb_components)-1):
-                        c_n = np.zeros(dim)
-                        c_n += 1./len(self._tdb_components)
+                        c_n = np.full(dim, 1./len(self._tdb_components))
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
         
         except:
@@ -464,16 +544,17 @@ class NCGPU(Simulation):
                 initial_concentration_array = self.user_data["initial_concentration_array"]
                 assert((len(initial_concentration_array)+1) == len(self._tdb_components))
                 for i in range(len(initial_concentration_array)):
-                    c_n = np.zeros(dim)
-                    c_n += initial_concentration_array[i]
+                    c_n = np.full(dim, initial_concentration_array[i], dtype=np.float64)
                     self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
             except: #initial_concentration array isnt defined?
                 for i in range(len(self._tdb_components)-1):
-                    c_n = np.zeros(dim)
-                    c_n += 1./len(self._tdb_components)
+                    c_n = np.full(dim, 1./len(self._tdb_components))
                     self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
                         
     def just_before_simulating(self):
+        self._set_gpu_precision(self.user_data["precision"])
+        #kernels run on a stream of their own, so copies back to the host (checkpoints, flush_async) overlap with them
+        ppf_gpu_utils.create_streams(self)
         super().just_before_simulating()
         params = []
         c_params = []
@@ -495,39 +576,101 @@ class NCGPU(Simulation):
         c_params.append(self.user_data["M"])
         self.user_data["params"] = np.array(params)
         self.user_data["c_params"] = np.array(c_params)
+        #copied once, passing host arrays to a kernel copies them to the GPU (and back) on every launch
+        self.user_data["params_gpu_device"] = cuda.to_device(self.user_data["params"])
+        self.user_data["c_params_gpu_device"] = cuda.to_device(self.user_data["c_params"])
+        threads = self.user_data["cuda_threads_per_block"]
+        if(isinstance(threads, str)): #"auto"
+            if(len(self.dimensions) == 2):
+                self._gpu_threads_per_block_2D = self._autotune_threads_per_block_2D()
+        elif not(threads is None):
+            threads = ppf_gpu_utils.clamp_threads_per_block(threads)
+            if(len(self.dimensions) == 1):
+                self._gpu_threads_per_block_1D = threads
+            elif(len(self.dimensions) == 2):
+                self._gpu_threads_per_block_2D = threads
+            elif(len(self.dimensions) == 3):
+                self._gpu_threads_per_block_3D = threads
+        
+    def _autotune_threads_per_block_2D(self):
+        """
+        Times the main 2D kernel for each shape in AUTOTUNE_THREADS_PER_BLOCK_2D and returns the fastest, 
+        see ppf_gpu_utils.autotune_threads_per_block. The benchmark writes to scratch copies of the output 
+        fields and random states, so the simulation itself is unaffected
+        """
+        fields_out = cuda.device_array_like(self._fields_out_gpu_device)
+        rng_states = cuda.to_device(self.user_data["rng_states"].copy_to_host())
+        params = self.user_data["params_gpu_device"]
+        c_params = self.user_data["c_params_gpu_device"]
+        #fill the transfer arrays first, so the benchmark sees the same values as the first timestep
+        NComponent_helper_kernel[self._gpu_blocks_per_grid_2D, self._gpu_threads_per_block_2D](self._fields_gpu_device, 
+                                                                  self._temperature_gpu_device, self._fields_transfer_gpu_device, 
+                                                                  rng_states, self._tdb_ufunc_gpu_device, params, c_params)
+        def launch(threads):
+            NComponent_kernel_2D(threads)[self._gpu_blocks_per_grid_2D, threads](self._fields_gpu_device, 
+                                                                  self._temperature_gpu_device, self._fields_transfer_gpu_device, 
+                                                                  fields_out, rng_states, params, c_params)
+        key = "NCGPU "+str(list(self.dimensions))+" "+str(self.user_data["precision"])
+        return ppf_gpu_utils.autotune_threads_per_block(launch, AUTOTUNE_THREADS_PER_BLOCK_2D, key)
+        
+    def _set_gpu_precision(self, precision):
+        """
+        Chooses the storage type of the arrays on the GPU:
+        
+        "fp64": every array is float64
+        "mixed": phi, q1, q4 and the concentrations are float32, the transfer arrays (free energies, mobilities and 
+            their derivatives) stay float64
+        "fp32": fields and transfer arrays are float32
+        
+        In every case the kernels compute in float64: values are widened when read (the kernels' constants are 
+        float64), and only rounded to float32 when stored. The thermal field stays float64, and fields retrieved 
+        from the GPU are widened back into the float64 host arrays, so any reductions over them (e.g. checks of 
+        mass conservation) run in float64
+        """
+        if(precision == "fp64"):
+            self._gpu_fields_dtype = np.float64
+            self._gpu_transfer_dtype = np.float64
+        elif(precision == "mixed"):
+            self._gpu_fields_dtype = np.float32
+            self._gpu_transfer_dtype = np.float64
+        elif(precision == "fp32"):
+            self._gpu_fields_dtype = np.float32
+            self._gpu_transfer_dtype = np.float32
+        else:
+            raise ValueError("Unknown precision \""+str(precision)+"\", must be \"fp64\", \"mixed\", or \"fp32\"")
         
     def simulation_loop(self):
-        cuda.synchronize()
+        #kernels on the same stream run in order, so no synchronization is needed between them
+        stream = ppf_gpu_utils.compute_stream(self)
+        params = self.user_data["params_gpu_device"]
+        c_params = self.user_data["c_params_gpu_device"]
+        ppf_gpu_utils.wait_for_copies_from_GPU(self, self._fields_out_gpu_device)
         if(len(self.dimensions) == 1):
-            NComponent_helper_kernel[self._gpu_blocks_per_grid_1D, self._gpu_threads_per_block_1D](self._fields_gpu_device, 
+            NComponent_helper_kernel[self._gpu_blocks_per_grid_1D, self._gpu_threads_per_block_1D, stream](self._fields_gpu_device, 
                                                                       self._temperature_gpu_device, self._fields_transfer_gpu_device, 
                                                                       self.user_data["rng_states"], self._tdb_ufunc_gpu_device, 
-                                                                      self.user_data["params"], self.user_data["c_params"])
-            cuda.synchronize()
-            NComponent_kernel[self._gpu_blocks_per_grid_1D, self._gpu_threads_per_block_1D](self._fields_gpu_device, 
+                                                                      params, c_params)
+            NComponent_kernel[self._gpu_blocks_per_grid_1D, self._gpu_threads_per_block_1D, stream](self._fields_gpu_device, 
                                                                       self._temperature_gpu_device, self._fields_transfer_gpu_device, 
                                                                       self._fields_out_gpu_device, self.user_data["rng_states"], 
-                                                                      self.user_data["params"], self.user_data["c_params"])
+                                                                      params, c_params)
         elif(len(self.dimensions) == 2):
-            NComponent_helper_kernel[self._gpu_blocks_per_grid_2D, self._gpu_threads_per_block_2D](self._fields_gpu_device, 
+            NComponent_helper_kernel[self._gpu_blocks_per_grid_2D, self._gpu_threads_per_block_2D, stream](self._fields_gpu_device, 
                                                                       self._temperature_gpu_device, self._fields_transfer_gpu_device, 
                                                                       self.user_data["rng_states"], self._tdb_ufunc_gpu_device, 
-                                                                      self.user_data["params"], self.user_data["c_params"])
-            cuda.synchronize()
-            NComponent_kernel[self._gpu_blocks_per_grid_2D, self._gpu_threads_per_block_2D](self._fields_gpu_device, 
+                                                                      params, c_params)
+            NComponent_kernel_2D(self._gpu_threads_per_block_2D)[self._gpu_blocks_per_grid_2D, self._gpu_threads_per_block_2D, stream](self._fields_gpu_device, 
                                                                       self._temperature_gpu_device, self._fields_transfer_gpu_device, 
                                                                       self._fields_out_gpu_device, self.user_data["rng_states"], 
-                                                                      self.user_data["params"], self.user_data["c_params"])
+                                                                      params, c_params)
         elif(len(self.dimensions) == 3):
-            NComponent_helper_kernel[self._gpu_blocks_per_grid_3D, self._gpu_threads_per_block_3D](self._fields_gpu_device, 
+            NComponent_helper_kernel[self._gpu_blocks_per_grid_3D, self._gpu_threads_per_block_3D, stream](self._fields_gpu_device, 
                                                                       self._temperature_gpu_device, self._fields_transfer_gpu_device, 
                                                                       self.user_data["rng_states"], self._tdb_ufunc_gpu_device, 
-                                                                      self.user_data["params"], self.user_data["c_params"])
-            cuda.synchronize()
-            NComponent_kernel[self._gpu_blocks_per_grid_3D, self._gpu_threads_per_block_3D](self._fields_gpu_device, 
+                                                                      params, c_params)
+            NComponent_kernel[self._gpu_blocks_per_grid_3D, self._gpu_threads_per_block_3D, stream](self._fields_gpu_device, 
                                                                       self._temperature_gpu_device, self._fields_transfer_gpu_device, 
                                                                       self._fields_out_gpu_device, self.user_data["rng_states"], 
-                                                                      self.user_data["params"], self.user_data["c_params"])
-        cuda.synchronize()
+                                                                      params, c_params)
         self._fields_gpu_device, self._fields_out_gpu_device = self._fields_out_gpu_device, self._fields_gpu_device
         
\ No newline at end of file
@@ -249,9 +249,6 @@ def NComponent_kernel(fields, T, transfer, fields_out, rng_states, params, c_par
                 c_i_out[i][j] += c_i[i][j]
                 #c_i_out[i][j] = max(0, c_i_out[i][j])
                 
-@numba.jit
-def get_thermodynamics(ufunc, array):
-    return ufunc(array)
             
 @cuda.jit
 def NComponent_helper_kernel(fields, T, transfer, rng_states, ufunc_array, params, c_params):
@@ -292,8 +289,8 @@ def NComponent_helper_kernel(fields, T, transfer, rng_states, ufunc_array, param
             ufunc_array[i][j][len(fields)-2] = T[i][j]
             #dGdc = numba.cuda.local.array((2,1), numba.float64)
             #NEEDS FIXING vvvvvvvvvv
-            G_L[i][j] = get_thermodynamics(ufunc_g_l, ufunc_array[i][j])
-            G_S[i][j] = get_thermodynamics(ufunc_g_s, ufunc_array[i][j])
+            G_L[i][j] = ufunc_g_l(ufunc_array[i][j])
+            G_S[i][j] = ufunc_g_s(ufunc_array[i][j])
             
             g = (phi[i][j]**2)*(1-phi[i][j])**2
             h = (phi[i][j]**3)*(6.*phi[i][j]**2 - 15.*phi[i][j] + 10.)
@@ -301,8 +298,8 @@ def NComponent_helper_kernel(fields, T, transfer, rng_states, ufunc_array, param
             ufunc_array[i][j][len(fields)-3] -= 0.0000001
             for l in range(3, len(fields)):
                 ufunc_array[i][j][l-3] += 0.0000001
-                dGLdc = 10000000.*(get_thermodynamics(ufunc_g_l, ufunc_array[i][j])-G_L[i][j])
-                dGSdc = 10000000.*(get_thermodynamics(ufunc_g_s, ufunc_array[i][j])-G_S[i][j])
+                dGLdc = 10000000.*(ufunc_g_l(ufunc_array[i][j])-G_L[i][j])
+                dGSdc = 10000000.*(ufunc_g_s(ufunc_array[i][j])-G_S[i][j])
                 M_c = transfer[l-1]
                 dFdc = transfer[l-1+len(fields)-3]
                 M_c[i][j] = v_m*fields[l][i][j]*(D_L + h*(D_S - D_L))/(8.314*T[i][j])
@@ -423,13 +420,11 @@ class NCGPU_new(Simulation):
                     initial_concentration_array = self.user_data["initial_concentration_array"]
                     assert((len(initial_concentration_array)+1) == len(self._tdb_components))
                     for i in range(len(initial_concentration_array)):
-                        c_n = np.zeros(dim)
-                        c_n += initial_concentration_array[i]
+                        c_n = np.full(dim, initial_concentration_array[i], dtype=np.float64)
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
                 except: #initial_concentration array isnt defined?
                     for i in range(len(self._tdb_components)-1):
-                        c_n = np.zeros(dim)
-                        c_n += 1./len(self._tdb_components)
+                        c_n = np.full(dim, 1./len(self._tdb_components))
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
             elif(sim_type == "seeds"):
                 #initialize phi, q1, q4
@@ -454,13 +449,11 @@ class NCGPU_new(Simulation):
                     initial_concentration_array = self.user_data["initial_concentration_array"]
                     assert((len(initial_concentration_array)+1) == len(self._tdb_components))
                     for i in range(len(initial_concentration_array)):
-                        c_n = np.zeros(dim)
-                        c_n += initial_concentration_array[i]
+                        c_n = np.full(dim, initial_concentration_array[i], dtype=np.float64)
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
                 except: #initial_concentration array isnt defined?
                     for i in range(len(self._tdb_components)-1):
-                        c_n = np.zeros(dim)
-                        c_n += 1./len(self._tdb_components)
+                        c_n = np.full(dim, 1./len(self._tdb_components))
                         self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
         
         except:
@@ -473,13 +466,11 @@ class NCGPU_new(Simulation):
                 initial_concentration_array = self.user_data["initial_concentration_array"]
                 assert((len(initial_concentration_array)+1) == len(self._tdb_components))
                 for i in range(len(initial_concentration_array)):
-                    c_n = np.zeros(dim)
-                    c_n += initial_concentration_array[i]
+                    c_n = np.full(dim, initial_concentration_array[i], dtype=np.float64)
                     self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
             except: #initial_concentration array isnt defined?
                 for i in range(len(self._tdb_components)-1):
-                    c_n = np.zeros(dim)
-                    c_n += 1./len(self._tdb_components)
+                    c_n = np.full(dim, 1./len(self._tdb_components))
                     self.add_field(c_n, "c_"+self._tdb_components[i], colormap=COLORMAP_OTHER)
                         
     def just_before_simulating(self):
@@ -1,8 +1,11 @@
+import subprocess
 import numpy as np
 import sympy as sp
 from scipy.sparse.linalg import gmres
-from ..field import Field
+from ..simulation import Simulation
 from ..ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE
+from .. import ppf_cpu_utils
+from .. import ppf_utils
 
 def find_Pn(T_M, T, Q ,dt):
     #finding the probability of forming a critical nucleus, nucleating only every 500 time steps
@@ -52,16 +55,12 @@ def compute_tdb_energy_nc(sim, temps, c, phase):
     """
     import pycalphad as pyc
     #alphabetical order of components!
-    fec = [] #flattened expanded c
+    #one row per cell: c_0 ... c_(N-1), then the implicit final component c_N = 1-sum(c_i)
+    fec_n_comp = np.empty([c[0].size, len(c)+1])
+    fec_n_comp[:, len(c)] = 1.
     for i in range(len(c)):
-            fec.append(np.expand_dims(c[i].flatten(), axis=1))
-    fec_n_comp = np.ones(fec[0].shape)
-    for i in range(len(c)):
-        fec_n_comp -= fec[i]
-    for i in range(len(c)):
-        fec_n_comp = np.concatenate((fec_n_comp, fec[i]), axis=1)
-    #move final component to end, maybe ill find a way to write this better in the future...
-    fec_n_comp = np.roll(fec_n_comp, -1, axis=1)
+        fec_n_comp[:, i] = c[i].reshape(-1)
+        fec_n_comp[:, len(c)] -= fec_n_comp[:, i]
     #offset composition, for computing slope of GM w.r.t. comp
     fec_nc_offset = []
     for i in range(len(c)):
@@ -78,6 +77,8 @@ def compute_tdb_energy_nc(sim, temps, c, phase):
 
 ufunc_g_s = None
 ufunc_g_l = None
+ufunc_dgdc_s = [] #derivatives of ufunc_g_s w.r.t. each c_i but the last, with c_N = 1-sum(c_i)
+ufunc_dgdc_l = []
 
 def compute_tdb_energy_nc_rev(sim, temps, c, phase):
     """
@@ -94,9 +95,6 @@ def compute_tdb_energy_nc_rev(sim, temps, c, phase):
     
     Returns GM (Molar Gibbs Free Energy) and dGdci (list of derivatives of GM, w.r.t. c_i)
     """
-    global ufunc_g_s, ufunc_g_l
-    import pycalphad as pyc
-        
     #actual code for the tdb functions
     c1 = []
     for i in range(len(c)):
@@ -104,26 +102,9 @@ def compute_tdb_energy_nc_rev(sim, temps, c, phase):
     c1.append(1-np.sum(c, axis=0)) #c_n component
     c1.append(temps)
     if(phase == "FCC_A1"):
-        g = ufunc_g_s(*tuple(c1))
-        dgdc = []
-        c1[len(c1)-2] -= 0.000000001 #c_n component
-        for i in range(len(c)):
-            c1[i] += 0.000000001
-            g2 = ufunc_g_s(*tuple(c1))
-            dgdc.append(1000000000.*(g2-g))
-            c1[i] -= 0.000000001
-        return g, dgdc
-    
+        return ufunc_g_s(*c1), [dgdc_i(*c1) for dgdc_i in ufunc_dgdc_s]
     else:
-        g = ufunc_g_l(*tuple(c1))
-        dgdc = []
-        c1[len(c1)-2] -= 0.000000001 #c_n component
-        for i in range(len(c)):
-            c1[i] += 0.000000001
-            g2 = ufunc_g_l(*tuple(c1))
-            dgdc.append(1000000000.*(g2-g))
-            c1[i] -= 0.000000001
-        return g, dgdc
+        return ufunc_g_l(*c1), [dgdc_i(*c1) for dgdc_i in ufunc_dgdc_l]
     
 
 def __h(phi):
@@ -185,6 +166,35 @@ def divagradb(a, b, dx, dim):
         r += (agradb - np.roll(agradb, 1, i))/dx
     return r
 
+def interdiffusion(M_c, c, dFdc, dx, dim):
+    """
+    Change in each of the N concentrations c[j], the sum over k of divagradb(M_c[j]*(delta_jk - c[k]), dFdc[k])
+    
+    The face averaged mobility matrix is M_c[j]*(delta_jk - c[k]), so its product with the gradients g[k] of dFdc 
+    across a face only needs the two sums of c[k]*g[k] (using c on either side of the face), shared by all j. 
+    This is O(N) stencil work per axis instead of the O(N*N) of separate divagradb calls on each pair of fields. 
+    Returns an array of shape (N, *c[0].shape)
+    """
+    M_c = np.asarray(M_c)
+    c = np.asarray(c)
+    dFdc = np.asarray(dFdc)
+    r = np.zeros_like(dFdc)
+    for i in range(dim):
+        g = np.roll(dFdc, -1, i+1)
+        g -= dFdc
+        g /= dx
+        cg = np.einsum("k...,k...->...", c, g)
+        cg_next = np.einsum("k...,k...->...", np.roll(c, -1, i+1), g)
+        flux = g - cg
+        flux *= M_c
+        g -= cg_next
+        g *= np.roll(M_c, -1, i+1)
+        flux += g
+        flux /= 2*dx
+        r += flux
+        r -= np.roll(flux, 1, i+1)
+    return r
+
 def gaq(gql, gqr, rgqsl, rgqsr, dqc, dx, dim):
     r = np.zeros_like(dqc)
     for i in range(dim):
@@ -443,7 +453,6 @@ def engine_NComponent_Explicit(sim):
     #change in c1, c2
     M_c = []
     dFdc = []
-    deltac = []
     #find the standard deviation as an array 
     std_c=np.sqrt(np.absolute(2*sim.R*T/sim.v_m))
     for j in range(len(c)):
@@ -452,11 +461,7 @@ def engine_NComponent_Explicit(sim):
         M_c.append(sim.v_m*c[j]*(sim.D_S+m*(sim.D_L-sim.D_S))/sim.R/1574.)
         #add the change in noise inside the functional
         dFdc.append((dGSdc[j] + m*(dGLdc[j]-dGSdc[j]))/sim.v_m + (sim.W[j]-sim.W[len(c)])*g*T+noise_c)
-    for j in range(len(c)):
-        deltac.append(divagradb(M_c[j]*(1-c[j]), dFdc[j], dx, dim))
-        for k in range(len(c)):
-            if not (j == k):
-                deltac[j] -= divagradb(M_c[j]*c[k], dFdc[k], dx, dim)
+    deltac = interdiffusion(M_c, c, dFdc, dx, dim)
 
     #change in phi
     divTgradphi = divagradb(T, phi, dx, dim)
@@ -544,8 +549,8 @@ def engine_NComponent_Explicit(sim):
     sim.fields[1].data += deltaq1*dt
     sim.fields[2].data += deltaq4*dt
     
-    #always renormalize quaternion fields after every step
-    sim.fields[1].data, sim.fields[2].data = renormalize(sim.fields[1].data, sim.fields[2].data)
+    #always renormalize quaternion fields after every step (fields 1 and 2, in place)
+    ppf_cpu_utils.renormalize_and_clip(sim._field_stack, 1, 3, -1, 0., 1.)
 
     #This code segment prints the progress after every 5% of the simulation is done (for convenience)
     #disabled for now, may bring it back in the simulate function of simulation.py
@@ -652,7 +657,6 @@ def engine_NComponent_FrozenOrientation(sim):
     #change in c1, c2
     M_c = []
     dFdc = []
-    deltac = []
     #find the standard deviation as an array 
     std_c=np.sqrt(np.absolute(2*sim.R*T/sim.v_m))
     for j in range(len(c)):
@@ -662,11 +666,7 @@ def engine_NComponent_FrozenOrientation(sim):
         M_c.append(sim.v_m*c[j]*(sim.D_S+m*(sim.D_L-sim.D_S))/sim.R/1574.)
         #add the change in noise inside the functional
         dFdc.append((dGSdc[j] + m*(dGLdc[j]-dGSdc[j]))/sim.v_m + (sim.W[j]-sim.W[len(c)])*g*T+noise_c)
-    for j in range(len(c)):
-        deltac.append(divagradb(M_c[j]*(1-c[j]), dFdc[j], dx, dim))
-        for k in range(len(c)):
-            if not (j == k):
-                deltac[j] -= divagradb(M_c[j]*c[k], dFdc[k], dx, dim)
+    deltac = interdiffusion(M_c, c, dFdc, dx, dim)
 
     #change in phi
     divTgradphi = divagradb(T, phi, dx, dim)
@@ -728,7 +728,7 @@ def engine_NComponent_FrozenOrientation(sim):
         sim.fields[3+j].data += deltac[j]*dt
     sim.fields[0].data += deltaphi*dt
     
-    sim.fields[0].data = np.clip(sim.fields[0].data, 0.000001, 0.999999)
+    ppf_cpu_utils.renormalize_and_clip(sim._field_stack, 0, 0, 0, 0.000001, 0.999999)
     
     
     
@@ -795,7 +795,6 @@ def engine_NComponent_AnisoM(sim):
     #change in c1, c2
     M_c = []
     dFdc = []
-    deltac = []
     #find the standard deviation as an array 
     std_c=np.sqrt(np.absolute(2*sim.R*T/sim.v_m))
     for j in range(len(c)):
@@ -804,11 +803,7 @@ def engine_NComponent_AnisoM(sim):
         M_c.append(sim.v_m*c[j]*(sim.D_S+m*(sim.D_L-sim.D_S))/sim.R/1574.)
         #add the change in noise inside the functional
         dFdc.append((dGSdc[j] + m*(dGLdc[j]-dGSdc[j]))/sim.v_m + (sim.W[j]-sim.W[len(c)])*g*T+noise_c)
-    for j in range(len(c)):
-        deltac.append(divagradb(M_c[j]*(1-c[j]), dFdc[j], dx, dim))
-        for k in range(len(c)):
-            if not (j == k):
-                deltac[j] -= divagradb(M_c[j]*c[k], dFdc[k], dx, dim)
+    deltac = interdiffusion(M_c, c, dFdc, dx, dim)
 
     #change in phi
     divTgradphi = divagradb(T, phi, dx, dim)
@@ -845,7 +840,7 @@ def engine_NComponent_AnisoM(sim):
         sim.fields[3+j].data += deltac[j]*dt
     sim.fields[0].data += deltaphi*dt
     
-    sim.fields[0].data = np.clip(sim.fields[0].data, 0.000001, 0.999999)
+    ppf_cpu_utils.renormalize_and_clip(sim._field_stack, 0, 0, 0, 0.000001, 0.999999)
     
         
 def engine_NComponent_ADI(sim):
@@ -937,7 +932,6 @@ def engine_NComponent_ADI(sim):
     #change in c1, c2
     M_c = []
     dFdc = []
-    deltac = []
     #find the standard deviation as an array 
     std_c=np.sqrt(np.absolute(2*sim.R*T/sim.v_m))
     for j in range(len(c)):
@@ -946,11 +940,7 @@ def engine_NComponent_ADI(sim):
         M_c.append(sim.v_m*c[j]*(sim.D_S+m*(sim.D_L-sim.D_S))/sim.R/1574.)
         #add the change in noise inside the functional
         dFdc.append((dGSdc[j] + m*(dGLdc[j]-dGSdc[j]))/sim.v_m + (sim.W[j]-sim.W[len(c)])*g*T+noise_c)
-    for j in range(len(c)):
-        deltac.append(divagradb(M_c[j]*(1-c[j]), dFdc[j], dx, dim))
-        for k in range(len(c)):
-            if not (j == k):
-                deltac[j] -= divagradb(M_c[j]*c[k], dFdc[k], dx, dim)
+    deltac = interdiffusion(M_c, c, dFdc, dx, dim)
 
     #change in phi
     divTgradphi = divagradb(T, phi, dx, dim)
@@ -1001,8 +991,8 @@ def engine_NComponent_ADI(sim):
     sim.fields[1].data += q1
     sim.fields[2].data += q4
     
-    #always renormalize quaternion fields after every step
-    sim.fields[1].data, sim.fields[2].data = renormalize(sim.fields[1].data, sim.fields[2].data)
+    #always renormalize quaternion fields after every step (fields 1 and 2, in place)
+    ppf_cpu_utils.renormalize_and_clip(sim._field_stack, 1, 3, -1, 0., 1.)
         
 def make_seed(phi, q1, q4, x, y, angle, seed_radius):
     shape = phi.shape
@@ -1026,7 +1016,7 @@ def init_tdb_parameters(sim):
     Returns True if variables are loaded successfully, False if certain variables dont exist in the TDB
     If false, preinitialize will print an error saying the TDB doesn't have enough info to run the sim
     """
-    global ufunc_g_s, ufunc_g_l
+    global ufunc_g_s, ufunc_g_l, ufunc_dgdc_s, ufunc_dgdc_l
     import pycalphad as pyc
     from tinydb import where
     tdb = sim._tdb
@@ -1114,8 +1104,23 @@ def init_tdb_parameters(sim):
         
         
 
-        ufunc_g_s = sp.lambdify(tuple(sympysyms_list_solid), sympyexpr_solid+ime_solid, "numpy")
-        ufunc_g_l = sp.lambdify(tuple(sympysyms_list_liquid), sympyexpr_liquid+ime_liquid, "numpy")
+        #G and its derivatives w.r.t. c_i, with c_N = 1-sum(c_i) decreasing (symbols are c_0 ... c_N, T)
+        functions = []
+        for symbols, G in ((sympysyms_list_solid, sympyexpr_solid+ime_solid), (sympysyms_list_liquid, sympyexpr_liquid+ime_liquid)):
+            expressions = [G]
+            for i in range(len(symbols)-2):
+                expressions.append(sp.diff(G, symbols[i]) - sp.diff(G, symbols[-2]))
+            functions.append((symbols, expressions))
+        #compiled to native code if possible, these are evaluated several times per cell each step
+        try:
+            compiled = [[ppf_utils.make_tdb_c_function(ppf_utils.tdb_function_c_source(symbols, e), len(symbols)) 
+                         for e in expressions] for symbols, expressions in functions]
+        except (OSError, subprocess.CalledProcessError) as e:
+            print("Could not compile the TDB free energies (is a C compiler installed?), using numpy instead")
+            print(e)
+            compiled = [[sp.lambdify(tuple(symbols), e, "numpy") for e in expressions] for symbols, expressions in functions]
+        ufunc_g_s, *ufunc_dgdc_s = compiled[0]
+        ufunc_g_l, *ufunc_dgdc_l = compiled[1]
             
         return True
     except Exception as e:
@@ -1241,7 +1246,6 @@ def engine_params_NComponent(sim):
     #change in c1, c2
     M_c = []
     dFdc = []
-    deltac = []
     #find the standard deviation as an array 
     std_c=np.sqrt(np.absolute(2*sim.R*T/sim.v_m))
     for j in range(len(c)):
@@ -1250,11 +1254,7 @@ def engine_params_NComponent(sim):
         M_c.append(sim.v_m*c[j]*(sim.D_S+m*(sim.D_L-sim.D_S))/sim.R/1574.)
         #add the change in noise inside the functional
         dFdc.append((dGSdc[j] + m*(dGLdc[j]-dGSdc[j]))/sim.v_m + (sim.W[j]-sim.W[len(c)])*g*T+noise_c)
-    for j in range(len(c)):
-        deltac.append(divagradb(M_c[j]*(1-c[j]), dFdc[j], dx, dim))
-        for k in range(len(c)):
-            if not (j == k):
-                deltac[j] -= divagradb(M_c[j]*c[k], dFdc[k], dx, dim)
+    deltac = interdiffusion(M_c, c, dFdc, dx, dim)
 
     #change in phi
     divTgradphi = divagradb(T, phi, dx, dim)
@@ -1344,75 +1344,39 @@ def engine_params_NComponent(sim):
     return rd
     
         
-def init_NComponent(sim, dim=[200,200], sim_type="seed", number_of_seeds=1, tdb_path="Ni-Cu_Ideal.tdb", 
-                           tdb_phases = ["FCC_A1", "LIQUID"], tdb_components = None, temperature_type="isothermal", 
-                           initial_temperature=1574, temperature_gradient=0, cooling_rate=0, temperature_file_path="T.xdmf", 
-                           initial_concentration_array=[0.40831], cell_spacing=0.0000046, d_ratio=1/0.94, solver="explicit", 
-                           nbc=["periodic", "periodic"]):
-    sim.set_boundary_conditions(nbc)
-    if(len(dim) == 1):
-        dim.append(1)
-    if(nbc[0] != "periodic"):
-        dim[1] += 2
-    if(nbc[1] != "periodic"):
-        dim[0] += 2
-    sim.set_dimensions(dim)
-    sim.load_tdb(tdb_path, phases=tdb_phases, components=tdb_components)
-    sim.set_cell_spacing(cell_spacing)
-    sim.d = sim.get_cell_spacing()*d_ratio
-    if(solver == "explicit"):
-        sim.set_engine(engine_NComponent_Explicit)
-    elif(solver == "frozenorientation"):
-        sim.set_engine(engine_NComponent_FrozenOrientation)
-    elif(solver == "aniso_m"):
-        sim.set_engine(engine_NComponent_AnisoM)
-    else:
-        sim.set_engine(engine_NComponent_ADI)
-    init_tdb_parameters(sim)
-    if(temperature_type=="isothermal"):
-        sim.set_temperature_isothermal(initial_temperature)
-    elif(temperature_type=="gradient"):
-        sim.set_temperature_gradient(initial_temperature, temperature_gradient, cooling_rate)
-    elif(temperature_type=="file"):
-        sim.set_temperature_file(temperature_file_path)
-        #set size of simulation equal to the thermal file dimensions
-        dim = list(sim.temperature.data.shape)
-        sim.set_dimensions(dim)
-    else:
-        print("Temperature type of "+temperature_type+" is not recognized, defaulting to isothermal with a temperature of "+str(initial_temperature))
-        sim.set_temperature_isothermal(initial_temperature)
-    if(sim_type=="seed"):
-        #initialize phi, q1, q4
-        phi = np.zeros(dim)
-        q1 = np.zeros(dim)
-        q4 = np.zeros(dim)
-        initial_angle = 0*np.pi/8
-        q1 += np.cos(initial_angle)
-        q4 += np.sin(initial_angle)
-        seed_angle = 1*np.pi/8
-        phi, q1, q4 = make_seed(phi, q1, q4, dim[1]/2, dim[0]/2, seed_angle, 5)
-        phi_field = Field(data=phi, name="phi", simulation=sim, colormap=COLORMAP_PHASE)
-        q1_field = Field(data=q1, name="q1", simulation=sim)
-        q4_field = Field(data=q4, name="q4", simulation=sim)
-        sim.add_field(phi_field)
-        sim.add_field(q1_field)
-        sim.add_field(q4_field)
+_SOLVERS = {"explicit": engine_NComponent_Explicit, 
+            "frozenorientation": engine_NComponent_FrozenOrientation, 
+            "aniso_m": engine_NComponent_AnisoM, 
+            "adi": engine_NComponent_ADI}
+
+class NComponent(Simulation):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._framework = "CPU_SERIAL" #numpy engine, must be this framework
+        self._step_function = None #engine function run each step, set in just_before_simulating
+        if not ("d_ratio" in self.user_data):
+            self.user_data["d_ratio"] = 1/0.94
+        if not ("solver" in self.user_data):
+            self.user_data["solver"] = "explicit"
+        if not ("sim_type" in self.user_data):
+            self.user_data["sim_type"] = "seed"
+        if not ("number_of_seeds" in self.user_data):
+            self.user_data["number_of_seeds"] = 1
+        if not (self.user_data["solver"] in _SOLVERS):
+            raise ValueError("Unknown solver \""+str(self.user_data["solver"])+"\", must be one of "+str(list(_SOLVERS)))
         
-        #initialize concentration array(s)
-        if(initial_concentration_array == None):
-            for i in range(len(sim._components)-1):
-                c_n = np.zeros(dim)
-                c_n += 1./len(sim._components)
-                c_n_field = Field(data=c_n, name="c_"+sim._components[i], simulation=sim, colormap=COLORMAP_OTHER)
-                sim.add_field(c_n_field)
-        else:
-            assert((len(initial_concentration_array)+1) == len(sim._components))
-            for i in range(len(initial_concentration_array)):
-                c_n = np.zeros(dim)
-                c_n += initial_concentration_array[i]
-                c_n_field = Field(data=c_n, name="c_"+sim._components[i], simulation=sim, colormap=COLORMAP_OTHER)
-                sim.add_field(c_n_field)
-    elif(sim_type=="seeds"):
+    def init_tdb_params(self):
+        super().init_tdb_params()
+        #the engine functions read the model parameters as attributes of the simulation, see init_tdb_parameters
+        self._components = list(self._tdb_components)
+        self.d = self.get_cell_spacing()*self.user_data["d_ratio"]
+        if not init_tdb_parameters(self):
+            raise ValueError("The TDB file "+str(self._tdb_path)+" does not define every parameter of the NComponent model")
+            
+    def init_fields(self):
+        dim = self.dimensions
+        if(len(dim) != 2):
+            raise ValueError("The NComponent engine only supports 2D simulations, not "+str(len(dim))+"D")
         #initialize phi, q1, q4
         phi = np.zeros(dim)
         q1 = np.zeros(dim)
@@ -1420,34 +1384,37 @@ def init_NComponent(sim, dim=[200,200], sim_type="seed", number_of_seeds=1, tdb_
         initial_angle = 0*np.pi/8
         q1 += np.cos(initial_angle)
         q4 += np.sin(initial_angle)
-        
-        for j in range(number_of_seeds):
-            seed_angle = (np.random.rand()-0.5)*np.pi/4
-            x_pos = int(np.random.rand()*dim[1])
-            y_pos = int(np.random.rand()*dim[0])
-            phi, q1, q4 = make_seed(phi, q1, q4, x_pos, y_pos, seed_angle, 5)
-        
-        phi_field = Field(data=phi, name="phi", simulation=sim, colormap=COLORMAP_PHASE)
-        q1_field = Field(data=q1, name="q1", simulation=sim)
-        q4_field = Field(data=q4, name="q4", simulation=sim) 
-        sim.add_field(phi_field)
-        sim.add_field(q1_field)
-        sim.add_field(q4_field)
+        if(self.user_data["sim_type"] == "seed"):
+            seed_angle = 1*np.pi/8
+            phi, q1, q4 = make_seed(phi, q1, q4, dim[1]/2, dim[0]/2, seed_angle, 5)
+        elif(self.user_data["sim_type"] == "seeds"):
+            for j in range(self.user_data["number_of_seeds"]):
+                seed_angle = (np.random.rand()-0.5)*np.pi/4
+                x_pos = int(np.random.rand()*dim[1])
+                y_pos = int(np.random.rand()*dim[0])
+                phi, q1, q4 = make_seed(phi, q1, q4, x_pos, y_pos, seed_angle, 5)
+        self.add_field(phi, "phi", colormap=COLORMAP_PHASE)
+        self.add_field(q1, "q1")
+        self.add_field(q4, "q4")
         
         #initialize concentration array(s)
-        if(initial_concentration_array == None):
-            for i in range(len(sim._components)-1):
-                c_n = np.zeros(dim)
-                c_n += 1./len(sim._components)
-                c_n_field = Field(data=c_n, name="c_"+sim._components[i], simulation=sim, colormap=COLORMAP_OTHER)
-                sim.add_field(c_n_field)
+        comps = self._tdb_components
+        if not ("initial_concentration_array" in self.user_data):
+            for i in range(len(comps)-1):
+                self.add_field(np.full(dim, 1./len(comps)), "c_"+comps[i], colormap=COLORMAP_OTHER)
         else:
-            assert((len(initial_concentration_array)+1) == len(sim._components))
+            initial_concentration_array = self.user_data["initial_concentration_array"]
+            if((len(initial_concentration_array)+1) != len(comps)):
+                raise ValueError("initial_concentration_array needs one concentration per component except the last of "+
+                                 str(comps))
             for i in range(len(initial_concentration_array)):
-                c_n = np.zeros(dim)
-                c_n += initial_concentration_array[i]
-                c_n_field = Field(data=c_n, name="c_"+sim._components[i], simulation=sim, colormap=COLORMAP_OTHER)
-                sim.add_field(c_n_field)
-        
+                self.add_field(np.full(dim, initial_concentration_array[i], dtype=np.float64), "c_"+comps[i], 
+                               colormap=COLORMAP_OTHER)
+                
+    def just_before_simulating(self):
+        super().just_before_simulating()
+        #the solver is chosen once here, instead of comparing the solver strings every step
+        self._step_function = _SOLVERS[self.user_data["solver"]]
         
-            
\ No newline at end of file
+    def simulation_loop(self):
+        self._step_function(self)
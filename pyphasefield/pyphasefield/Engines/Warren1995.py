@@ -5,14 +5,23 @@ try:
     from ..field import Field
     from ..simulation import Simulation
     from ..ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE_INV
+    from .. import ppf_cpu_utils
 except:
     try:
         #import classes from pyphasefield library
         from pyphasefield.field import Field
         from pyphasefield.simulation import Simulation
         from pyphasefield.ppf_utils import COLORMAP_OTHER, COLORMAP_PHASE_INV
+        from pyphasefield import ppf_cpu_utils
     except:
         raise ImportError("Cannot import from pyphasefield library!")
+        
+try:
+    import numba
+    from numba import prange
+except:
+    from .. import jit_placeholder as numba
+    from ..jit_placeholder import prange
 
 def __p(phi):
     return phi*phi*phi*(10-15*phi+6*phi*phi)
@@ -52,12 +61,14 @@ def engine_Warren1995(sim):
     dx = sim.get_cell_spacing()
     phi = sim.fields[0].data
     c = sim.fields[1].data
+    ud = sim.user_data
+    T = ud["T"] if (sim.temperature is None) else sim.temperature.data
     
     g = _g(phi)
     p = _p(phi)
     gprime = _gprime(phi)
-    H_A = sim.W_A*gprime + 30*sim.L_A*(1/sim.T-1/sim.T_mA)*g
-    H_B = sim.W_B*gprime + 30*sim.L_B*(1/sim.T-1/sim.T_mB)*g
+    H_A = ud["W_A"]*gprime + 30*ud["L_A"]*(1/T-1/ud["T_mA"])*g
+    H_B = ud["W_B"]*gprime + 30*ud["L_B"]*(1/T-1/ud["T_mB"])*g
     phixx = gradxx(phi, dx)
     phiyy = gradyy(phi, dx)
     lphi = phixx+phiyy
@@ -66,69 +77,176 @@ def engine_Warren1995(sim):
     phixy = grady(phix, dx)
     
     #change in c
-    D_C = sim.D_S+p*(sim.D_L-sim.D_S)
-    temp = D_C*sim.v_m*c*(1-c)*(H_B-H_A)/sim.R
+    D_C = ud["D_S"]+p*(ud["D_L"]-ud["D_S"])
+    temp = D_C*ud["v_m"]*c*(1-c)*(H_B-H_A)/ud["R"]
     deltac = D_C*(gradxx(c, dx)+gradyy(c, dx))+(gradx(D_C, dx)*gradx(c, dx)+grady(D_C, dx)*grady(c, dx))+temp*(lphi)+(gradx(temp, dx)*phix+grady(temp, dx)*phiy)
     #print(deltac)
     #print(temp)
     
     #change in phi
     theta = np.arctan2(phiy, phix)
-    eta = 1+sim.y_e*np.cos(4*theta)
-    etap = -4*sim.y_e*np.sin(4*theta)
+    eta = 1+ud["y_e"]*np.cos(4*theta)
+    etap = -4*ud["y_e"]*np.sin(4*theta)
     etapp = -16*(eta-1)
     c2 = np.cos(2*theta)
     s2 = np.sin(2*theta)
-    M_phi = (1-c)*sim.M_A + c*sim.M_B
-    ebar2 = sim.ebar**2
+    M_phi = (1-c)*ud["M_A"] + c*ud["M_B"]
+    ebar2 = ud["ebar"]**2
     deltaphi = M_phi*((ebar2*eta*eta*lphi-(1-c)*H_A-c*H_B)+ebar2*eta*etap*(s2*(phiyy-phixx)+2*c2*phixy)+0.5*ebar2*(etap*etap+eta*etapp)*(-2*s2*phixy+lphi+c2*(phiyy-phixx)))
     randArray = 2*np.random.random(phi.shape)-1
-    deltaphi += M_phi*sim.alpha*randArray*(16*g)*((1-c)*H_A+c*H_B)
-    np.set_printoptions(threshold=np.inf)
-    
+    deltaphi += M_phi*ud["alpha"]*randArray*(16*g)*((1-c)*H_A+c*H_B)
     
     #apply changes
     sim.fields[0].data += deltaphi*dt
     sim.fields[1].data += deltac*dt
     
-def init_Warren1995(sim, dim, diamond_size=15):
-    #original Warren1995 model uses centimeters, values have been converted to meters!
-    sim.set_dimensions(dim)
-    phi = np.zeros(dim)
-    phi += 1.
-    for i in range(diamond_size):
-        phi[(int)(dim[0]/2-i):(int)(dim[0]/2+i), ((int)(dim[1]/2-(diamond_size-i))):(int)(dim[1]/2+(diamond_size-i))] = 0
-    phi_field = Field(data=phi, name="phi", simulation=sim, colormap=COLORMAP_PHASE_INV)
-    sim.add_field(phi_field)
-    c = np.zeros(dim)
-    c += 0.40831
-    c_field = Field(data=c, name="c", simulation=sim, colormap=COLORMAP_OTHER)
-    sim.add_field(c_field)
-    sim.T_mA = 1728. #melting point of nickel
-    sim.T_mB = 1358. #melting point of copper
-    sim.L_A = 2350000000. #latent heat of nickel, J/m^3
-    sim.L_B = 1728000000. #latent heat of copper, J/m^3
-    sim.s_A = 0.37 #surface energy of nickel, J/m^2
-    sim.s_B = 0.29 #surface energy of copper, J/m^2
-    sim.D_L = 1e-9 #diffusion in liquid, m^2/s
-    sim.D_S = 1e-13 #diffusion in solid, m^2/s
-    sim.B_A = 0.0033 #linear kinetic coefficient of nickel, m/K/s
-    sim.B_B = 0.0039 #linear kinetic coefficient of copper, m/K/s
-    sim.v_m = 0.00000742 #molar volume, m^3/mol
-    sim.R = 8.314 #gas constant, J/mol*K
-    sim.y_e = 0.04 #anisotropy
-    sim.T = 1574.
-    sim.alpha = 0.3
-    sim.set_cell_spacing(4.6e-8)
-    sim.set_time_step_length(sim.get_cell_spacing()**2/5./sim.D_L)
-    sim.d = sim.get_cell_spacing()/0.94 #interfacial thickness
-    sim.ebar = np.sqrt(6*np.sqrt(2)*sim.s_A*sim.d/sim.T_mA) #baseline energy
-    sim.W_A = 3*sim.s_A/(np.sqrt(2)*sim.T_mA*sim.d)
-    sim.W_B = 3*sim.s_B/(np.sqrt(2)*sim.T_mB*sim.d)
-    sim.M_A = sim.T_mA*sim.T_mA*sim.B_A/(6*np.sqrt(2)*sim.L_A*sim.d)
-    sim.M_B = sim.T_mB*sim.T_mB*sim.B_B/(6*np.sqrt(2)*sim.L_B*sim.d)
-    sim.ebar = np.sqrt(6*np.sqrt(2)*sim.s_A*sim.d/sim.T_mA)
-    sim.set_engine(Warren1995)
+@numba.njit(inline="always")
+def _warren_H(phi, W, L, T, T_m):
+    return W*(4*phi*phi*phi - 6*phi*phi + 2*phi) + 30*L*(1/T-1/T_m)*(phi*phi*(1-phi)*(1-phi))
+
+@numba.njit(inline="always")
+def _warren_D(phi, D_L, D_S):
+    return D_S+phi*phi*phi*(10-15*phi+6*phi*phi)*(D_L-D_S)
+
+@numba.njit(inline="always")
+def _warren_T(temperature, i, j, temperature_offset, params):
+    if(params[3] == 0.):
+        return params[2]
+    return temperature[i, j]+temperature_offset
+
+@numba.njit(inline="always")
+def _warren_flux(phi, c, T, params):
+    #the D_C*v_m*c*(1-c)*(H_B-H_A)/R term of engine_Warren1995, at one cell
+    H_A = _warren_H(phi, params[4], params[6], T, params[8])
+    H_B = _warren_H(phi, params[5], params[7], T, params[9])
+    return _warren_D(phi, params[10], params[11])*params[12]*c*(1-c)*(H_B-H_A)/params[13]
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def warren1995_kernel(fields, fields_out, temperature, temperature_offset, params):
+    """
+    One step of engine_Warren1995, with all of its array passes fused into one loop over the cells
+    
+    Each cell reads its 3x3 neighborhood of phi and 5 point neighborhood of c once, and computes the update of 
+    both fields from them, rather than every derivative and intermediate term being a separate pass over the grid
+    params: [dx, dt, T, use temperature field (0/1), W_A, W_B, L_A, L_B, T_mA, T_mB, D_L, D_S, v_m, R, y_e, M_A, M_B, 
+    ebar, alpha], see Warren1995.just_before_simulating
+    """
+    phi = fields[0]
+    c = fields[1]
+    phi_out = fields_out[0]
+    c_out = fields_out[1]
+    dx = params[0]
+    dt = params[1]
+    y_e = params[14]
+    ebar2 = params[17]*params[17]
+    alpha = params[18]
+    idx2 = 1./(2*dx)
+    idxx = 1./(dx*dx)
+    for i in prange(1, phi.shape[0]-1):
+        for j in range(1, phi.shape[1]-1):
+            p00 = phi[i-1, j-1]
+            p01 = phi[i-1, j]
+            p02 = phi[i-1, j+1]
+            p10 = phi[i, j-1]
+            p11 = phi[i, j]
+            p12 = phi[i, j+1]
+            p20 = phi[i+1, j-1]
+            p21 = phi[i+1, j]
+            p22 = phi[i+1, j+1]
+            c01 = c[i-1, j]
+            c10 = c[i, j-1]
+            c11 = c[i, j]
+            c12 = c[i, j+1]
+            c21 = c[i+1, j]
+            T11 = _warren_T(temperature, i, j, temperature_offset, params)
+            
+            #x is the first axis, as in engine_Warren1995
+            phix = (p21-p01)*idx2
+            phiy = (p12-p10)*idx2
+            phixx = (p21+p01-2*p11)*idxx
+            phiyy = (p12+p10-2*p11)*idxx
+            phixy = (p22-p20-p02+p00)*idx2*idx2
+            lphi = phixx+phiyy
+            
+            #change in c
+            D_C = _warren_D(p11, params[10], params[11])
+            D_Cx = (_warren_D(p21, params[10], params[11])-_warren_D(p01, params[10], params[11]))*idx2
+            D_Cy = (_warren_D(p12, params[10], params[11])-_warren_D(p10, params[10], params[11]))*idx2
+            temp = _warren_flux(p11, c11, T11, params)
+            tempx = (_warren_flux(p21, c21, _warren_T(temperature, i+1, j, temperature_offset, params), params)-
+                     _warren_flux(p01, c01, _warren_T(temperature, i-1, j, temperature_offset, params), params))*idx2
+            tempy = (_warren_flux(p12, c12, _warren_T(temperature, i, j+1, temperature_offset, params), params)-
+                     _warren_flux(p10, c10, _warren_T(temperature, i, j-1, temperature_offset, params), params))*idx2
+            deltac = (D_C*(c21+c01+c12+c10-4*c11)*idxx + D_Cx*(c21-c01)*idx2 + D_Cy*(c12-c10)*idx2 + temp*lphi + 
+                      tempx*phix + tempy*phiy)
+            
+            #change in phi
+            H_A = _warren_H(p11, params[4], params[6], T11, params[8])
+            H_B = _warren_H(p11, params[5], params[7], T11, params[9])
+            theta = np.arctan2(phiy, phix)
+            eta = 1+y_e*np.cos(4*theta)
+            etap = -4*y_e*np.sin(4*theta)
+            etapp = -16*(eta-1)
+            c2 = np.cos(2*theta)
+            s2 = np.sin(2*theta)
+            M_phi = (1-c11)*params[15] + c11*params[16]
+            deltaphi = M_phi*((ebar2*eta*eta*lphi-(1-c11)*H_A-c11*H_B)+ebar2*eta*etap*(s2*(phiyy-phixx)+2*c2*phixy)+
+                              0.5*ebar2*(etap*etap+eta*etapp)*(-2*s2*phixy+lphi+c2*(phiyy-phixx)))
+            if(alpha != 0.):
+                g = p11*p11*(1-p11)*(1-p11)
+                deltaphi += M_phi*alpha*(2*np.random.random()-1)*(16*g)*((1-c11)*H_A+c11*H_B)
+            
+            phi_out[i, j] = p11+deltaphi*dt
+            c_out[i, j] = c11+deltac*dt
+            
+#like the Diffusion drivers, this calls the kernel directly so numba can cache it on disk
+@numba.njit(cache=True)
+def warren1995_driver(fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    for i in range(number_of_timesteps):
+        warren1995_kernel(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        ppf_cpu_utils.apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+    
+#upper bound on the number of elements in the temporary arrays made by rasterize_seeds
+_SEED_CHUNK_CELLS = 2**24
+
+def diamond_seeds(dim, diamond_size):
+    """Returns the seed list (xs, ys, radii) of a single diamond in the center of the simulation region"""
+    return (np.array([dim[1]//2], dtype=np.int32), np.array([dim[0]//2], dtype=np.int32), 
+            np.array([diamond_size], dtype=np.float32))
+
+def rasterize_seeds(dim, seeds):
+    """
+    Returns phi for a set of diamond shaped seeds, phi = 0 (solid) inside the seeds and 1 (liquid) elsewhere
+    
+    seeds is a structure of arrays (xs, ys, radii). Seed k covers the cells whose centers are within an L1 distance 
+    of radii[k] of the grid point (ys[k], xs[k]), i.e. the corner shared by cells [ys[k]-1:ys[k]+1, xs[k]-1:xs[k]+1]
+    Every seed is tested against the cells of its own bounding window at once by broadcasting, so the cost scales 
+    with the number and size of the seeds, not with the size of the grid
+    """
+    xs = np.asarray(seeds[0], dtype=np.int32)
+    ys = np.asarray(seeds[1], dtype=np.int32)
+    radii = np.asarray(seeds[2], dtype=np.float32)
+    if not(xs.shape == ys.shape == radii.shape) or not(xs.ndim == 1):
+        raise ValueError("Seeds must be three 1D arrays (xs, ys, radii) of the same length!")
+    solid = np.zeros(dim, dtype=bool)
+    if(len(xs) == 0):
+        return np.where(solid, 0., 1.)
+    #cells more than r cells away from the seed's corner point along either axis are never inside it
+    r = max(int(np.ceil(radii.max())), 0)
+    offsets = np.arange(-r, r)
+    chunk = max(1, _SEED_CHUNK_CELLS//max(4*r*r, 1))
+    for k in range(0, len(xs), chunk):
+        rows = ys[k:k+chunk, None]+offsets
+        cols = xs[k:k+chunk, None]+offsets
+        dy = np.abs(rows+0.5-ys[k:k+chunk, None])
+        dx = np.abs(cols+0.5-xs[k:k+chunk, None])
+        inside = (dy[:, :, None]+dx[:, None, :] < radii[k:k+chunk, None, None])
+        inside &= ((rows >= 0) & (rows < dim[0]))[:, :, None]
+        inside &= ((cols >= 0) & (cols < dim[1]))[:, None, :]
+        solid[np.broadcast_to(rows[:, :, None], inside.shape)[inside], np.broadcast_to(cols[:, None, :], inside.shape)[inside]] = True
+    return np.where(solid, 0., 1.)
     
 class Warren1995(Simulation):
     def __init__(self, **kwargs):
@@ -167,6 +285,8 @@ class Warren1995(Simulation):
             self.user_data["alpha"] = 0.3
         if not ("diamond_size" in self.user_data):
             self.user_data["diamond_size"] = 15
+        if not ("seed_soa" in self.user_data):
+            self.user_data["seed_soa"] = None #(xs, ys, radii) of diamond seeds, None for one of diamond_size in the center
         
         
     def init_fields(self):
@@ -174,15 +294,13 @@ class Warren1995(Simulation):
         #runs *after* tdb and thermal data is loaded/initialized
         #runs *before* boundary conditions are initialized
         dim = self.dimensions
-        phi = np.zeros(dim)
-        phi += 1.
-        diamond_size = self.user_data["diamond_size"]
-        for i in range(diamond_size):
-            phi[(int)(dim[0]/2-i):(int)(dim[0]/2+i), ((int)(dim[1]/2-(diamond_size-i))):(int)(dim[1]/2+(diamond_size-i))] = 0
+        seeds = self.user_data["seed_soa"]
+        if(seeds is None):
+            seeds = diamond_seeds(dim, self.user_data["diamond_size"])
+        phi = rasterize_seeds(dim, seeds)
         self.add_field(phi, "phi", colormap=COLORMAP_PHASE_INV)
-        c = np.zeros(dim)
-        c += 0.40831
-        self.add_field(c_field, "c", colormap=COLORMAP_OTHER)
+        c = np.full(dim, 0.40831)
+        self.add_field(c, "c", colormap=COLORMAP_OTHER)
         
         
     def initialize_fields_and_imported_data(self):
@@ -201,6 +319,15 @@ class Warren1995(Simulation):
         self.user_data["W_B"] = 3*self.user_data["s_B"]/(np.sqrt(2)*self.user_data["T_mB"]*self.user_data["d"])
         self.user_data["M_A"] = (self.user_data["T_mA"]**2)*self.user_data["B_A"]/(6*np.sqrt(2)*self.user_data["L_A"]*self.user_data["d"])
         self.user_data["M_B"] = (self.user_data["T_mB"]**2)*self.user_data["B_B"]/(6*np.sqrt(2)*self.user_data["L_B"]*self.user_data["d"])
+        if(self._framework == "CPU_SERIAL" or self._framework == "CPU_PARALLEL"):
+            #whole steps run in compiled code, see ppf_cpu_utils.simulate
+            self._numba_kernel = warren1995_kernel
+            self._numba_driver = warren1995_driver
+            ud = self.user_data
+            params = [self.dx, self.dt, ud["T"], 0. if (self.temperature is None) else 1.]
+            params += [ud[key] for key in ["W_A", "W_B", "L_A", "L_B", "T_mA", "T_mB", "D_L", "D_S", "v_m", "R", "y_e", 
+                                           "M_A", "M_B", "ebar", "alpha"]]
+            self._numba_kernel_params = np.array(params, dtype=np.float64)
         
     def simulation_loop(self):
         #code to run each simulation step goes here
@@ -1,3 +1,3 @@
 from .field import Field
-from .simulation import Simulation
+from .simulation import Simulation, refresh_capabilities, get_engine
 from .ppf_utils import *
\ No newline at end of file
@@ -1,9 +1,9 @@
 import sys
 sys.path.insert(0,"../..")
-import pyphasefield as ppf
+from pyphasefield.Engines import Diffusion
 
-sim = ppf.Simulation("data/diffusion_test")
-sim.init_sim_Diffusion([20])
+sim = Diffusion(dimensions=[20], dx=1., dt=0.1, save_path="data/diffusion_test")
+sim.initialize_fields_and_imported_data()
 print(sim.fields[0])
 sim.simulate(100)
 print(sim.fields[0])
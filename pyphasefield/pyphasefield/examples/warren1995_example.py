@@ -1,12 +1,12 @@
 import sys
 sys.path.insert(0,"../..")
-import pyphasefield as ppf
+from pyphasefield.Engines import Warren1995
 
-sim = ppf.Simulation(save_path="data/warren1995_test")
-sim.init_sim_Warren1995([200, 200], diamond_size=10)
+sim = Warren1995(dimensions=[200, 200], dx=4.6e-8, save_path="data/warren1995_test", user_data={"diamond_size":10})
+sim.initialize_fields_and_imported_data()
 print(sim.fields[0])
 print(sim.fields[1])
 sim.simulate(1000)
 print(sim.fields[0])
 print(sim.fields[1])
-sim.plot_field()
\ No newline at end of file
+sim.plot_simulation()
\ No newline at end of file
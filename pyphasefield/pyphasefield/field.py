@@ -3,23 +3,60 @@ from matplotlib.colors import LinearSegmentedColormap
 
 class Field():
     
-    def __init__(self, data=None, simulation=None, name=None, colormap="GnBu"):
+    def __init__(self, data=None, simulation=None, name=None, colormap="GnBu", view=None):
         #add boundary cells
+        #if view is given (an array including the boundary cells, e.g. a slice of Simulation._field_stack), data is copied 
+        #into it and the field becomes a view of it, rather than allocating a new array
         dim = list(data.shape)
         self._slice = []
         for i in range(len(dim)):
             dim[i] += 2
             self._slice.append(slice(1, -1)) #build dynamic slice tuple for access to center cells
         self._slice = tuple(self._slice)
-        fullarray = None
-        fullarray = np.zeros(dim)
-        fullarray[self._slice] += data
-        self.data = fullarray
+        self._data = None
+        self._is_view = False #True if self._data is a view into the stacked fields array of the simulation
+        self._laplacian_buffer = None #reused by laplacian()
+        if(view is None):
+            fullarray = np.zeros(dim)
+            fullarray[self._slice] = data
+            self.data = fullarray
+        else:
+            for i in range(len(dim)):
+                before = (slice(None),)*i
+                view[before+(0,)] = 0.
+                view[before+(-1,)] = 0.
+            view[self._slice] = data
+            self._set_view(view)
         self.name = name
         self._simulation = simulation
         self.colormap = colormap
         
 
+    @property
+    def data(self):
+        return self._data
+    
+    @data.setter
+    def data(self, array):
+        """
+        If this field is a view into Simulation._field_stack, new values are copied into the view 
+        (so the stacked array stays valid), otherwise the array is simply replaced
+        
+        Compiled steps may point the field at a second stacked array (see Simulation.simulate), so keep the Field 
+        rather than the array it returns
+        """
+        if(self._is_view and (array.shape == self._data.shape)):
+            if not(array is self._data):
+                self._data[...] = array
+        else:
+            self._data = array
+            self._is_view = False
+            
+    def _set_view(self, view):
+        """Used by Simulation to point this field at its slice of the stacked fields array"""
+        self._data = view
+        self._is_view = True
+
     def __str__(self):
         return self.data.__str__()
 
@@ -57,14 +94,49 @@ class Field():
             array = np.concatenate((array, temp), axis=0)
         return array
 
-    def laplacian(self):
-        number_of_dimensions = len(self.data.shape)
+    def laplacian(self, out=None):
+        """
+        Returns the laplacian of the field (central differences), an array of the same shape as self.data
+        
+        Terms of the interior cells are summed in place with out=, so besides the result, the only array used is one 
+        interior-sized buffer which is kept between calls. The boundary cells of the result wrap around the array, 
+        exactly as a laplacian built from np.roll of self.data would, so callers which apply a second stencil to the 
+        whole result (e.g. the Crank-Nicolson Cahn-Hilliard engines) see the same values next to the boundary
+        """
+        data = self.data
+        number_of_dimensions = len(data.shape)
         inverse_cell_spacing = 1. / (self._simulation.get_cell_spacing())
         inverse_dx_squared = inverse_cell_spacing ** 2
-        result = (np.roll(self.data, -1, 0) + np.roll(self.data, 1, 0) - 2 * self.data) * inverse_dx_squared
-        for i in range(1, number_of_dimensions):
-            result += (np.roll(self.data, -1, i) + np.roll(self.data, 1, i) - 2 * self.data) * inverse_dx_squared
-        return result
+        if out is None:
+            out = np.zeros(data.shape)
+        result = out[self._slice]
+        center = data[self._slice]
+        if(self._laplacian_buffer is None or self._laplacian_buffer.shape != center.shape):
+            self._laplacian_buffer = np.empty(center.shape)
+        for i in range(number_of_dimensions):
+            #neighbors of the interior cells along axis i
+            high = self._slice[:i] + (slice(2, None),) + self._slice[i+1:]
+            low = self._slice[:i] + (slice(None, -2),) + self._slice[i+1:]
+            if(i == 0):
+                np.add(data[high], data[low], out=result)
+            else:
+                result += data[high]
+                result += data[low]
+        np.multiply(center, 2*number_of_dimensions, out=self._laplacian_buffer)
+        result -= self._laplacian_buffer
+        result *= inverse_dx_squared
+        #boundary cells, one slab (the first or last index along an axis) at a time
+        for i in range(number_of_dimensions):
+            before = (slice(None),)*i
+            n = data.shape[i]
+            for k in (0, n-1):
+                slab = data[before+(k,)]
+                total = data[before+((k+1)%n,)] + data[before+((k-1)%n,)] - (2*number_of_dimensions)*slab
+                #rolling along the other axes never mixes in other indices along axis i, so the slab can be rolled alone
+                for j in range(number_of_dimensions-1):
+                    total += np.roll(slab, -1, j) + np.roll(slab, 1, j)
+                out[before+(k,)] = total*inverse_dx_squared
+        return out
 
     def get_cells(self):
         return self.data[self._slice]
@@ -0,0 +1,17 @@
+"""
+Stand-in for numba, used when numba is not installed
+
+Lets modules which define jit-compiled functions still be imported, the decorated
+functions just run as (slow!) regular python functions
+"""
+
+def jit(*args, **kwargs):
+    if(len(args) == 1 and callable(args[0]) and len(kwargs) == 0):
+        #used as @jit, without arguments
+        return args[0]
+    def decorator(function):
+        return function
+    return decorator
+
+njit = jit
+prange = range
@@ -0,0 +1,443 @@
+import numpy as np
+
+import os
+import warnings
+from contextlib import contextmanager
+
+try:
+    import numba
+    from numba import prange
+    numba_enabled = True
+except:
+    from . import jit_placeholder as numba
+    from .jit_placeholder import prange
+    numba_enabled = False
+
+#cache constants used to size the tiles of the blocked stencil kernels
+CACHE_LINE_SIZE = 64
+
+def _probe_l2_cache_size(default=262144):
+    """Reads the L2 cache size (in bytes) of the first cpu from sysfs (linux only), uses default otherwise"""
+    try:
+        from pathlib import Path
+        for index in sorted(Path("/sys/devices/system/cpu/cpu0/cache").glob("index*")):
+            if((index / "level").read_text().strip() == "2"):
+                size = (index / "size").read_text().strip().upper()
+                if(size.endswith("K")):
+                    return int(size[:-1])*1024
+                elif(size.endswith("M")):
+                    return int(size[:-1])*1024*1024
+                return int(size)
+    except Exception:
+        pass
+    return default
+
+L2_CACHE_SIZE = _probe_l2_cache_size()
+
+def stencil_block_sizes(shape, itemsize=8, block_z=8):
+    """
+    Returns tile sizes (BZ, BY) for blocked 3D stencil sweeps over an array with the given (padded) shape
+    
+    Tiles span whole x-rows (unit stride), BY is chosen so the input tile (with ghost rows) and 
+    the output tile fit in L2 together
+    """
+    row_bytes = shape[-1]*itemsize
+    row_bytes = CACHE_LINE_SIZE*((row_bytes+CACHE_LINE_SIZE-1)//CACHE_LINE_SIZE)
+    rows = L2_CACHE_SIZE//row_bytes
+    block_z = max(1, min(block_z, shape[0]-2))
+    block_y = (rows - 2*(block_z+2))//(2*block_z+2)
+    block_y = max(1, min(block_y, shape[1]-2))
+    return block_z, block_y
+
+HUGEPAGE_SIZE = 2097152
+_MADV_HUGEPAGE = 14 #linux value of MADV_HUGEPAGE
+
+def _madvise_hugepage(array):
+    """Asks the (linux) kernel to back array with transparent huge pages, silently does nothing elsewhere"""
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.madvise(ctypes.c_void_p(array.ctypes.data), ctypes.c_size_t(array.nbytes), ctypes.c_int(_MADV_HUGEPAGE))
+    except Exception:
+        pass
+
+def aligned_empty(shape, dtype=np.float64, alignment=CACHE_LINE_SIZE, hugepages=False):
+    """
+    Equivalent of np.empty(shape, dtype), but the first element is aligned to a multiple of alignment bytes
+    
+    If hugepages is True, the array is aligned to HUGEPAGE_SIZE and the kernel is asked to use transparent 
+    huge pages for it (fewer TLB misses on large arrays). The returned array is a view of a larger uint8 
+    buffer, which stays alive as the .base of the view.
+    """
+    dtype = np.dtype(dtype)
+    if(hugepages):
+        alignment = max(alignment, HUGEPAGE_SIZE)
+    nbytes = int(np.prod(shape))*dtype.itemsize
+    raw = np.empty(nbytes+alignment, dtype=np.uint8)
+    offset = (-raw.ctypes.data) % alignment
+    array = raw[offset:offset+nbytes].view(dtype).reshape(shape)
+    if(hugepages):
+        _madvise_hugepage(raw[offset:offset+nbytes])
+    return array
+
+def simulation_threads(sim):
+    """
+    Returns the number of threads the parallel (prange) loops of sim's compiled kernels run on, None if the 
+    framework of sim does not run compiled CPU kernels (or numba is not installed)
+    
+    CPU_SERIAL uses a single thread. CPU_PARALLEL uses sim._num_threads if set, otherwise OMP_NUM_THREADS 
+    if set, otherwise every thread numba was started with (NUMBA_NUM_THREADS, the cpu count by default)
+    """
+    if not numba_enabled:
+        return None
+    if(sim._framework == "CPU_SERIAL"):
+        threads = 1
+    elif(sim._framework == "CPU_PARALLEL"):
+        threads = sim._num_threads
+        if(threads is None and "OMP_NUM_THREADS" in os.environ):
+            try:
+                threads = int(os.environ["OMP_NUM_THREADS"].split(",")[0])
+            except ValueError:
+                threads = None
+        if(threads is None):
+            threads = numba.config.NUMBA_NUM_THREADS
+    else:
+        return None
+    return max(1, min(threads, numba.config.NUMBA_NUM_THREADS))
+
+@contextmanager
+def simulation_threads_set(sim):
+    """
+    Runs the body of the with statement with numba's thread count set to simulation_threads(sim), and restores the 
+    previous count afterwards, so simulations using different thread counts (and any other numba code) in the same 
+    process do not change each other's setting
+    """
+    threads = simulation_threads(sim)
+    if(threads is None):
+        yield
+        return
+    previous = numba.get_num_threads()
+    numba.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        numba.set_num_threads(previous)
+
+@numba.njit(parallel=True, cache=True)
+def first_touch_fill(stack, value):
+    """
+    Fills a stacked fields array (nfields, *dims) with value, in parallel over the first spatial axis
+    
+    Memory pages are placed on the NUMA node of the thread which first writes to them. Filling in parallel over 
+    the same axis that the prange loops of the stencil kernels use puts each slab near the thread that sweeps it, 
+    instead of every page on the node of the (single) thread which would otherwise initialize the array
+    """
+    a = stack.reshape((stack.shape[0], stack.shape[1], stack.size//(stack.shape[0]*stack.shape[1])))
+    for j in prange(a.shape[1]):
+        for i in range(a.shape[0]):
+            for k in range(a.shape[2]):
+                a[i, j, k] = value
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def renormalize_and_clip(stack, q_start, q_end, phi_index, phi_min, phi_max):
+    """
+    In a single in-place pass over a stacked fields array (nfields, *dims):
+        * fields q_start to q_end-1 (quaternion components) are renormalized to unit length, if q_end > q_start
+        * field phi_index (order parameter) is clipped to [phi_min, phi_max], if phi_index >= 0
+    """
+    a = stack.reshape((stack.shape[0], stack.shape[1], stack.size//(stack.shape[0]*stack.shape[1])))
+    for j in prange(a.shape[1]):
+        for k in range(a.shape[2]):
+            if(q_end > q_start):
+                norm2 = 0.
+                for q in range(q_start, q_end):
+                    norm2 += a[q, j, k]*a[q, j, k]
+                inverse_norm = 1./np.sqrt(norm2)
+                for q in range(q_start, q_end):
+                    a[q, j, k] *= inverse_norm
+            if(phi_index >= 0):
+                a[phi_index, j, k] = max(phi_min, min(phi_max, a[phi_index, j, k]))
+
+def min_max(array):
+    """
+    Returns (np.min(array), np.max(array)), reading the array from main memory only once
+    
+    The array is reduced in blocks which fit in L2, so the max of each block reads it from cache right after the min 
+    loaded it. Faster than a single-pass compiled loop, which numba cannot vectorize as well as numpy's reductions
+    """
+    a = array.reshape(-1)
+    block = max(1, L2_CACHE_SIZE//a.itemsize)
+    if(a.size <= block):
+        return np.min(a), np.max(a)
+    amin = a[0]
+    amax = a[0]
+    for start in range(0, a.size, block):
+        b = a[start:start+block]
+        #np.minimum/np.maximum propagate NaNs like np.min/np.max
+        amin = np.minimum(amin, b.min())
+        amax = np.maximum(amax, b.max())
+    return amin, amax
+
+#integer codes for the boundary condition types, strings cannot be cheaply compared in compiled code
+BC_PERIODIC = 0
+BC_NEUMANN = 1
+BC_DIRCHLET = 2
+BC_NONE = -1 #boundary cells are left as they are
+
+def boundary_condition_codes(sim):
+    """Converts sim._boundary_conditions_type into an array of integer codes, one per dimension"""
+    bc = sim._boundary_conditions_type
+    if not isinstance(bc, list):
+        l = []
+        for i in range(len(sim.dimensions)):
+            l.append(bc)
+        bc = l
+    codes = np.zeros(len(bc), dtype=np.int64)
+    for i in range(len(bc)):
+        if(bc[i] == "PERIODIC"):
+            codes[i] = BC_PERIODIC
+        elif(bc[i] == "NEUMANN"):
+            codes[i] = BC_NEUMANN
+        elif(bc[i] == "DIRCHLET"):
+            codes[i] = BC_DIRCHLET
+        elif(bc[i] is None):
+            codes[i] = BC_NONE
+        else:
+            raise ValueError("Unknown boundary condition type: "+str(bc[i]))
+    return codes
+
+@numba.njit(cache=True)
+def apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx):
+    """
+    Applies boundary conditions to the stacked fields array, shape (nfields, *dims+2)
+
+    Each axis is viewed as a (before, axis, after) array, so the same code works for 1, 2, or 3D
+    """
+    for i in range(len(bc_codes)):
+        before = 1
+        for j in range(i+1):
+            before *= fields.shape[j]
+        n = fields.shape[i+1]
+        after = fields.size//(before*n)
+        f = fields.reshape((before, n, after))
+        b = bcarray.reshape((before, n, after))
+        #explicit loops, slice expressions would allocate a temporary array per face
+        #the type is checked once per axis rather than per cell. For every axis but the last, each face is copied by 
+        #unit stride inner loops. On the last axis (after == 1) faces are strided, but the high face of one row and the 
+        #low face of the next are adjacent, so both faces are done in the same loop to share cache lines
+        code = bc_codes[i]
+        if(after == 1):
+            if(code == BC_PERIODIC):
+                for j in range(before):
+                    f[j, 0, 0] = f[j, n-2, 0]
+                    f[j, n-1, 0] = f[j, 1, 0]
+            elif(code == BC_NEUMANN):
+                for j in range(before):
+                    f[j, 0, 0] = f[j, 1, 0] - dx*b[j, 0, 0]
+                    f[j, n-1, 0] = f[j, n-2, 0] + dx*b[j, n-1, 0]
+            elif(code == BC_DIRCHLET):
+                for j in range(before):
+                    f[j, 0, 0] = b[j, 0, 0]
+                    f[j, n-1, 0] = b[j, n-1, 0]
+        elif(code == BC_PERIODIC):
+            for j in range(before):
+                for k in range(after):
+                    f[j, 0, k] = f[j, n-2, k]
+                for k in range(after):
+                    f[j, n-1, k] = f[j, 1, k]
+        elif(code == BC_NEUMANN):
+            for j in range(before):
+                for k in range(after):
+                    f[j, 0, k] = f[j, 1, k] - dx*b[j, 0, k]
+                for k in range(after):
+                    f[j, n-1, k] = f[j, n-2, k] + dx*b[j, n-1, k]
+        elif(code == BC_DIRCHLET):
+            for j in range(before):
+                for k in range(after):
+                    f[j, 0, k] = b[j, 0, k]
+                for k in range(after):
+                    f[j, n-1, k] = b[j, n-1, k]
+
+@numba.njit(parallel=True, cache=True)
+def laplacian_sum_3d(a, out, weights):
+    """
+    out = sum over the axes of weights[axis]*(a[next] + a[previous] - 2*a) for the interior cells of the padded 3D
+    arrays a and out (the unscaled discrete laplacian, when all weights are 1). Lower dimensional arrays are
+    given leading axes of one interior cell and weight 0. The loop over the first two axes is collapsed, so
+    2D arrays are still split between threads
+    """
+    ny = a.shape[1]-2
+    for ij in prange((a.shape[0]-2)*ny):
+        i = ij//ny+1
+        j = ij%ny+1
+        for k in range(1, a.shape[2]-1):
+            center = 2.*a[i, j, k]
+            out[i, j, k] = (weights[0]*(a[i+1, j, k] + a[i-1, j, k] - center) +
+                            weights[1]*(a[i, j+1, k] + a[i, j-1, k] - center) +
+                            weights[2]*(a[i, j, k+1] + a[i, j, k-1] - center))
+
+class HomogeneousLaplacian:
+    """
+    Matrix-free discrete laplacian (unscaled, see laplacian_sum_3d) of arrays with the shape of the interior cells of
+    sim, for the homogeneous version of its boundary conditions (periodic axes wrap around, neumann axes have no
+    flux, dirchlet axes have zero boundary values), which is what implicit solves for the interior cells need
+
+    The array is copied into a padded scratch buffer, allocated once, and the boundary cells are filled by
+    apply_boundary_conditions_compiled with an all-zero boundary array
+    """
+    def __init__(self, sim):
+        dims = list(sim.dimensions)
+        if(sim._bc_codes is None):
+            sim._bc_codes = boundary_condition_codes(sim)
+        self.shape = tuple(dims)
+        self.dim = len(dims)
+        self._padded_shape = tuple([1]*(3-len(dims)) + dims)
+        self._weights = np.array([0.]*(3-len(dims)) + [1.]*len(dims))
+        self._bc_codes = np.array([BC_PERIODIC]*(3-len(dims)) + list(sim._bc_codes), dtype=np.int64)
+        self._buffer = np.zeros([1]+[n+2 for n in self._padded_shape])
+        self._buffer_out = np.zeros_like(self._buffer)
+        self._zero_boundaries = np.zeros_like(self._buffer)
+
+    def __call__(self, x):
+        self._buffer[0, 1:-1, 1:-1, 1:-1] = x.reshape(self._padded_shape)
+        apply_boundary_conditions_compiled(self._buffer, self._zero_boundaries, self._bc_codes, 1.)
+        laplacian_sum_3d(self._buffer[0], self._buffer_out[0], self._weights)
+        return self._buffer_out[0, 1:-1, 1:-1, 1:-1].reshape(self.shape).copy()
+
+    def boundary_term(self, sim, field=0):
+        """
+        Returns the part of the laplacian of the interior cells of the given field of sim that comes from its 
+        boundary values (dirchlet values, neumann fluxes), so the laplacian with the boundary conditions of sim is 
+        self(x) + boundary_term. All zeros for periodic and zero flux boundaries
+        """
+        dim = self.dim
+        self._buffer[...] = 0.
+        self._zero_boundaries[(0,)+(1,)*(3-dim)] = sim._boundary_conditions_array[field]
+        dx = 0. if (sim.dx is None) else float(sim.dx)
+        apply_boundary_conditions_compiled(self._buffer, self._zero_boundaries, self._bc_codes, dx)
+        self._zero_boundaries[...] = 0.
+        laplacian_sum_3d(self._buffer[0], self._buffer_out[0], self._weights)
+        return self._buffer_out[0, 1:-1, 1:-1, 1:-1].reshape(self.shape).copy()
+
+    def diagonal(self):
+        """Diagonal entry of the laplacian away from non-periodic boundaries, -2 per dimension"""
+        return -2.*self.dim
+
+def homogeneous_laplacian(sim):
+    """Returns the HomogeneousLaplacian of sim, built on first use and kept in sim._gmres_laplacian"""
+    laplacian = sim._gmres_laplacian
+    if(laplacian is None or laplacian.shape != tuple(sim.dimensions)):
+        laplacian = HomogeneousLaplacian(sim)
+        sim._gmres_laplacian = laplacian
+    return laplacian
+
+def _gmres_tolerance_keyword():
+    #scipy 1.12 renamed the relative tolerance of its iterative solvers from tol to rtol
+    import inspect
+    from scipy.sparse.linalg import gmres
+    return "rtol" if ("rtol" in inspect.signature(gmres).parameters) else "tol"
+
+def gmres_solve(operator, rhs, diagonal, x0=None, restart=30, rtol=1e-8):
+    """
+    Solves operator(x) = rhs with scipy's restarted GMRES, without assembling the matrix of the operator
+
+    operator maps arrays with the shape of rhs to arrays of the same shape (e.g. a stencil built on a
+    HomogeneousLaplacian). diagonal (an array of that shape, or a scalar) is the diagonal of the operator, its
+    inverse is used as a Jacobi preconditioner. Returns (x, exit code of gmres, 0 if it converged), and warns 
+    if gmres did not converge
+    """
+    from scipy.sparse.linalg import LinearOperator, gmres
+    global _GMRES_TOLERANCE_KEYWORD
+    if(_GMRES_TOLERANCE_KEYWORD is None):
+        _GMRES_TOLERANCE_KEYWORD = _gmres_tolerance_keyword()
+    shape = rhs.shape
+    n = rhs.size
+    A = LinearOperator((n, n), matvec=lambda v: operator(v.reshape(shape)).ravel(), dtype=np.float64)
+    inverse_diagonal = np.broadcast_to(1./np.asarray(diagonal, dtype=np.float64), shape).ravel()
+    M = LinearOperator((n, n), matvec=lambda v: inverse_diagonal*v.ravel(), dtype=np.float64)
+    if(x0 is None):
+        x0 = rhs
+    kwargs = {_GMRES_TOLERANCE_KEYWORD: rtol}
+    x, exit_code = gmres(A, rhs.ravel(), x0=np.ravel(x0), atol=0., restart=restart, M=M, **kwargs)
+    if(exit_code > 0):
+        warnings.warn("GMRES did not converge to a relative tolerance of "+str(rtol)+" in "+str(exit_code)+
+                      " iterations, try a smaller timestep or a larger restart", RuntimeWarning)
+    elif(exit_code < 0):
+        raise ValueError("GMRES was given an illegal input or broke down (exit code "+str(exit_code)+")")
+    return x.reshape(shape), exit_code
+
+_GMRES_TOLERANCE_KEYWORD = None
+
+@numba.njit(cache=True)
+def simulate_compiled(kernel, fields, fields_out, temperature, params, bcarray, bc_codes, dx, dT, number_of_timesteps):
+    """
+    Runs number_of_timesteps steps of kernel entirely within compiled code
+
+    kernel(fields, fields_out, temperature, temperature_offset, params) must write the new values of 
+    *every* field into the interior cells of fields_out. The two arrays are swapped after every step, 
+    the array containing the final values is returned first.
+    
+    dT is the change in temperature per timestep (0 if the thermal field does not change). Rather than 
+    making a separate pass over the thermal field each step, the temperature of a cell during a step is 
+    temperature[cell] + temperature_offset, computed by the kernel in the same loop iteration that reads 
+    the cell. The accumulated offset is added to the thermal field once, at the end, by simulate.
+    """
+    for i in range(number_of_timesteps):
+        kernel(fields, fields_out, temperature, dT*i, params)
+        fields, fields_out = fields_out, fields
+        apply_boundary_conditions_compiled(fields, bcarray, bc_codes, dx)
+    return fields, fields_out
+
+def uses_compiled_loop(sim):
+    """Checks if the simulation can be evolved using simulate(sim, number_of_timesteps)"""
+    if not numba_enabled:
+        return False
+    if(sim._numba_kernel is None):
+        return False
+    if(sim._temperature_type == "XDMF_FILE"):
+        return False
+    return True
+
+def simulate(sim, number_of_timesteps):
+    """
+    CPU equivalent of the per-step loop in Simulation.simulate, using sim._numba_kernel
+
+    The compiled driver works directly on sim._field_stack, the array which each Field.data is a view of, 
+    and sim._field_stack_out, which is allocated once and reused by every call
+    
+    simulate_compiled receives the kernel as an argument (a first-class function), which numba cannot cache 
+    between runs, so it is recompiled in every new process. Engines can avoid this by also setting 
+    sim._numba_driver, a module-level njit(cache=True) function with the signature of simulate_compiled 
+    minus the kernel, which runs the same loop calling the kernel directly
+    """
+    if(sim._field_stack_out is None or sim._field_stack_out.shape != sim._field_stack.shape):
+        sim._field_stack_out = sim._allocate_field_stack(sim._field_stack.shape)
+    fields = sim._field_stack
+    fields_out = sim._field_stack_out
+    dT = 0.
+    if(sim.temperature is None):
+        temperature = np.zeros([1]*len(sim.dimensions))
+    elif(sim._temperature_is_scalar):
+        #zero-strided view of a single value, kernels reading the temperature of any cell read the same address
+        temperature = np.lib.stride_tricks.as_strided(sim.temperature.data.reshape(-1)[:1], shape=sim.temperature.data.shape, 
+                                                      strides=(0,)*len(sim.dimensions))
+    else:
+        temperature = sim.temperature.data
+        if(sim._temperature_type == "LINEAR_GRADIENT"):
+            dT = float(sim._dTdt*sim.dt)
+    if(sim._bc_codes is None):
+        sim._bc_codes = boundary_condition_codes(sim)
+    args = (fields, fields_out, temperature, sim._numba_kernel_params, sim._boundary_conditions_array, 
+            sim._bc_codes, float(sim.dx), dT, number_of_timesteps)
+    with simulation_threads_set(sim):
+        if(sim._numba_driver is None):
+            fields, fields_out = simulate_compiled(sim._numba_kernel, *args)
+        else:
+            fields, fields_out = sim._numba_driver(*args)
+    if(dT != 0.):
+        #a uniform offset does not change the boundary cells relative to the interior, no need to reapply them
+        sim.temperature.data += dT*number_of_timesteps
+    if(number_of_timesteps % 2 == 1):
+        #final values are in the second buffer
+        sim._swap_field_stacks()
+    sim.time_step_counter += number_of_timesteps
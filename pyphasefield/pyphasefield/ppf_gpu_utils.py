@@ -4,321 +4,42 @@ import matplotlib.pyplot as plt
 import numpy as np
 np.set_printoptions(threshold=np.inf)
 import math
+import json
+import os
+from pathlib import Path
 from numba.cuda.random import create_xoroshiro128p_states, xoroshiro128p_uniform_float32
 import meshio as mio
 from . import ppf_utils
-
-@cuda.jit
-def periodic_bc_1D_x_kernel(fields):
-    startx = cuda.grid(1)     
-    stridex = cuda.gridsize(1) 
-
-    for i in range(startx, fields.shape[0], stridex):
-        fields[i][0] = fields[i][fields.shape[1]-2]
-        fields[i][fields.shape[1]-1] = fields[i][1]
-        
-@cuda.jit
-def dirchlet_bc_1D_x_kernel(fields, bcarray):
-    startx = cuda.grid(1)     
-    stridex = cuda.gridsize(1) 
-    
-    for i in range(startx, fields.shape[0], stridex):
-        fields[i][0] = bcarray[i][0]
-        fields[i][fields.shape[1]-1] = bcarray[i][fields.shape[1]-1]
-            
-@cuda.jit
-def neumann_bc_1D_x_kernel(fields, bcarray, dx):
-    startx = cuda.grid(1)     
-    stridex = cuda.gridsize(1) 
+from . import ppf_cpu_utils
+from .ppf_cpu_utils import BC_PERIODIC, BC_NEUMANN, BC_DIRCHLET, BC_NONE
+
+#the kernels of this module are cached on disk (like the njit(cache=True) functions of ppf_cpu_utils), so 
+#new processes load them rather than compiling them again
+@cuda.jit(cache=True)
+def boundary_conditions_axis_kernel(fields, bcarray, code, dx):
+    """
+    Applies one type of boundary condition (ppf_cpu_utils.BC_*) along one axis
     
-    for i in range(startx, fields.shape[0], stridex):
-        fields[i][0] = fields[i][1] - dx*bcarray[i][0]
-        fields[i][fields.shape[1]-1] = fields[i][fields.shape[1]-2] + dx*bcarray[i][fields.shape[1]-1]
-
-@cuda.jit
-def periodic_bc_2D_x_kernel(fields):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(starty, fields.shape[1], stridey):
-        for j in range(startx, fields.shape[0], stridex):
-            fields[j][i][0] = fields[j][i][fields.shape[2]-2]
-            fields[j][i][fields.shape[2]-1] = fields[j][i][1]
-            
-@cuda.jit
-def periodic_bc_2D_y_kernel(fields):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, fields.shape[2], stridex):
-        for j in range(starty, fields.shape[0], stridey):
-            fields[j][0][i] = fields[j][fields.shape[1]-2][i]
-            fields[j][fields.shape[1]-1][i] = fields[j][1][i]
-            
-@cuda.jit
-def dirchlet_bc_2D_x_kernel(fields, bcarray):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(starty, fields.shape[1], stridey):
-        for j in range(startx, fields.shape[0], stridex):
-            fields[j][i][0] = bcarray[j][i][0]
-            fields[j][i][fields.shape[2]-1] = bcarray[j][i][fields.shape[2]-1]
-            
-@cuda.jit
-def dirchlet_bc_2D_y_kernel(fields, bcarray):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, fields.shape[2], stridex):
-        for j in range(starty, fields.shape[0], stridey):
-            fields[j][0][i] = bcarray[j][0][i]
-            fields[j][fields.shape[1]-1][i] = bcarray[j][fields.shape[1]-1][i]
-            
-@cuda.jit
-def neumann_bc_2D_x_kernel(fields, bcarray, dx):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(starty, fields.shape[1], stridey):
-        for j in range(startx, fields.shape[0], stridex):
-            fields[j][i][0] = fields[j][i][1] - dx*bcarray[j][i][0]
-            fields[j][i][fields.shape[2]-1] = fields[j][i][fields.shape[2]-2] + dx*bcarray[j][i][fields.shape[2]-1]
-            
-@cuda.jit
-def neumann_bc_2D_y_kernel(fields, bcarray, dx):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, fields.shape[2], stridex):
-        for j in range(starty, fields.shape[0], stridey):
-            fields[j][0][i] = fields[j][1][i] - dx*bcarray[j][0][i]
-            fields[j][fields.shape[1]-1][i] = fields[j][fields.shape[1]-2][i] + dx*bcarray[j][fields.shape[1]-1][i]
-            
-@cuda.jit
-def periodic_bc_3D_x_kernel(fields):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(starty, fields.shape[2], stridey):
-        for j in range(startz, fields.shape[1], stridez):
-            for k in range(startx, fields.shape[0], stridex):
-                fields[k][j][i][0] = fields[k][j][i][fields.shape[3]-2]
-                fields[k][j][i][fields.shape[3]-1] = fields[k][j][i][1]
-            
-@cuda.jit
-def periodic_bc_3D_y_kernel(fields):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(startx, fields.shape[3], stridex):
-        for j in range(startz, fields.shape[1], stridez):
-            for k in range(starty, fields.shape[0], stridey):
-                fields[k][j][0][i] = fields[k][j][fields.shape[2]-2][i]
-                fields[k][j][fields.shape[2]-1][i] = fields[k][j][1][i]
-            
-@cuda.jit
-def periodic_bc_3D_z_kernel(fields):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, fields.shape[3], stridex):
-        for j in range(starty, fields.shape[2], stridey):
-            for k in range(startz, fields.shape[0], stridez):
-                fields[k][0][j][i] = fields[k][fields.shape[1]-2][j][i]
-                fields[k][fields.shape[1]-1][j][i] = fields[k][1][j][i]
-                
-@cuda.jit
-def dirchlet_bc_3D_x_kernel(fields, bcarray):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(starty, fields.shape[2], stridey):
-        for j in range(startz, fields.shape[1], stridez):
-            for k in range(startx, fields.shape[0], stridex):
-                fields[k][j][i][0] = bcarray[k][j][i][0]
-                fields[k][j][i][fields.shape[3]-1] = bcarray[k][j][i][fields.shape[3]-1]
-            
-@cuda.jit
-def dirchlet_bc_3D_y_kernel(fields, bcarray):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(startx, fields.shape[3], stridex):
-        for j in range(startz, fields.shape[1], stridez):
-            for k in range(starty, fields.shape[0], stridey):
-                fields[k][j][0][i] = bcarray[k][j][0][i]
-                fields[k][j][fields.shape[2]-1][i] = bcarray[k][j][fields.shape[2]-1][i]
-            
-@cuda.jit
-def dirchlet_bc_3D_z_kernel(fields, bcarray):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, fields.shape[3], stridex):
-        for j in range(starty, fields.shape[2], stridey):
-            for k in range(startz, fields.shape[0], stridez):
-                fields[k][0][j][i] = bcarray[k][0][j][i]
-                fields[k][fields.shape[1]-1][j][i] = bcarray[k][fields.shape[1]-1][j][i]
-                
-@cuda.jit
-def neumann_bc_3D_x_kernel(fields):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(starty, fields.shape[2], stridey):
-        for j in range(startz, fields.shape[1], stridez):
-            for k in range(startx, fields.shape[0], stridex):
-                fields[k][j][i][0] = fields[k][j][i][1] - dx*bcarray[k][j][i][0]
-                fields[k][j][i][fields.shape[3]-1] = fields[k][j][i][fields.shape[3]-2] + dx*bcarray[k][j][i][fields.shape[3]-1]
-            
-@cuda.jit
-def neumann_bc_3D_y_kernel(fields):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(startx, fields.shape[3], stridex):
-        for j in range(startz, fields.shape[1], stridez):
-            for k in range(starty, fields.shape[0], stridey):
-                fields[k][j][0][i] = fields[k][j][1][i] - dx*bcarray[k][j][0][i]
-                fields[k][j][fields.shape[2]-1][i] = fields[k][j][fields.shape[2]-2][i] + dx*bcarray[k][j][fields.shape[2]-1][i]
-            
-@cuda.jit
-def neumann_bc_3D_z_kernel(fields):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, fields.shape[3], stridex):
-        for j in range(starty, fields.shape[2], stridey):
-            for k in range(startz, fields.shape[0], stridez):
-                fields[k][0][j][i] = fields[k][1][j][i] - dx*bcarray[k][0][j][i]
-                fields[k][fields.shape[1]-1][j][i] = fields[k][fields.shape[1]-2][j][i] + dx*bcarray[k][fields.shape[1]-1][j][i]
-                
-@cuda.jit
-def periodic_bc_1D_x_single_kernel(field):
-    startx = cuda.grid(1)     
-    stridex = cuda.gridsize(1) 
-
-    for i in range(startx, 1, stridex):
-        field[0] = field[field.shape[0]-2]
-        field[field.shape[0]-1] = field[1]
-        
-@cuda.jit
-def neumann_bc_1D_x_single_kernel(field):
-    startx = cuda.grid(1)     
-    stridex = cuda.gridsize(1) 
+    fields and bcarray are (before, axis, after) views of the arrays, so the same kernel works for every axis of 
+    1, 2, or 3D simulations. Consecutive threads handle consecutive (contiguous) values of the last index
+    """
+    startk, startj = cuda.grid(2)
+    stridek, stridej = cuda.gridsize(2)
+    n = fields.shape[1]
     
-    for i in range(startx, 1, stridex):
-        field[0] = field[1]
-        field[field.shape[0]-1] = field[field.shape[0]-2]
-
-@cuda.jit
-def periodic_bc_2D_x_single_kernel(field):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(starty, field.shape[0], stridey):
-        for j in range(startx, 1, stridex):
-            field[i][0] = field[i][field.shape[1]-2]
-            field[i][field.shape[1]-1] = field[i][1]
-            
-@cuda.jit
-def periodic_bc_2D_y_single_kernel(field):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, field.shape[1], stridex):
-        for j in range(starty, 1, stridey):
-            field[0][i] = field[field.shape[0]-2][i]
-            field[field.shape[0]-1][i] = field[1][i]
-            
-@cuda.jit
-def neumann_bc_2D_x_single_kernel(field):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(starty, field.shape[0], stridey):
-        for j in range(startx, 1, stridex):
-            field[i][0] = field[i][1]
-            field[i][field.shape[1]-1] = field[i][field.shape[1]-2]
-            
-@cuda.jit
-def neumann_bc_2D_y_single_kernel(field):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, field.shape[1], stridex):
-        for j in range(starty, 1, stridey):
-            field[0][i] = field[1][i]
-            field[field.shape[0]-1][i] = field[field.shape[0]-2][i]
-            
-@cuda.jit
-def periodic_bc_3D_x_single_kernel(field):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(starty, field.shape[1], stridey):
-        for j in range(startz, field.shape[0], stridez):
-            for k in range(startx, 1, stridex):
-                field[j][i][0] = field[j][i][field.shape[2]-2]
-                field[j][i][field.shape[2]-1] = field[j][i][1]
-            
-@cuda.jit
-def periodic_bc_3D_y_single_kernel(field):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(startx, field.shape[2], stridex):
-        for j in range(startz, field.shape[0], stridez):
-            for k in range(starty, 1, stridey):
-                field[j][0][i] = field[j][field.shape[1]-2][i]
-                field[j][field.shape[1]-1][i] = field[j][1][i]
-            
-@cuda.jit
-def periodic_bc_3D_z_single_kernel(field):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, field.shape[2], stridex):
-        for j in range(starty, field.shape[1], stridey):
-            for k in range(startz, 1, stridez):
-                field[0][j][i] = field[field.shape[0]-2][j][i]
-                field[field.shape[0]-1][j][i] = field[1][j][i]
-                
-@cuda.jit
-def neumann_bc_3D_x_single_kernel(field):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(starty, field.shape[1], stridey):
-        for j in range(startz, field.shape[0], stridez):
-            for k in range(startx, 1, stridex):
-                field[j][i][0] = field[j][i][1]
-                field[j][i][field.shape[2]-1] = field[j][i][field.shape[2]-2]
-            
-@cuda.jit
-def neumann_bc_3D_y_single_kernel(field):
-    startx, starty, startz = cuda.grid(3)
-    stridex, stridey, stridez = cuda.gridsize(3)
-
-    for i in range(startx, field.shape[2], stridex):
-        for j in range(startz, field.shape[0], stridez):
-            for k in range(starty, 1, stridey):
-                field[j][0][i] = field[j][1][i]
-                field[j][field.shape[1]-1][i] = field[j][field.shape[1]-2][i]
-            
-@cuda.jit
-def neumann_bc_3D_z_single_kernel(field):
-    startx, starty = cuda.grid(2)
-    stridex, stridey = cuda.gridsize(2)
-
-    for i in range(startx, field.shape[2], stridex):
-        for j in range(starty, field.shape[1], stridey):
-            for k in range(startz, 1, stridez):
-                field[0][j][i] = field[1][j][i]
-                field[field.shape[0]-1][j][i] = field[field.shape[0]-2][j][i]
-
-@cuda.jit
+    for j in range(startj, fields.shape[0], stridej):
+        for k in range(startk, fields.shape[2], stridek):
+            if(code == BC_PERIODIC):
+                fields[j][0][k] = fields[j][n-2][k]
+                fields[j][n-1][k] = fields[j][1][k]
+            elif(code == BC_NEUMANN):
+                fields[j][0][k] = fields[j][1][k] - dx*bcarray[j][0][k]
+                fields[j][n-1][k] = fields[j][n-2][k] + dx*bcarray[j][n-1][k]
+            elif(code == BC_DIRCHLET):
+                fields[j][0][k] = bcarray[j][0][k]
+                fields[j][n-1][k] = bcarray[j][n-1][k]
+
+@cuda.jit(cache=True)
 def update_thermal_gradient_1D_kernel(T, dTdt, dt):
     startx = cuda.grid(1)
     stridex = cuda.gridsize(1)
@@ -329,7 +50,7 @@ def update_thermal_gradient_1D_kernel(T, dTdt, dt):
     for i in range(startx, T.shape[0], stridex):
             T[i] += dT
             
-@cuda.jit
+@cuda.jit(cache=True)
 def update_thermal_gradient_2D_kernel(T, dTdt, dt):
     startx, starty = cuda.grid(2)
     stridex, stridey = cuda.gridsize(2)
@@ -341,7 +62,7 @@ def update_thermal_gradient_2D_kernel(T, dTdt, dt):
         for j in range(startx, T.shape[1], stridex):
             T[i][j] += dT
 
-@cuda.jit
+@cuda.jit(cache=True)
 def update_thermal_gradient_3D_kernel(T, dTdt, dt):
     startx, starty, startz = cuda.grid(3)
     stridex, stridey, startz = cuda.gridsize(3)
@@ -354,7 +75,7 @@ def update_thermal_gradient_3D_kernel(T, dTdt, dt):
             for k in range(startx, T.shape[2], stridex):
                 T[i][j][k] += dT
             
-@cuda.jit
+@cuda.jit(cache=True)
 def update_thermal_file_1D_kernel(T, T0, T1, start, end, current):
     startx = cuda.grid(1)
     stridex = cuda.gridsize(1)
@@ -366,7 +87,7 @@ def update_thermal_file_1D_kernel(T, T0, T1, start, end, current):
     for i in range(startx+1, T.shape[0]-1, stridex):
         T[i] = T0[i-1]*ratio_T0 + T1[i-1]*ratio_T1
 
-@cuda.jit
+@cuda.jit(cache=True)
 def update_thermal_file_2D_kernel(T, T0, T1, start, end, current):
     startx, starty = cuda.grid(2)
     stridex, stridey = cuda.gridsize(2)
@@ -379,7 +100,7 @@ def update_thermal_file_2D_kernel(T, T0, T1, start, end, current):
         for j in range(startx+1, T.shape[1]-1, stridex):
             T[i][j] = T0[i-1][j-1]*ratio_T0 + T1[i-1][j-1]*ratio_T1
             
-@cuda.jit
+@cuda.jit(cache=True)
 def update_thermal_file_3D_kernel(T, T0, T1, start, end, current):
     startx, starty, startz = cuda.grid(3)
     stridex, stridey, stridez = cuda.gridsize(3)
@@ -393,166 +114,351 @@ def update_thermal_file_3D_kernel(T, T0, T1, start, end, current):
             for j in range(startx+1, T.shape[2]-1, stridex):
                 T[i][j][k] = T0[i-1][j-1][k-1]*ratio_T0 + T1[i-1][j-1][k-1]*ratio_T1
             
+def pinned_empty(shape, dtype=np.float64):
+    """Equivalent of np.empty(shape, dtype), in page-locked host memory which can be copied to and from the GPU directly"""
+    return cuda.pinned_array(shape, dtype=dtype)
+
+def create_streams(sim):
+    """
+    Gives the simulation its own compute stream, for the engine, boundary condition and thermal kernels, next to 
+    the copy stream used for copies from the GPU to the host. Copies queued with _queue_copy_from_GPU then overlap 
+    with the kernels of the following steps, rather than waiting for (and holding up) the default stream
+    Engines which call this must launch their kernels on compute_stream(sim), and call wait_for_copies_from_GPU 
+    before overwriting an array which may be being copied
+    """
+    if(sim._compute_stream is None):
+        sim._compute_stream = cuda.stream()
+    if(sim._copy_stream is None):
+        sim._copy_stream = cuda.stream()
+        
+def compute_stream(sim):
+    """The stream GPU kernels of the simulation are launched on"""
+    if(sim._compute_stream is None):
+        if not(hasattr(cuda, "default_stream")):
+            #the CUDA simulator has no default stream object, and runs every kernel and copy in order anyway
+            return cuda.stream()
+        return cuda.default_stream()
+    return sim._compute_stream
+    
+def _queue_copy_from_GPU(sim, device_array, host_buffer):
+    """
+    Copies device_array into host_buffer on sim._copy_stream, after the kernels queued so far, and returns an event 
+    recorded once the copy is done. Neither the host nor (with a compute stream, see create_streams) the following 
+    kernels wait for the copy
+    """
+    if(sim._copy_stream is None):
+        sim._copy_stream = cuda.stream()
+    stream = sim._copy_stream
+    if not(sim._compute_stream is None):
+        computed = cuda.event()
+        computed.record(sim._compute_stream)
+        computed.wait(stream)
+    device_array.copy_to_host(host_buffer, stream=stream)
+    copied = cuda.event()
+    copied.record(stream)
+    if not(sim._compute_stream is None):
+        #only the last copy out of each array needs to be waited for, copies on the stream run in order
+        sim._pending_copies = [(event, array) for (event, array) in sim._pending_copies if not(array is device_array)]
+        sim._pending_copies.append((copied, device_array))
+    return copied
+    
+def wait_for_copies_from_GPU(sim, device_array):
+    """
+    Makes the compute stream wait for queued copies out of device_array before running the kernels launched after 
+    this call. The wait happens on the GPU, the host does not block
+    """
+    remaining = []
+    for event, array in sim._pending_copies:
+        if(array is device_array):
+            event.wait(sim._compute_stream)
+        else:
+            remaining.append((event, array))
+    sim._pending_copies = remaining
+            
 def send_fields_to_GPU(sim):
     if not (sim.temperature is None):
         sim._temperature_gpu_device = cuda.to_device(sim.temperature.data)
         if(sim._temperature_type == "XDMF_FILE"):
-            sim._t_file_gpu_devices[0] = cuda.to_device(sim._t_file_arrays[0])
-            sim._t_file_gpu_devices[1] = cuda.to_device(sim._t_file_arrays[1])
-    fields = []
-    for i in range(len(sim.fields)):
-        fields.append(sim.fields[i].data)
-    fields = np.array(fields)
-    sim._fields_gpu_device = cuda.to_device(fields)
-    sim._fields_out_gpu_device = cuda.device_array_like(fields)
+            if(sim._t_file_lut is None):
+                sim._t_file_gpu_devices[0] = cuda.to_device(sim._t_file_arrays[0])
+                sim._t_file_gpu_devices[1] = cuda.to_device(sim._t_file_arrays[1])
+            else:
+                send_temperature_lut_to_GPU(sim)
+    #every field is a view into sim._field_stack, so all fields are sent in a single (contiguous) transfer
+    #engines may store them in lower precision on the GPU (sim._gpu_fields_dtype), the host copy always stays float64
+    dtype = sim._gpu_fields_dtype
+    if(sim._field_stack.dtype == dtype):
+        sim._fields_gpu_device = cuda.to_device(sim._field_stack)
+    else:
+        sim._fields_gpu_device = cuda.to_device(sim._field_stack.astype(dtype))
+    sim._fields_out_gpu_device = cuda.device_array(sim._field_stack.shape, dtype=dtype)
     if not (sim._num_transfer_arrays is None):
         dim = sim.dimensions.copy()
         for i in range(len(dim)):
             dim[i] += 2
         dim.insert(0, sim._num_transfer_arrays)
-        sim._fields_transfer_gpu_device = cuda.device_array_like(np.zeros(dim))
+        sim._fields_transfer_gpu_device = cuda.device_array(dim, dtype=sim._gpu_transfer_dtype)
     if not (sim._tdb_path is None):
         dim = sim.dimensions.copy()
         for i in range(len(dim)):
             dim[i] += 2
         dim.append(len(sim._tdb_components)+1)
-        sim._tdb_ufunc_gpu_device = cuda.device_array_like(np.zeros(dim))
+        sim._tdb_ufunc_gpu_device = cuda.device_array(dim)
     sim._boundary_conditions_gpu_device = cuda.to_device(sim._boundary_conditions_array)
         
         
+def send_temperature_lut_to_GPU(sim):
+    """Uploads the preloaded thermal history (see Simulation.preload_temperature_file) in one transfer"""
+    sim._t_file_lut_gpu_device = cuda.to_device(sim._t_file_lut)
+    _point_t_file_devices_at_lut(sim)
+    
+def _point_t_file_devices_at_lut(sim):
+    #the device arrays of the current pair of steps become views of the uploaded history, if it contains both of them
+    first = sim._t_file_index-1-sim._t_file_lut_start
+    if(first < 0 or first+1 >= len(sim._t_file_lut)):
+        return False
+    sim._t_file_gpu_devices[0] = sim._t_file_lut_gpu_device[first]
+    sim._t_file_gpu_devices[1] = sim._t_file_lut_gpu_device[first+1]
+    return True
+        
 def retrieve_fields_from_GPU(sim):
+    #copied in place, so the Field.data views into sim._field_stack stay valid
     if not (sim.temperature is None):
-        sim.temperature.data = sim._temperature_gpu_device.copy_to_host()
-    fields = sim._fields_gpu_device.copy_to_host()
-    for i in range(len(sim.fields)):
-        sim.fields[i].data = fields[i]
+        sim._temperature_gpu_device.copy_to_host(sim.temperature.data)
+    if(sim._fields_gpu_device.dtype == sim._field_stack.dtype):
+        sim._fields_gpu_device.copy_to_host(sim._field_stack)
+    else:
+        #fields stored in lower precision on the GPU are widened back to float64
+        sim._field_stack[...] = sim._fields_gpu_device.copy_to_host()
         
-def apply_boundary_conditions(sim):
-    bc = sim._boundary_conditions_type
-    if not isinstance(bc, list):
-        l = []
-        for i in range(len(sim.dimensions)):
-            l.append(bc)
-        bc = l
-    if(len(sim.dimensions) == 1):
-        if(bc[0] == "PERIODIC"):
-            periodic_bc_1D_x_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._fields_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                periodic_bc_1D_x_single_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._temperature_gpu_device)
-        elif(bc[0] == "DIRCHLET"):
-            dirchlet_bc_1D_x_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_1D_x_single_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._temperature_gpu_device)
-        elif(bc[0] == "NEUMANN"):
-            neumann_bc_1D_x_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device, sim.dx)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_1D_x_single_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._temperature_gpu_device)
+def write_checkpoint_from_GPU(sim, writer, path, names):
+    """
+    Queues a checkpoint of the fields on the GPU with writer (a ppf_utils.CheckpointWriter), without waiting for them
+    
+    The fields are copied asynchronously into a pinned host buffer, on sim._copy_stream, after the current step. 
+    Engines using the default stream run the next steps after the copy, while the host keeps launching them. 
+    Engines with their own compute stream (see create_streams) keep computing during the copy. The writer thread 
+    waits for the copy before writing the file
+    """
+    device_fields = sim._fields_gpu_device
+    copied = []
+    
+    def copy(buffer):
+        copied.append(_queue_copy_from_GPU(sim, device_fields, buffer))
     
-    elif(len(sim.dimensions) == 2):
-        if(bc[0] == "PERIODIC"):
-            periodic_bc_2D_x_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._fields_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                periodic_bc_2D_x_single_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device)
-        elif(bc[0] == "DIRCHLET"):
-            dirchlet_bc_2D_x_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_2D_x_single_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device)
-        elif(bc[0] == "NEUMANN"):
-            neumann_bc_2D_x_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device, sim.dx)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_2D_x_single_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device)
-        if(bc[1] == "PERIODIC"):
-            periodic_bc_2D_y_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._fields_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                periodic_bc_2D_y_single_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device)
-        elif(bc[1] == "DIRCHLET"):
-            dirchlet_bc_2D_y_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_2D_y_single_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device)
-        elif(bc[1] == "NEUMANN"):
-            neumann_bc_2D_y_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device, sim.dx)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_2D_y_single_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device)
+    def allocate(shape, dtype):
+        return cuda.pinned_array(shape, dtype=dtype)
     
-    elif(len(sim.dimensions) == 3):
-        if(bc[0] == "PERIODIC"):
-            periodic_bc_3D_x_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                periodic_bc_3D_x_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        elif(bc[0] == "DIRCHLET"):
-            dirchlet_bc_3D_x_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_3D_x_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        elif(bc[0] == "NEUMANN"):
-            neumann_bc_3D_x_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device, sim.dx)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_3D_x_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        if(bc[1] == "PERIODIC"):
-            periodic_bc_3D_y_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                periodic_bc_3D_y_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        elif(bc[1] == "DIRCHLET"):
-            dirchlet_bc_3D_y_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_3D_y_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        elif(bc[1] == "NEUMANN"):
-            neumann_bc_3D_y_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device, sim.dx)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_3D_y_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        if(bc[2] == "PERIODIC"):
-            periodic_bc_3D_z_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                periodic_bc_3D_z_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        elif(bc[2] == "DIRCHLET"):
-            dirchlet_bc_3D_z_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_3D_z_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-        elif(bc[2] == "NEUMANN"):
-            neumann_bc_3D_z_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._fields_gpu_device, sim._boundary_conditions_gpu_device, sim.dx)
-            if not(sim._temperature_gpu_device is None):
-                neumann_bc_3D_z_single_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device)
-    cuda.synchronize()
+    def ready():
+        copied[0].synchronize()
+    
+    writer.write(path, device_fields, names, sim.fields[0]._slice, allocate=allocate, copy=copy, ready=ready)
+    
+def flush_fields_from_GPU_async(sim):
+    """
+    Starts copying the fields (and thermal field) on the GPU into pinned host buffers, see Simulation.flush_async
+    The two buffers are reused by later flushes
+    """
+    fields = sim._fields_gpu_device
+    temperature = sim._temperature_gpu_device
+    buffers = sim._flush_buffers
+    if(buffers is None or buffers[0].shape != fields.shape or buffers[0].dtype != fields.dtype):
+        buffers = (pinned_empty(fields.shape, fields.dtype), None if (temperature is None) else pinned_empty(temperature.shape))
+        sim._flush_buffers = buffers
+    sim._flush_event = _queue_copy_from_GPU(sim, fields, buffers[0])
+    if not(temperature is None):
+        #same stream, so this event is also only recorded after the fields are copied
+        sim._flush_event = _queue_copy_from_GPU(sim, temperature, buffers[1])
+        
+def finish_flush_from_GPU(sim):
+    """Waits for the copies started by flush_fields_from_GPU_async, and writes them into the host arrays of sim"""
+    if(sim._flush_event is None):
+        return
+    sim._flush_event.synchronize()
+    sim._flush_event = None
+    #widened back to float64 if the GPU stores the fields in lower precision
+    sim._field_stack[...] = sim._flush_buffers[0]
+    if not(sim._flush_buffers[1] is None):
+        sim.temperature.data[...] = sim._flush_buffers[1]
+        
+def _axis_views(array, ndim):
+    """(before, axis, after) views of a C-contiguous (device) array, one for each of its last ndim axes"""
+    views = []
+    for i in range(ndim):
+        axis = len(array.shape)-ndim+i
+        before = int(np.prod(array.shape[:axis]))
+        after = int(np.prod(array.shape[axis+1:]))
+        views.append(array.reshape(before, array.shape[axis], after))
+    return views
+
+def _cached_axis_views(sim, array):
+    #engines swap the fields arrays every step, so views of the last few arrays are kept, by identity
+    for cached, views in sim._gpu_bc_views:
+        if(cached is array):
+            return views
+    views = _axis_views(array, len(sim.dimensions))
+    sim._gpu_bc_views = sim._gpu_bc_views[-4:]+[(array, views)]
+    return views
+        
+def apply_boundary_conditions(sim):
+    """
+    Applies the boundary conditions of every axis to the fields (and the thermal field) on the GPU
+    
+    Each axis is one launch of boundary_conditions_axis_kernel, using the integer codes in sim._bc_codes, so the type 
+    of boundary condition is never compared as a string. The thermal field uses periodic boundary conditions on 
+    periodic axes, and zero-derivative neumann boundary conditions otherwise
+    """
+    if(sim._bc_codes is None):
+        sim._bc_codes = ppf_cpu_utils.boundary_condition_codes(sim)
+    blocks = sim._gpu_blocks_per_grid_2D
+    threads = sim._gpu_threads_per_block_2D
+    dx = 0. if (sim.dx is None) else float(sim.dx)
+    fields = _cached_axis_views(sim, sim._fields_gpu_device)
+    bcarray = _cached_axis_views(sim, sim._boundary_conditions_gpu_device)
+    temperature = None
+    if not(sim._temperature_gpu_device is None):
+        temperature = _cached_axis_views(sim, sim._temperature_gpu_device)
+    stream = compute_stream(sim)
+    for i in range(len(sim._bc_codes)):
+        code = sim._bc_codes[i]
+        if(code == BC_NONE):
+            continue
+        boundary_conditions_axis_kernel[blocks, threads, stream](fields[i], bcarray[i], code, dx)
+        if not(temperature is None):
+            #the thermal field is its own (unused) bcarray, with dx = 0 neumann boundaries have a zero derivative
+            t_code = BC_PERIODIC if (code == BC_PERIODIC) else BC_NEUMANN
+            boundary_conditions_axis_kernel[blocks, threads, stream](temperature[i], temperature[i], t_code, 0.)
+    stream.synchronize()
             
 def update_temperature_field(sim):
     if(sim._temperature_type == "ISOTHERMAL"):
         return
-    elif(sim._temperature_type == "LINEAR_GRADIENT"):
+    stream = compute_stream(sim)
+    #the thermal field is updated in place, so copies of it still in flight must finish first
+    wait_for_copies_from_GPU(sim, sim._temperature_gpu_device)
+    if(sim._temperature_type == "LINEAR_GRADIENT"):
         if(len(sim.dimensions) == 1):
-            update_thermal_gradient_1D_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._temperature_gpu_device, 
+            update_thermal_gradient_1D_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D, stream](sim._temperature_gpu_device, 
                                                                                     sim._dTdt,
                                                                                     sim.get_time_step_length())
         elif(len(sim.dimensions) == 2):
-            update_thermal_gradient_2D_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device, 
+            update_thermal_gradient_2D_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D, stream](sim._temperature_gpu_device, 
                                                                                     sim._dTdt,
                                                                                     sim.get_time_step_length())
         elif(len(sim.dimensions) == 3):
-            update_thermal_gradient_3D_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device, 
+            update_thermal_gradient_3D_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D, stream](sim._temperature_gpu_device, 
                                                                                     sim._dTdt,
                                                                                     sim.get_time_step_length())
     elif(sim._temperature_type == "XDMF_FILE"):
         current_time = sim.get_time_step_length()*sim.get_time_step_counter()
-        while(current_time > sim._t_file_bounds[1]):
-            with mio.xdmf.TimeSeriesReader(sim._temperature_path) as reader:
-                reader.cells=[]
-                sim._t_file_bounds[0] = sim._t_file_bounds[1]
-                sim._t_file_arrays[0] = sim._t_file_arrays[1]
-                sim._t_file_index += 1
-                sim._t_file_bounds[1], point_data1, cell_data0 = reader.read_data(sim._t_file_index)
-                sim._t_file_arrays[1] = np.squeeze(point_data1['T'])
-                sim._t_file_gpu_devices[0], sim._t_file_gpu_devices[1] = sim._t_file_gpu_devices[1], sim._t_file_gpu_devices[0]
-                sim._t_file_gpu_devices[1] = cuda.to_device(sim._t_file_arrays[1])
+        steps = sim._advance_t_file(current_time)
+        #the device arrays mirror the host ring buffer, and are refilled in place rather than reallocated
+        if(steps == 0):
+            pass
+        elif not(sim._t_file_lut_gpu_device is None):
+            if not(_point_t_file_devices_at_lut(sim)):
+                #past the end of the preloaded steps, back to refilling arrays of our own
+                sim._t_file_lut_gpu_device = None
+                sim._t_file_gpu_devices[0] = cuda.to_device(sim._t_file_arrays[0], stream=stream)
+                sim._t_file_gpu_devices[1] = cuda.to_device(sim._t_file_arrays[1], stream=stream)
+        elif(steps == 1):
+            sim._t_file_gpu_devices[0], sim._t_file_gpu_devices[1] = sim._t_file_gpu_devices[1], sim._t_file_gpu_devices[0]
+            sim._t_file_gpu_devices[1].copy_to_device(sim._t_file_arrays[1], stream=stream)
+        elif(steps > 1):
+            sim._t_file_gpu_devices[0].copy_to_device(sim._t_file_arrays[0], stream=stream)
+            sim._t_file_gpu_devices[1].copy_to_device(sim._t_file_arrays[1], stream=stream)
         if(len(sim.dimensions) == 1):
-            update_thermal_file_1D_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D](sim._temperature_gpu_device, 
+            update_thermal_file_1D_kernel[sim._gpu_blocks_per_grid_1D, sim._gpu_threads_per_block_1D, stream](sim._temperature_gpu_device, 
                                                                                     sim._t_file_gpu_devices[0], sim._t_file_gpu_devices[1], 
                                                                                     sim._t_file_bounds[0], sim._t_file_bounds[1], 
                                                                                     current_time)
         elif(len(sim.dimensions) == 2):
-            update_thermal_file_2D_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D](sim._temperature_gpu_device, 
+            update_thermal_file_2D_kernel[sim._gpu_blocks_per_grid_2D, sim._gpu_threads_per_block_2D, stream](sim._temperature_gpu_device, 
                                                                                     sim._t_file_gpu_devices[0], sim._t_file_gpu_devices[1], 
                                                                                     sim._t_file_bounds[0], sim._t_file_bounds[1], 
                                                                                     current_time)
         elif(len(sim.dimensions) == 3):
-            update_thermal_file_3D_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D](sim._temperature_gpu_device, 
+            update_thermal_file_3D_kernel[sim._gpu_blocks_per_grid_3D, sim._gpu_threads_per_block_3D, stream](sim._temperature_gpu_device, 
                                                                                     sim._t_file_gpu_devices[0], sim._t_file_gpu_devices[1], 
                                                                                     sim._t_file_bounds[0], sim._t_file_bounds[1], 
                                                                                     current_time)
+
+#where autotune_threads_per_block remembers the fastest block shape found for each device and problem
+BLOCK_CACHE_PATH = Path.home() / ".cache" / "pyphasefield" / "blocks.json"
+
+def max_threads_per_block():
+    """Returns the largest number of threads per block the current device supports"""
+    return getattr(cuda.current_context().device, "MAX_THREADS_PER_BLOCK", 1024)
+
+def clamp_threads_per_block(threads):
+    """
+    Returns threads as a tuple, with its largest entry repeatedly halved until the block fits on the current device
+    Prints a warning if the block had to be shrunk
+    """
+    clamped = [int(t) for t in np.atleast_1d(threads)]
+    limit = max_threads_per_block()
+    if(np.prod(clamped) <= limit):
+        return tuple(clamped)
+    while(np.prod(clamped) > limit):
+        k = int(np.argmax(clamped))
+        clamped[k] = max(clamped[k]//2, 1)
+    print("Warning: "+str(threads)+" is too many threads per block, this device allows at most "+str(limit)+
+          ", using "+str(tuple(clamped))+" instead")
+    return tuple(clamped)
+
+def _read_block_cache():
+    try:
+        with open(BLOCK_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_block_cache(cache):
+    try:
+        BLOCK_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = BLOCK_CACHE_PATH.with_name(BLOCK_CACHE_PATH.name+"."+str(os.getpid()))
+        with open(temp_path, "w") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(temp_path, BLOCK_CACHE_PATH)
+    except OSError:
+        #unwritable cache directory, the benchmark will just be rerun next time
+        pass
+
+def autotune_threads_per_block(launch, candidates, key, repeats=5):
+    """
+    Returns whichever block shape in candidates runs launch(threads) fastest, by the median of repeats timed launches
+    
+    launch should run the kernel being tuned once, on buffers whose contents may be overwritten. The winner is stored 
+    in BLOCK_CACHE_PATH under the uuid of the current device and key (which should describe the shape and type of 
+    the problem), so later simulations of the same problem on the same device skip the benchmark
+    """
+    device = cuda.current_context().device
+    cache_key = str(device.uuid)+" "+key
+    cache = _read_block_cache()
+    if(cache_key in cache):
+        return tuple(cache[cache_key])
+    limit = max_threads_per_block()
+    best_threads = None
+    best_time = np.inf
+    for threads in candidates:
+        if(np.prod(threads) > limit):
+            continue
+        #first launch compiles the kernel for this configuration, and is not timed
+        launch(threads)
+        cuda.synchronize()
+        times = []
+        for i in range(repeats):
+            start = cuda.event()
+            end = cuda.event()
+            start.record()
+            launch(threads)
+            end.record()
+            end.synchronize()
+            times.append(start.elapsed_time(end))
+        if(np.median(times) < best_time):
+            best_time = np.median(times)
+            best_threads = tuple(threads)
+    cache = _read_block_cache()
+    cache[cache_key] = list(best_threads)
+    _write_block_cache(cache)
+    return best_threads
@@ -4,6 +4,15 @@ import meshio
 import numpy as np
 import sympy as sp
 from tinydb import where
+import atexit
+import functools
+import hashlib
+import io
+import math
+import os
+import queue
+import tempfile
+import threading
 
 colors = [(0, 0, 1), (0, 1, 1), (0, 1, 0), (1, 1, 0), (1, 0, 0)]
 COLORMAP_OTHER = LinearSegmentedColormap.from_list('rgb', colors)
@@ -12,24 +21,284 @@ COLORMAP_PHASE = LinearSegmentedColormap.from_list('rgb', colors2)
 colors2 = [(0, 0, 1), (1, 1, 0), (1, 0, 0)]
 COLORMAP_PHASE_INV = LinearSegmentedColormap.from_list('rgb', colors2)
 
-def successfully_imported_pycalphad():
+def tdb_function_source(symbols, expression, name="tdb_function", module="math"):
+    """
+    Returns the python source of a function name(values), which evaluates the sympy expression with symbols[i] = values[i]
+    
+    If module is "math", the source only uses the math module and indexing, so it can be compiled by numba, including 
+    as a CUDA device function. If module is "numpy", it uses numpy functions instead, and values may be arrays
+    """
+    arguments = sp.symbols(["x"+str(i) for i in range(len(symbols))])
+    expression = expression.subs(dict(zip(symbols, arguments)))
+    if(module == "numpy"):
+        from sympy.printing.numpy import NumPyPrinter
+        body = NumPyPrinter({"fully_qualified_modules": True}).doprint(expression)
+    else:
+        body = sp.pycode(expression, fully_qualified_modules=True)
+    lines = ["def "+name+"(values):"]
+    for i in range(len(arguments)):
+        lines.append("    x"+str(i)+" = values["+str(i)+"]")
+    lines.append("    return "+body)
+    return "\n".join(lines)+"\n"
+
+def _compile_tdb_function(source):
+    namespace = {"math": math, "numpy": np}
+    exec(source, namespace)
+    return namespace["tdb_function"]
+
+#generated functions are pure, so one compiled function per source is shared by every simulation in the process
+@functools.lru_cache(maxsize=None)
+def make_tdb_cpu_function(source):
+    """Compiles source (from tdb_function_source, with module="numpy") into a python function f(values)"""
+    return _compile_tdb_function(source)
+
+@functools.lru_cache(maxsize=None)
+def make_tdb_device_function(source):
+    """
+    Compiles source (from tdb_function_source, with module="math") into an inlined CUDA device function f(values)
+    
+    Kernels call it like any other device function, it is compiled into (and optimized along with) the calling kernel
+    """
+    from numba import cuda
+    return cuda.jit(device=True, inline=True, fastmath=True)(_compile_tdb_function(source))
+
+#bump when the generated source changes, so stale cached sources are not used
+TDB_CACHE_VERSION = 1
+
+def tdb_cache_directory():
+    """Folder where generated TDB function sources are cached: $PYPHASEFIELD_CACHE_DIR if set, otherwise ~/.cache/pyphasefield"""
+    if("PYPHASEFIELD_CACHE_DIR" in os.environ):
+        return os.environ["PYPHASEFIELD_CACHE_DIR"]
+    return os.path.join(os.path.expanduser("~"), ".cache", "pyphasefield")
+
+_tdb_sources = {} #key (see tdb_phase_function_source) -> source
+
+def tdb_phase_function_source(tdb, tdb_path, phase_id, components, module="math"):
+    """
+    Returns tdb_function_source of the molar Gibbs free energy (including ideal mixing) of phase_id in the pycalphad 
+    Database tdb, as a function of (site fractions of the sorted components..., T)
+    
+    Building the pycalphad model and the sympy expression is often slower than the simulation itself, so sources are 
+    cached in tdb_cache_directory(), keyed by the contents of the file at tdb_path, the phase, the components, the 
+    module, and the pycalphad and sympy versions (which may build a different expression from the same file). Later 
+    runs with the same inputs read the cached source instead, and it is kept in memory for the rest of the process. 
+    If tdb_path cannot be read (e.g. the Database was not loaded from a file), the source is generated without caching
+    """
+    import pycalphad as pyc
+    key = hashlib.blake2b(digest_size=16)
+    try:
+        with open(tdb_path, "rb") as f:
+            key.update(f.read())
+    except (OSError, TypeError):
+        symbols, expression = tdb_phase_expression(tdb, phase_id, components)
+        return tdb_function_source(symbols, expression, module=module)
+    key.update(repr((TDB_CACHE_VERSION, pyc.__version__, sp.__version__, phase_id, tuple(components), module)).encode())
+    key = key.hexdigest()
+    #sources already generated or read in this process (e.g. by earlier simulations of a parameter study)
+    if(key in _tdb_sources):
+        return _tdb_sources[key]
+    cache_path = os.path.join(tdb_cache_directory(), "tdb_"+key+".py")
+    try:
+        with open(cache_path) as f:
+            _tdb_sources[key] = f.read()
+            return _tdb_sources[key]
+    except OSError:
+        pass
+    symbols, expression = tdb_phase_expression(tdb, phase_id, components)
+    source = tdb_function_source(symbols, expression, module=module)
+    temp_path = None
+    try:
+        #written to a temporary file and renamed, so other processes never read a partially written source
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(cache_path))
+        with os.fdopen(handle, "w") as f:
+            f.write(source)
+        os.replace(temp_path, cache_path)
+        temp_path = None
+    except OSError:
+        #an unwritable cache only costs time on the next run
+        pass
+    finally:
+        if not(temp_path is None) and os.path.exists(temp_path):
+            os.remove(temp_path)
+    _tdb_sources[key] = source
+    return source
+
+def tdb_phase_expression(tdb, phase_id, components):
+    """
+    Returns (symbols, expression): the sympy expression of the molar Gibbs free energy (including ideal mixing) of phase_id 
+    in the pycalphad Database tdb, and the list of its variables, site fractions of the sorted components then T
+    """
+    import pycalphad as pyc
+    phase = tdb.phases[phase_id]
+    g_param_query = (
+        (where('phase_name') == phase.name) & \
+        ((where('parameter_type') == 'G') | \
+        (where('parameter_type') == 'L'))
+    )
+    model = pyc.Model(tdb, components, phase_id)
+    sympyexpr = model.redlich_kister_sum(phase, tdb.search, g_param_query)
+    ime = model.ideal_mixing_energy(tdb)
+    
+    for i in tdb.symbols:
+        d = tdb.symbols[i]
+        g = sp.Symbol(i)
+        sympyexpr = sympyexpr.subs(g, d)
+
+    sympysyms_list = []
+    T = None
+    symbol_name_list = []
+    for i in components:
+        symbol_name_list.append(phase_id+"0"+i)
+        
+    for j in sympyexpr.free_symbols:
+        if j.name in symbol_name_list: 
+            #this may need additional work for phases with sublattices...
+            sympysyms_list.append(j)
+        elif j.name == "T":
+            T = j
+        else:
+            sympyexpr = sympyexpr.subs(j, 0)
+    sympysyms_list = sorted(sympysyms_list, key=lambda t:t.name)
+    sympysyms_list.append(T)
+    return sympysyms_list, sympyexpr+ime
+
+def tdb_phase_functions(tdb, tdb_path, phases, components, device=False):
+    """
+    Returns the molar Gibbs free energy function of each of the phases, see tdb_phase_function_source
+    Numpy functions for the CPU (make_tdb_cpu_function), or inlined CUDA device functions if device is True 
+    (make_tdb_device_function)
+    """
+    if(device):
+        return [make_tdb_device_function(tdb_phase_function_source(tdb, tdb_path, phase_id, components, module="math")) 
+                for phase_id in phases]
+    return [make_tdb_cpu_function(tdb_phase_function_source(tdb, tdb_path, phase_id, components, module="numpy")) 
+            for phase_id in phases]
+
+TDB_C_COMPILER = os.environ.get("CC", "cc")
+#no -ffast-math: it lets the compiler reassociate sums and assume there are no infs/nans, so results would no longer 
+#match the lambdified numpy functions to rounding error (and e.g. log(0) = -inf in ideal mixing terms would be wrong)
+TDB_C_FLAGS = ["-O3", "-march=native", "-shared", "-fPIC"]
+
+@functools.lru_cache(maxsize=None)
+def host_cpu_signature():
+    """
+    Identifies the CPU that -march=native compiles for: the machine type, and the model and feature flags of the 
+    first CPU listed in /proc/cpuinfo (Linux), otherwise platform.processor(). Part of the cache key of compiled TDB 
+    libraries, so a cache directory shared between machines (e.g. a home directory on a cluster) never gives one 
+    machine a library using instructions its CPU does not have
+    """
+    import platform
+    signature = [platform.machine(), platform.processor()]
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if(line.strip() == ""): #end of the first CPU
+                    break
+                if(line.split(":")[0].strip() in ("vendor_id", "model name", "flags", "CPU implementer", "CPU part", "Features")):
+                    signature.append(line.strip())
+    except OSError:
+        pass
+    return "\n".join(signature)
+
+def tdb_function_c_source(symbols, expression, name="tdb_function"):
+    """
+    Returns the C source of void name(const double **values, double *out, long n), which evaluates the sympy expression 
+    with symbols[i] = values[i][j], into out[j], for each of the n points j
+    """
+    arguments = sp.symbols(["x"+str(i) for i in range(len(symbols))])
+    expression = expression.subs(dict(zip(symbols, arguments)))
+    lines = ["#include <math.h>", "", "void "+name+"(const double **values, double *out, long n) {", 
+             "    for(long j = 0; j < n; j++) {"]
+    for i in range(len(arguments)):
+        lines.append("        const double x"+str(i)+" = values["+str(i)+"][j];")
+    lines.append("        out[j] = "+sp.ccode(expression)+";")
+    lines += ["    }", "}"]
+    return "\n".join(lines)+"\n"
+
+class TDBCFunction:
+    """
+    Callable wrapper of a compiled tdb_function_c_source function, which works like the numpy function of 
+    tdb_function_source called with separate arguments: f(x0, x1, ...), each a scalar or an array, broadcast together
+    """
+    def __init__(self, function, number_of_arguments):
+        import ctypes
+        self._function = function
+        self._function.restype = None
+        self._function.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p, ctypes.c_long]
+        self._number_of_arguments = number_of_arguments
+        self._pointers = (ctypes.c_void_p*number_of_arguments)()
+        
+    def __call__(self, *values):
+        if not(len(values) == self._number_of_arguments):
+            raise TypeError("Expected "+str(self._number_of_arguments)+" arguments, got "+str(len(values)))
+        arrays = [np.ascontiguousarray(v, dtype=np.float64) for v in np.broadcast_arrays(*values)]
+        out = np.empty(np.broadcast(*values).shape)
+        for i in range(len(arrays)):
+            self._pointers[i] = arrays[i].ctypes.data
+        self._function(self._pointers, out.ctypes.data, out.size)
+        if(out.ndim == 0):
+            return out[()]
+        return out
+
+@functools.lru_cache(maxsize=None)
+def make_tdb_c_function(source, number_of_arguments):
+    """
+    Compiles source (from tdb_function_c_source) into a shared library with TDB_C_COMPILER, and returns a TDBCFunction of it
+    
+    Libraries are cached in tdb_cache_directory(), named by the sha1 of the source, compiler, flags and 
+    host_cpu_signature(), so each one is only compiled once per CPU. Raises OSError (or subprocess.CalledProcessError) 
+    if the library can't be compiled or loaded
+    """
+    import ctypes
+    import subprocess
+    key = hashlib.sha1(repr((source, TDB_C_COMPILER, TDB_C_FLAGS, host_cpu_signature())).encode()).hexdigest()
+    directory = tdb_cache_directory()
+    library_path = os.path.join(directory, "tdb_"+key+".so")
+    if not(os.path.exists(library_path)):
+        os.makedirs(directory, exist_ok=True)
+        #compiled to a temporary file and renamed, so other processes never load a partially written library
+        handle, temp_path = tempfile.mkstemp(suffix=".so.tmp", dir=directory)
+        os.close(handle)
+        try:
+            #libm provides the vectorized math functions the loop may be compiled to use
+            subprocess.run([TDB_C_COMPILER]+TDB_C_FLAGS+["-o", temp_path, "-xc", "-", "-lm"], input=source.encode(), 
+                           check=True, capture_output=True)
+            os.replace(temp_path, library_path)
+        finally:
+            if(os.path.exists(temp_path)):
+                os.remove(temp_path)
+    try:
+        library = ctypes.CDLL(library_path)
+    except OSError:
+        #so the next attempt compiles it again, rather than loading the same broken library
+        try:
+            os.remove(library_path)
+        except FileNotFoundError: #another process removed it first
+            pass
+        raise
+    return TDBCFunction(library.tdb_function, number_of_arguments)
+
+def successfully_imported_pycalphad(verbose=True):
     """
     Checks if pycalphad is installed. 
-    If not, warns the user that pycalphad-dependent features cannot be used
+    If not (and verbose is True), warns the user that pycalphad-dependent features cannot be used
     Also tells the user how to install it (if the user has Anaconda)
     """
     try:
         import pycalphad as pyc
     except ImportError:
+        if not(verbose):
+            return False
         print("The feature you are trying to use requires pycalphad")
         print("In Anaconda, use \'conda install -c pycalphad -c conda-forge pycalphad\' to install it")
         return False
     return True
 
-def successfully_imported_numba():
+def successfully_imported_numba(verbose=True):
     """
     Checks if numba/cuda is installed. 
-    If not, warns the user that gpu-dependent features cannot be used
+    If not (and verbose is True), warns the user that gpu-dependent features cannot be used
     Also tells the user how to install it (if the user has Anaconda)
     """
     try:
@@ -37,6 +306,8 @@ def successfully_imported_numba():
         from numba import cuda
         from . import ppf_gpu_utils
     except ImportError as e:
+        if not(verbose):
+            return False
         print("The feature you are trying to use requires numba (and cudatoolkit)")
         print("In Anaconda, use \'conda install cudatoolkit\' and \'conda install numba\' to install them")
         print(e)
@@ -122,66 +393,282 @@ class XDMFLoader():
             array = np.squeeze(point_data0['T'])
             return bound, array
         
+class CheckpointWriter():
+    """
+    Writes .npz checkpoints on a background thread, so simulating can continue while the file is written
+    
+    write() copies the fields into one of a small pool of reusable shadow buffers (blocking only if every 
+    buffer is still waiting to be written), and queues it for the writer thread. Files are written to a 
+    temporary file in the same folder and then renamed, so an interrupted write never leaves behind a 
+    truncated checkpoint.
+    
+    If delta is True, only the ~1 MB chunks of the fields which changed since the previous checkpoint (compared 
+    using blake2b digests) are written, along with the name of that previous checkpoint. Every 
+    full_checkpoint_interval checkpoints, and whenever a checkpoint is saved to a different folder than the 
+    previous one, a complete one is written, bounding the chain load_checkpoint has to replay.
+    
+    If dtype is given (e.g. np.float32 or np.float16), fields are cast to it on disk, computation is unaffected. 
+    If compress is True, files are written with np.savez_compressed. If compress is "zstd" and the optional zstandard 
+    package is installed, the whole (uncompressed) .npz is instead compressed with multithreaded zstd, which is 
+    several times faster for similar file sizes. load_checkpoint detects these files, np.load alone cannot read them.
+    """
+    def __init__(self, number_of_buffers=2, delta=False, chunk_bytes=1048576, full_checkpoint_interval=10, 
+                 dtype=None, compress=False):
+        self.delta = delta
+        self.chunk_bytes = chunk_bytes
+        self.full_checkpoint_interval = full_checkpoint_interval
+        self.dtype = dtype
+        self.compress = compress
+        self._digests = None
+        self._previous_path = None
+        self._previous_names = None
+        self._previous_dtype = None
+        self._chain_length = 0
+        self._queue = queue.Queue(maxsize=number_of_buffers)
+        self._free_buffers = queue.Queue()
+        for i in range(number_of_buffers):
+            self._free_buffers.put(None)
+        self._error = None
+        self._zstd = None #see _zstd_compressor, only used by the writer thread
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        #make sure pending checkpoints are written before the interpreter exits
+        atexit.register(self._queue.join)
+        
+    def write(self, path, fields, names, index, allocate=None, copy=None, ready=None):
+        """
+        Queues fields[i][index] to be saved as names[i], for each field, in the file at path
+        
+        By default fields is a numpy array, copied into a shadow buffer before this returns. Other arrays (e.g. on a GPU) 
+        may be saved by also giving allocate(shape, dtype), which creates a shadow buffer, copy(buffer), which starts 
+        copying fields into it, and ready(), called by the writer thread before the buffer is read (e.g. to wait 
+        for an asynchronous copy to finish)
+        """
+        self._raise_error()
+        if(self._thread is None):
+            raise RuntimeError("CheckpointWriter has been closed")
+        buffer = self._free_buffers.get()
+        if(buffer is None or buffer.shape != fields.shape or buffer.dtype != fields.dtype):
+            if(allocate is None):
+                buffer = np.empty(fields.shape, dtype=fields.dtype)
+            else:
+                buffer = allocate(fields.shape, fields.dtype)
+        if(copy is None):
+            np.copyto(buffer, fields)
+        else:
+            copy(buffer)
+        #settings are captured now, in case they are changed before the checkpoint is written
+        self._queue.put((str(path), buffer, list(names), index, self.delta, self.dtype, self.compress, ready))
+        
+    def wait(self):
+        """Blocks until every queued checkpoint has been written"""
+        self._queue.join()
+        self._raise_error()
+        
+    def reset_delta_base(self):
+        """
+        Makes the next delta checkpoint a complete one, e.g. after the fields were replaced by loading a checkpoint, 
+        from which point on the previous checkpoint no longer describes the fields being saved
+        Must only be called while no checkpoints are queued (see wait)
+        """
+        self._digests = None
+        self._previous_path = None
+        self._previous_names = None
+        self._previous_dtype = None
+        self._chain_length = 0
+        
+    def close(self):
+        """
+        Writes every queued checkpoint, then stops the writer thread and releases the shadow buffers
+        The writer cannot be used afterwards
+        """
+        if(self._thread is None):
+            return
+        self._queue.join()
+        self._queue.put(None) #tells the writer thread to exit
+        self._thread.join()
+        self._thread = None
+        atexit.unregister(self._queue.join)
+        while not(self._free_buffers.empty()):
+            self._free_buffers.get()
+        self._raise_error()
+        
+    def _raise_error(self):
+        if not(self._error is None):
+            error = self._error
+            self._error = None
+            raise error
+        
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if(item is None):
+                self._queue.task_done()
+                return
+            path, buffer, names, index, delta, dtype, compress, ready = item
+            temp_path = None
+            try:
+                if not(ready is None):
+                    ready()
+                interior = buffer[(slice(None),)+tuple(index)]
+                if(dtype is None):
+                    interior = np.ascontiguousarray(interior)
+                else:
+                    interior = np.ascontiguousarray(interior, dtype=dtype)
+                if(delta):
+                    save_dict = self._delta_dict(path, interior, names)
+                else:
+                    save_dict = dict()
+                    for i in range(len(names)):
+                        save_dict[names[i]] = interior[i]
+                    self._digests = None
+                handle, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+                with os.fdopen(handle, "wb") as f:
+                    if(compress == "zstd" and not(self._zstd_compressor() is None)):
+                        #zip archives need a seekable file, so the .npz is built in memory and then compressed
+                        npz = io.BytesIO()
+                        np.savez(npz, **save_dict)
+                        f.write(self._zstd_compressor().compress(npz.getbuffer()))
+                    elif(compress):
+                        np.savez_compressed(f, **save_dict)
+                    else:
+                        np.savez(f, **save_dict)
+                os.replace(temp_path, path)
+                temp_path = None
+            except Exception as e:
+                self._error = e
+            finally:
+                if not(temp_path is None) and os.path.exists(temp_path):
+                    os.remove(temp_path)
+                self._free_buffers.put(buffer)
+                self._queue.task_done()
+                
+    def _zstd_compressor(self):
+        """Returns the (reused) zstandard compressor, or None if zstandard is not installed, in which case zlib is used"""
+        if(self._zstd is None):
+            zstandard = _import_zstandard()
+            if(zstandard is None):
+                print("zstd checkpoint compression requires the zstandard package (\'pip install zstandard\'), using zlib instead")
+                self._zstd = False
+            else:
+                self._zstd = zstandard.ZstdCompressor(level=3, threads=-1)
+        if(self._zstd is False):
+            return None
+        return self._zstd
+        
+    def _delta_dict(self, path, interior, names):
+        flat = interior.reshape(-1)
+        chunk = max(1, self.chunk_bytes//flat.itemsize)
+        digests = []
+        for start in range(0, flat.size, chunk):
+            digests.append(hashlib.blake2b(memoryview(flat[start:start+chunk]), digest_size=8).digest())
+        digests = np.frombuffer(b"".join(digests), dtype=np.uint64)
+        #a checkpoint overwriting its own base (e.g. saving a step again after loading it) would reference itself, 
+        #and the base is only stored by file name, so it must be in the same folder (e.g. save_path was not changed)
+        full = (self._digests is None) or (self._digests.shape != digests.shape) or (self._previous_names != names) or \
+               (self._previous_dtype != flat.dtype) or (self._chain_length >= self.full_checkpoint_interval) or \
+               (os.path.abspath(self._previous_path) == os.path.abspath(path)) or \
+               (os.path.dirname(os.path.abspath(self._previous_path)) != os.path.dirname(os.path.abspath(path)))
+        if(full):
+            save_dict = dict()
+            for i in range(len(names)):
+                save_dict[names[i]] = interior[i]
+            self._chain_length = 0
+        else:
+            changed = np.nonzero(digests != self._digests)[0]
+            data = []
+            for i in changed:
+                data.append(flat[i*chunk:(i+1)*chunk])
+            save_dict = {"_delta_base": np.array(os.path.basename(self._previous_path)), 
+                         "_delta_names": np.array(names), 
+                         "_delta_shape": np.array(interior.shape), 
+                         "_delta_chunk": np.array(chunk), 
+                         "_delta_changed": changed, 
+                         "_delta_data": np.concatenate(data) if len(data) > 0 else np.zeros(0, dtype=flat.dtype)}
+            self._chain_length += 1
+        self._digests = digests
+        self._previous_path = path
+        self._previous_names = names
+        self._previous_dtype = flat.dtype
+        return save_dict
+        
+def _import_zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+    
+#first bytes of a zstd frame, zstd checkpoints are detected by these rather than by their file name
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+        
+def load_checkpoint(path):
+    """
+    Loads a checkpoint written by CheckpointWriter, returns a dictionary of field name -> array
+    
+    Delta checkpoints are rebuilt by loading the checkpoint they are based on (which must be in the same folder) 
+    and replacing the chunks which changed
+    """
+    path = str(path)
+    file = path
+    with open(path, "rb") as f:
+        if(f.read(4) == ZSTD_MAGIC):
+            zstandard = _import_zstandard()
+            if(zstandard is None):
+                raise ImportError("Checkpoint "+path+" is zstd compressed, loading it requires the zstandard package")
+            f.seek(0)
+            #multithreaded compression may write several frames
+            file = io.BytesIO(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True).read())
+    #checkpoints only contain plain arrays, never pickled objects
+    with np.load(file, allow_pickle=False) as checkpoint:
+        if not("_delta_base" in checkpoint.files):
+            fields = dict()
+            for key in checkpoint.files:
+                fields[key] = checkpoint[key]
+            return fields
+        base = checkpoint["_delta_base"].item()
+        names = [str(name) for name in checkpoint["_delta_names"]]
+        shape = tuple(checkpoint["_delta_shape"])
+        chunk = int(checkpoint["_delta_chunk"])
+        changed = checkpoint["_delta_changed"]
+        data = checkpoint["_delta_data"]
+    base_fields = load_checkpoint(os.path.join(os.path.dirname(path), base))
+    stack = np.empty(shape, dtype=data.dtype)
+    for i in range(len(names)):
+        stack[i] = base_fields[names[i]]
+    flat = stack.reshape(-1)
+    offset = 0
+    for i in changed:
+        length = min(chunk, flat.size-i*chunk)
+        flat[i*chunk:i*chunk+length] = data[offset:offset+length]
+        offset += length
+    fields = dict()
+    for i in range(len(names)):
+        fields[names[i]] = stack[i]
+    return fields
+        
 class TDBContainer():
     def __init__(self, tdb_path, phases=None, components=None):
-        if(successfully_imported_pycalphad):
+        if(successfully_imported_pycalphad()):
             import pycalphad as pyc
         else:
             raise Exception("Aborting, pycalphad must be installed for this class to be used")
         self._tdb_path = tdb_path
         self._tdb = pyc.Database(self._tdb_path)
-        self._tdb_phases = phases
-        if self._tdb_phases is None:
-            self._tdb_phases = list(self._tdb.phases)
-        self._tdb_components = components
-        if self._tdb_components is None:
-            self._tdb_components = list(self._tdb.elements)
-        self._tdb_phases.sort()
-        self._tdb_components.sort()
-        self._tdb_cpu_ufuncs = []
-        self._tdb_gpu_ufuncs = []
-        param_search = self._tdb.search
+        #sorted once into tuples, which later code (and users) can hash and compare cheaply
+        self._tdb_phases = tuple(sorted(self._tdb.phases if phases is None else phases))
+        self._tdb_components = tuple(sorted(self._tdb.elements if components is None else components))
+        self._tdb_cpu_ufuncs = tdb_phase_functions(self._tdb, self._tdb_path, self._tdb_phases, self._tdb_components)
+        #inlined CUDA device functions, only callable from kernels (these used to be numba.jit CPU functions, 
+        #stored as _tdb_gpu_ufuncs)
+        self._tdb_device_ufuncs = []
         numba_enabled = False
         try:
             import numba
             numba_enabled = True
         except:
             print("Cannot import numba, therefore cannot create TDB ufuncs built for GPUs")
-        for k in range(len(self._tdb_phases)):
-            phase_id = self._tdb_phases[k]
-            phase = self._tdb.phases[phase_id]
-            g_param_query = (
-                (where('phase_name') == phase.name) & \
-                ((where('parameter_type') == 'G') | \
-                (where('parameter_type') == 'L'))
-            )
-            model = pyc.Model(self._tdb, self._tdb_components, phase_id)
-            sympyexpr = model.redlich_kister_sum(phase, param_search, g_param_query)
-            ime = model.ideal_mixing_energy(self._tdb)
-            
-            for i in self._tdb.symbols:
-                d = self._tdb.symbols[i]
-                g = sp.Symbol(i)
-                sympyexpr = sympyexpr.subs(g, d)
-
-            sympysyms_list = []
-            T = None
-            symbol_name_list = []
-            for i in list(self._tdb_components):
-                symbol_name_list.append(phase_id+"0"+i)
-                
-            for j in sympyexpr.free_symbols:
-                if j.name in symbol_name_list: 
-                    #this may need additional work for phases with sublattices...
-                    sympysyms_list.append(j)
-                elif j.name == "T":
-                    T = j
-                else:
-                    sympyexpr = sympyexpr.subs(j, 0)
-            sympysyms_list = sorted(sympysyms_list, key=lambda t:t.name)
-            sympysyms_list.append(T)
-            
-            self._tdb_cpu_ufuncs.append(sp.lambdify([sympysyms_list], sympyexpr+ime, 'numpy'))
-            if(numba_enabled):
-                self._tdb_gpu_ufuncs.append(numba.jit(sp.lambdify([sympysyms_list], sympyexpr+ime, 'math')))
+        if(numba_enabled):
+            self._tdb_device_ufuncs = tdb_phase_functions(self._tdb, self._tdb_path, self._tdb_phases, self._tdb_components, 
+                                                          device=True)
         
\ No newline at end of file
@@ -1,6 +1,6 @@
 import sys
 sys.path.insert(0, "../..") #location of pyphasefield files
-import pyphasefield as ppf
+from pyphasefield.Engines import NCGPU
 import numpy as np
 import matplotlib.pyplot as plt
 import time
@@ -18,32 +18,24 @@ def run_Q_test(angle, widthcells, isometric):
     dx = 2.3e-06
     #d = 4.8936e-06*2
     d = dx*widthcells
-    sim = ppf.Simulation("data/q_test_"+str(angle))
     dim = [200, 200]
-    sim.init_sim_NCGPU(dim=dim, solver="explicit", temperature_type="gradient", initial_temperature=1560, 
-                            temperature_gradient=0, cooling_rate = 0,
-                            initial_concentration_array=[0.126], tdb_path="Ni-Nb_Simplified.tdb", cell_spacing=dx, 
-                            d_ratio=(d/dx), nbc=["periodic", "periodic"], sim_type="seed", number_of_seeds=0)
-    #ratio = sim.H/H
-    #sim.H = H
-    #sim.M_qmax *= ratio
-    #sim.params[3] = sim.M_qmax
-    #sim.params[4] = sim.H
+    sim = NCGPU(dimensions=dim, dx=dx, temperature_type="LINEAR_GRADIENT", initial_T=1560, dTdx=0, dTdt=0, 
+                tdb_path="Ni-Nb_Simplified.tdb", boundary_conditions="PERIODIC", save_path="data/q_test_"+str(angle), 
+                user_data={"sim_type":"seed", "number_of_seeds":0, "initial_concentration_array":[0.126], "d_ratio":(d/dx)})
+    sim.initialize_fields_and_imported_data()
+    #ratio = sim.user_data["H"]/H
+    #sim.user_data["H"] = H
+    #sim.user_data["M_qmax"] *= ratio
     if isometric:
-        sim.y_e = 0
-        sim.params[5] = 0
-    sim.fields[1].data = np.zeros(dim)
-    sim.fields[1].data += np.cos(0.5*angle)
-    sim.fields[2].data = np.zeros(dim)
-    sim.fields[2].data += np.sin(0.5*angle)
-    D = sim.M[0]*sim.ebar*sim.ebar*1685.
-    if D < sim.M[1]*sim.ebar*sim.ebar*1685.:
-        D = sim.M[1]*sim.ebar*sim.ebar*1685.
-    if D < sim.D_L:
-        D = sim.D_L
+        sim.user_data["y_e"] = 0
+    sim.fields[1].get_cells()[:] = np.cos(0.5*angle)
+    sim.fields[2].get_cells()[:] = np.sin(0.5*angle)
+    D = sim.user_data["M"][0]*sim.user_data["ebar"]*sim.user_data["ebar"]*1685.
+    if D < sim.user_data["M"][1]*sim.user_data["ebar"]*sim.user_data["ebar"]*1685.:
+        D = sim.user_data["M"][1]*sim.user_data["ebar"]*sim.user_data["ebar"]*1685.
+    if D < sim.user_data["D_L"]:
+        D = sim.user_data["D_L"]
     sim.set_time_step_length(sim.get_cell_spacing()**2/20./D)
-    sim.set_checkpoint_rate(100000)
-    sim.send_fields_to_GPU()
     #sim.plot_simulation(save_images=False)
     sim.simulate(1500)
     sim.retrieve_fields_from_GPU()
@@ -3,26 +3,134 @@ import sympy as sp
 import meshio as mio
 from .field import Field
 from pathlib import Path
+from functools import partialmethod
+from importlib import import_module
+import inspect
+import warnings
 import matplotlib.cm as cm
 from matplotlib import pyplot as plt
-from matplotlib.colors import PowerNorm
+from matplotlib.colors import PowerNorm, Normalize
 from tinydb import where
 from . import ppf_utils
+from . import ppf_cpu_utils
 
-try:
-    import pycalphad as pyc
-    from . import ppf_gpu_utils
-    import numba
-except:
+def refresh_capabilities():
+    """
+    Checks (again) whether pycalphad and numba can be imported, and imports them if so. This is done once when 
+    pyphasefield is imported, call this after installing either of them to use them without restarting Python
+    Returns (pycalphad can be imported, numba can be imported)
+    """
+    global _HAS_PYCALPHAD, _HAS_NUMBA, pyc, numba, ppf_gpu_utils
+    _HAS_PYCALPHAD = ppf_utils.successfully_imported_pycalphad(verbose=False)
+    _HAS_NUMBA = ppf_utils.successfully_imported_numba(verbose=False)
+    if(_HAS_PYCALPHAD):
+        import pycalphad as pyc
+    if(_HAS_NUMBA):
+        import numba
+        from . import ppf_gpu_utils
+    return _HAS_PYCALPHAD, _HAS_NUMBA
+
+_HAS_PYCALPHAD, _HAS_NUMBA = refresh_capabilities()
+
+def _require_pycalphad():
+    #only probes again (warning the user if it is still missing) when pycalphad could not be imported before
+    if not(_HAS_PYCALPHAD or refresh_capabilities()[0]):
+        return ppf_utils.successfully_imported_pycalphad()
+    return True
+
+def _require_numba():
+    if not(_HAS_NUMBA or refresh_capabilities()[1]):
+        return ppf_utils.successfully_imported_numba()
+    return True
+
+#model name: (module in Engines, name of its engine class), replaced by the class itself once first used
+_MODEL_ENGINES = {"Diffusion": ("Diffusion", "Diffusion"), 
+                  "DiffusionGPU": ("DiffusionGPU", "DiffusionGPU"), 
+                  "CahnAllen": ("CahnAllen", "CahnAllen"), 
+                  "CahnHilliard": ("CahnHilliard", "CahnHilliard"), 
+                  "Warren1995": ("Warren1995", "Warren1995"), 
+                  "NComponent": ("NComponent", "NComponent"), 
+                  "NCGPU": ("NCGPU", "NCGPU")}
+
+#models registered by other packages under this entry point group, e.g. in their setup.py: 
+#entry_points={"pyphasefield.engines": ["MyModel = mypackage.mymodule:MyModel"]}, where MyModel subclasses Simulation
+ENGINE_ENTRY_POINT_GROUP = "pyphasefield.engines"
+_plugin_models = None #name: entry point, only scanned for once a model that is not built-in is requested
+
+#optional dependencies of each model, checked by get_engine before anything else
+_MODEL_REQUIREMENTS = {"DiffusionGPU": (_require_numba,), 
+                       "NComponent": (_require_pycalphad,), 
+                       "NCGPU": (_require_pycalphad, _require_numba)}
+
+def _find_plugin_models():
+    global _plugin_models
+    if(_plugin_models is None):
+        try:
+            from importlib.metadata import entry_points
+        except ImportError: #python < 3.8, no plugin models
+            _plugin_models = {}
+            return _plugin_models
+        eps = entry_points()
+        if(hasattr(eps, "select")):
+            eps = eps.select(group=ENGINE_ENTRY_POINT_GROUP)
+        else: #python < 3.10 returns a dict of group: entry points
+            eps = eps.get(ENGINE_ENTRY_POINT_GROUP, [])
+        _plugin_models = {ep.name: ep for ep in eps}
+    return _plugin_models
+
+def get_engine(model):
+    """
+    Returns the engine class (a subclass of Simulation) of one of the built-in models (a key of _MODEL_ENGINES) or 
+    of a model registered by another package under the "pyphasefield.engines" entry point group, e.g. 
+    get_engine("Warren1995")(dimensions=[200, 200], dx=4.6e-8). The engine module is only imported on first use
+    Raises ValueError for unknown models, and ImportError (after warning the user) if an optional dependency of 
+    the model is missing
+    """
+    for required in _MODEL_REQUIREMENTS.get(model, ()):
+        if not required():
+            raise ImportError("The "+str(model)+" engine requires a package which is not installed")
+    if not(model in _MODEL_ENGINES):
+        plugins = _find_plugin_models()
+        if not(model in plugins):
+            raise ValueError("Unknown model \""+str(model)+"\", must be one of "+str(list(_MODEL_ENGINES)+
+                             [name for name in plugins if not(name in _MODEL_ENGINES)]))
+        #built-in models take precedence over plugins of the same name
+        _MODEL_ENGINES[model] = plugins[model].load()
+    engine = _MODEL_ENGINES[model]
+    if(isinstance(engine, tuple)):
+        #Engines imports this module, so the engine modules can only be imported once they are needed
+        engine = getattr(import_module(".Engines."+engine[0], __package__), engine[1])
+        _MODEL_ENGINES[model] = engine
+    return engine
+
+#keyword arguments of the old init_sim_X functions, and the Simulation.__init__ parameter each one became
+_LEGACY_INIT_KEYWORDS = {"dim": "dimensions", "cell_spacing": "dx", "initial_temperature": "initial_T", 
+                         "temperature_gradient": "dTdx", "cooling_rate": "dTdt", 
+                         "temperature_file_path": "temperature_path", "nbc": "boundary_conditions"}
+_LEGACY_TEMPERATURE_TYPES = {"isothermal": "ISOTHERMAL", "gradient": "LINEAR_GRADIENT", "file": "XDMF_FILE"}
+
+def _normalize_dimensions(dimensions):
+    """
+    Returns dimensions (any sequence or 1D array of integer sizes, e.g. a list, a tuple or the shape of an ndarray) as 
+    the list of python ints used throughout pyphasefield. Raises ValueError unless it has 1 to 3 positive sizes
+    """
+    if(dimensions is None):
+        return None
+    sizes = np.asarray(dimensions)
+    if not(sizes.ndim == 1 and 1 <= sizes.size <= 3 and sizes.dtype.kind in "iu" and np.all(sizes > 0)):
+        raise ValueError("Simulation dimensions must be 1 to 3 positive integer sizes, not "+str(dimensions))
+    return [int(n) for n in sizes]
+
+def _no_temperature_update():
     pass
 
 class Simulation:
-    def __init__(self, dimensions, framework=None, dx=None, dt=None, initial_time_step=0, 
+    def __init__(self, dimensions=None, framework=None, dx=None, dt=None, initial_time_step=0, 
                  temperature_type=None, initial_T=None, dTdx=None, dTdy=None, dTdz=None, dTdt=None, 
                  temperature_path=None, temperature_units="K",
                  tdb_container=None, tdb_path=None, tdb_components=None, tdb_phases=None, 
                  save_path=None, autosave=False, save_images=False, autosave_rate=None, 
-                 boundary_conditions=None, user_data={}):
+                 boundary_conditions=None, user_data=None):
         """
         Class used by pyphasefield to store data related to a given simulation
         Methods of Simulation are used to:
@@ -44,17 +152,39 @@ class Simulation:
         self._gpu_threads_per_block_1D = (256)
         self._gpu_threads_per_block_2D = (16, 16)
         self._gpu_threads_per_block_3D = (8, 8, 8)
+        self._num_threads = None #number of threads for compiled CPU kernels (CPU_PARALLEL), None to use all of them, see ppf_cpu_utils.simulation_threads
+        self._numba_kernel = None #compiled step function used by ppf_cpu_utils.simulate, set by the subclass
+        self._numba_kernel_params = None #float64 array of parameters passed to self._numba_kernel
+        self._numba_driver = None #optional, on-disk cacheable compiled loop over self._numba_kernel, see ppf_cpu_utils.simulate
+        self._gmres_laplacian = None #matrix-free laplacian used by implicit GMRES solves, see ppf_cpu_utils.homogeneous_laplacian
+        self._plot_cache = {} #per field index: (key, RGBA image, copy of the data it was colored from), see _field_image
+        self._plot_tile_size = 64
+        self._plot_figure = None #(figure, axes, image, colorbar) reused by plot_simulation while the figure is open
         
         #variable for determining if class needs to be re-initialized before running simulation steps
         self._begun_simulation = False
         
         #core variables: fields, length of space/time steps, dimensions of simulation region
         self.fields = []
+        self._field_stack = None #contiguous array of shape (nfields, *dims+2), each Field.data is a view into it
+        self._field_stack_out = None #second buffer of the same shape, written to by compiled engine steps
         self._fields_gpu_device = None
         self._fields_out_gpu_device = None
+        self._copy_stream = None #cuda stream used for asynchronous copies of checkpoints from the GPU
+        self._compute_stream = None #cuda stream the GPU kernels run on, None for the default stream, see ppf_gpu_utils.create_streams
+        self._pending_copies = [] #(event, device array) of copies from the GPU the compute stream has not waited for yet
+        self._flush_buffers = None #pinned host buffers (fields, thermal field) used by flush_async
+        self._flush_event = None #event recorded when the copies started by flush_async are done
         self._num_transfer_arrays = None
         self._fields_transfer_gpu_device = None
-        self.dimensions = dimensions
+        self._gpu_fields_dtype = np.float64 #storage type of the fields (and the output buffer) on the GPU
+        self._gpu_transfer_dtype = np.float64 #storage type of the transfer arrays on the GPU
+        if(isinstance(dimensions, str)):
+            #Simulation(save_path) of the old API, e.g. to load a checkpoint with load_simulation
+            if(save_path is None):
+                save_path = dimensions
+            dimensions = None
+        self.dimensions = _normalize_dimensions(dimensions)
         self.dx = dx
         self.dt = dt
         self.time_step_counter = initial_time_step
@@ -63,6 +193,7 @@ class Simulation:
         self.temperature = None
         self._temperature_gpu_device = None
         self._temperature_type = temperature_type
+        self._temperature_is_scalar = False #True if the thermal field is a single constant value (ISOTHERMAL)
         self._temperature_path = temperature_path
         self._temperature_units = temperature_units
         self._initial_T = initial_T
@@ -74,6 +205,13 @@ class Simulation:
         self._t_file_bounds = [0, 0]
         self._t_file_arrays = [None, None]
         self._t_file_gpu_devices = [None, None]
+        self._t_file_reader = None #kept open between steps, see close_simulation
+        self._t_file_inverse_interval = None #1/(self._t_file_bounds[1]-self._t_file_bounds[0])
+        self._t_file_buffer = None #scratch array used when interpolating the thermal history
+        self._t_file_lut = None #steps of the thermal history preloaded into one array, see preload_temperature_file
+        self._t_file_lut_times = None
+        self._t_file_lut_start = 0 #index in the file of self._t_file_lut[0]
+        self._t_file_lut_gpu_device = None
         
         #tdb related variables
         self._tdb_container = tdb_container #TDBContainer class, for storing TDB info across simulation instances (load times...)
@@ -87,20 +225,30 @@ class Simulation:
         
         #progress saving related variables
         self._save_path = save_path
+        self._save_loc = None #(self._save_path, Path of the created folder) of the last checkpoint, see save_simulation
         self._autosave_flag = autosave
         self._autosave_rate = autosave_rate
         self._autosave_save_images_flag = save_images
+        self._checkpoint_writer = None #ppf_utils.CheckpointWriter, created on first save
+        self._delta_checkpoints_flag = False #if True, checkpoints after the first only store chunks which changed
+        self._checkpoint_dtype = None #dtype fields are cast to when saved (e.g. np.float32), None to save as is
+        self._checkpoint_compression_flag = False #True for np.savez_compressed, "zstd" for zstd (see ppf_utils.CheckpointWriter)
         
         #boundary condition related variables
         self._boundary_conditions_type = boundary_conditions
         self._boundary_conditions_array = None
+        self._boundary_slices = None #cached slice tuples used by apply_boundary_conditions, see init_boundary_conditions
+        self._bc_codes = None #ppf_cpu_utils.BC_* integer code of each axis, see init_boundary_conditions
+        #appliers for one axis, indexed by bc code. BC_NONE (-1) indexes the last entry, which does nothing
+        self._bc_appliers = [self._apply_periodic_axis, self._apply_neumann_axis, self._apply_dirchlet_axis, self._apply_no_axis]
         self._boundary_conditions_gpu_device = None
+        self._gpu_bc_views = [] #(device array, per axis views) used by ppf_gpu_utils.apply_boundary_conditions
         
         #debug mode flag, for verbose printing to track down errors
         self._debug_mode_flag = False
         
-        #arbitrary subclass-specific data container (dictionary)
-        self.user_data = user_data
+        #arbitrary subclass-specific data container (dictionary), engines write their defaults into it
+        self.user_data = {} if user_data is None else user_data
         
     def init_fields(self):
         #exclusively used by the subclass, base Simulation class does not initialize fields!
@@ -121,60 +269,70 @@ class Simulation:
             dim[i] += 2
         dim.insert(0, len(self.fields)) #requires initialization of fields first
         self._boundary_conditions_array = np.zeros(dim)
+        self._init_boundary_slices()
+        
+    def _init_boundary_slices(self):
+        #for each axis i, index of the boundary cells on the low/high face and of the interior cells next to them
+        #used on self._field_stack and self._boundary_conditions_array (first index is the field index) 
+        #the thermal field has no field index, and uses [1:] of each tuple
+        #also translates the boundary condition types to integer codes once, rather than comparing strings every step
+        self._boundary_slices = []
+        for i in range(len(self.dimensions)):
+            before = (slice(None),)*(i+1)
+            self._boundary_slices.append((before+(0,), before+(1,), before+(-1,), before+(-2,)))
+        self._bc_codes = ppf_cpu_utils.boundary_condition_codes(self)
         
         
     def init_temperature_field(self):
         if(self._temperature_type is None):
             pass
         elif(self._temperature_type == "ISOTHERMAL"):
-            array = np.zeros(self.dimensions)
-            array += self._initial_T
+            array = np.full(self.dimensions, self._initial_T, dtype=np.float64)
             t_field = Field(data=array, simulation=self, colormap="jet", name="Temperature ("+self._temperature_units+")")
+            #boundary cells too, so boundary conditions never need to be applied to the (constant) thermal field
+            t_field.data.fill(self._initial_T)
             self.temperature = t_field
+            self._temperature_is_scalar = True
         elif(self._temperature_type == "LINEAR_GRADIENT"):
-            array = np.zeros(self.dimensions)
-            array += self._initial_T
-            if not ((self._dTdx is None) or (self._dTdx == 0)):
-                x_length = self.dimensions[len(self.dimensions)-1]
-                x_t_array = np.arange(0, x_length*self.dx*self._dTdx, self.dx*self._dTdx)
-                array += x_t_array
-            if(len(self.dimensions) > 1):
-                if not ((self._dTdy is None) or (self._dTdy == 0)):
-                    y_length = self.dimensions[len(self.dimensions)-2]
-                    y_t_array = np.arange(0, y_length*self.dx*self._dTdy, self.dx*self._dTdy)
-                    y_t_array = np.expand_dims(y_t_array, axis=1)
-                    array += y_t_array
-            if(len(self.dimensions) > 2):
-                if not ((self._dTdz is None) or (self._dTdz == 0)):
-                    z_length = self.dimensions[len(self.dimensions)-3]
-                    z_t_array = np.arange(0, z_length*self.dx*self._dTdz, self.dx*self._dTdz)
-                    z_t_array = np.expand_dims(z_t_array, axis=1)
-                    z_t_array = np.expand_dims(z_t_array, axis=2)
-                    array += z_t_array
-            array += self.time_step_counter*self._dTdt
+            #one dimensional ramp for each axis with a gradient, shaped to broadcast along that axis
+            #dTdx is the gradient along the last axis, dTdy the second to last, dTdz the third to last
+            gradients = [self._dTdz, self._dTdy, self._dTdx][3-len(self.dimensions):]
+            ramps = []
+            for i in range(len(self.dimensions)):
+                if not ((gradients[i] is None) or (gradients[i] == 0)):
+                    shape = [1]*len(self.dimensions)
+                    shape[i] = self.dimensions[i]
+                    ramps.append((np.arange(self.dimensions[i], dtype=np.float64)*(self.dx*gradients[i])).reshape(shape))
+            #every term but the last only broadcasts over a subset of the axes (small), the final add writes the full array once
+            partial_sum = self._initial_T + self.time_step_counter*self.dt*self._dTdt
+            for ramp in ramps[:-1]:
+                partial_sum = partial_sum + ramp
+            array = np.empty(self.dimensions, dtype=np.float64)
+            if(len(ramps) == 0):
+                array.fill(partial_sum)
+            else:
+                np.add(partial_sum, ramps[-1], out=array)
             t_field = Field(data=array, simulation=self, colormap="jet", name="Temperature ("+self._temperature_units+")")
             self.temperature = t_field
         elif(self._temperature_type == "XDMF_FILE"):
             if(self._temperature_path is None):
                 self._temperature_path = "T.xdmf"
+            if not(self._t_file_reader is None):
+                #reinitializing, the path of the thermal history may have changed
+                self.close_simulation()
+            self._t_file_lut = None
+            self._t_file_lut_gpu_device = None
             self._t_file_index = 1
-            with mio.xdmf.TimeSeriesReader(self._temperature_path) as reader:
-                dt = self.dt
-                step = self.time_step_counter
-                points, cells = reader.read_points_cells()
-                self._t_file_bounds[0], point_data0, cell_data0 = reader.read_data(0)
-                self._t_file_arrays[0] = np.squeeze(point_data0['T'])
-                self._t_file_bounds[1], point_data1, cell_data0 = reader.read_data(self._t_file_index)
-                self._t_file_arrays[1] = np.squeeze(point_data1['T'])
-                while(dt*step > self._t_file_bounds[1]):
-                    self._t_file_bounds[0] = self._t_file_bounds[1]
-                    self._t_file_arrays[0] = self._t_file_arrays[1]
-                    self._t_file_index += 1
-                    self._t_file_bounds[1], point_data1, cell_data0 = reader.read_data(self.t_file_index)
-                    self._t_file_arrays[1] = np.squeeze(point_data1['T'])
-                array = self._t_file_arrays[0]*(self._t_file_bounds[1] - dt*step)/(self._t_file_bounds[1]-self._t_file_bounds[0]) + self._t_file_arrays[1]*(dt*step-self._t_file_bounds[0])/(self._t_file_bounds[1]-self._t_file_bounds[0])
-                t_field = Field(data=array, simulation=self, colormap="jet", name="Temperature ("+self._temperature_units+")")
-                self.temperature = t_field
+            dt = self.dt
+            step = self.time_step_counter
+            self._t_file_bounds[0] = self._read_t_file(0, 0)
+            self._t_file_bounds[1] = self._read_t_file(self._t_file_index, 1)
+            self._t_file_inverse_interval = 1./(self._t_file_bounds[1]-self._t_file_bounds[0])
+            self._advance_t_file(dt*step)
+            array = np.empty(self._t_file_arrays[0].shape)
+            self._interpolate_t_file(dt*step, array)
+            t_field = Field(data=array, simulation=self, colormap="jet", name="Temperature ("+self._temperature_units+")")
+            self.temperature = t_field
         
     def init_tdb_params(self):
         if not(self._tdb_container is None):
@@ -185,62 +343,22 @@ class Simulation:
             if(self._framework == "CPU_SERIAL" or self._framework == "CPU_PARALLEL"):
                 self._tdb_ufuncs = self._tdb_container._tdb_cpu_ufuncs
             else:
-                self._tdb_ufuncs = self._tdb_container._tdb_gpu_ufuncs
+                self._tdb_ufuncs = self._tdb_container._tdb_device_ufuncs
             return
         if(self._tdb_path is None):
             return
         #if tdb_path is specified, pycalphad *must* be installed
-        if not ppf_utils.successfully_imported_pycalphad():
+        if not _require_pycalphad():
             raise ImportError
         import pycalphad as pyc
         self._tdb = pyc.Database(self._tdb_path)
-        if self._tdb_phases is None:
-            self._tdb_phases = list(self._tdb.phases)
-        if self._tdb_components is None:
-            self._tdb_components = list(self._tdb.elements)
-        self._tdb_phases.sort()
-        self._tdb_components.sort()
-        param_search = self._tdb.search
-        for k in range(len(self._tdb_phases)):
-            phase_id = self._tdb_phases[k]
-            phase = self._tdb.phases[phase_id]
-            g_param_query = (
-                (where('phase_name') == phase.name) & \
-                ((where('parameter_type') == 'G') | \
-                (where('parameter_type') == 'L'))
-            )
-            model = pyc.Model(self._tdb, self._tdb_components, phase_id)
-            sympyexpr = model.redlich_kister_sum(phase, param_search, g_param_query)
-            ime = model.ideal_mixing_energy(self._tdb)
-            
-            for i in self._tdb.symbols:
-                d = self._tdb.symbols[i]
-                g = sp.Symbol(i)
-                sympyexpr = sympyexpr.subs(g, d)
-
-            sympysyms_list = []
-            T = None
-            symbol_name_list = []
-            for i in list(self._tdb_components):
-                symbol_name_list.append(phase_id+"0"+i)
-                
-            for j in sympyexpr.free_symbols:
-                if j.name in symbol_name_list: 
-                    #this may need additional work for phases with sublattices...
-                    sympysyms_list.append(j)
-                elif j.name == "T":
-                    T = j
-                else:
-                    sympyexpr = sympyexpr.subs(j, 0)
-            sympysyms_list = sorted(sympysyms_list, key=lambda t:t.name)
-            sympysyms_list.append(T)
-            
-            if(self._framework == "CPU_SERIAL" or self._framework == "CPU_PARALLEL"):
-                #use numpy for CPUs
-                self._tdb_ufuncs.append(sp.lambdify([sympysyms_list], sympyexpr+ime, 'numpy'))
-            else: 
-                #use numba for GPUs
-                self._tdb_ufuncs.append(numba.jit(sp.lambdify([sympysyms_list], sympyexpr+ime, 'math')))
+        #sorted once into tuples, which later code (and users) can hash and compare cheaply
+        self._tdb_phases = tuple(sorted(self._tdb.phases if self._tdb_phases is None else self._tdb_phases))
+        self._tdb_components = tuple(sorted(self._tdb.elements if self._tdb_components is None else self._tdb_components))
+        #use numpy for CPUs, inlined CUDA device functions for GPUs
+        device = not(self._framework == "CPU_SERIAL" or self._framework == "CPU_PARALLEL")
+        self._tdb_ufuncs = ppf_utils.tdb_phase_functions(self._tdb, self._tdb_path, self._tdb_phases, self._tdb_components, 
+                                                         device=device)
 
     def simulate(self, number_of_timesteps):
         """
@@ -255,20 +373,60 @@ class Simulation:
                 - Gradient: Add dT/dt, multiplied by the timestep length, to the thermal field
                 - File: Use linear interpolation to find the thermal field of the new timestep
             * If the timestep counter is a multiple of time_steps_per_checkpoint, save a checkpoint of the simulation
+        Steps are run in chunks which end on the checkpoint steps. If the subclass defines a compiled step function 
+            (self._numba_kernel) and numba is installed, each chunk is run within compiled code by ppf_cpu_utils.simulate
+        Compiled chunks alternate between two field buffers rather than copying, so after an odd number of steps 
+            each Field.data is a view of the other buffer. Arrays taken from field.data or field.get_cells() before 
+            calling simulate may hold old values afterwards: get them from the Field again (the Field objects themselves 
+            stay valid, and assigning to field.data still writes into the simulation's fields)
         """
         if(self._begun_simulation == False):
-            self._begun_simulation == True
+            self._begun_simulation = True
             self.just_before_simulating()
-        for i in range(number_of_timesteps):
-            self.time_step_counter += 1
-            self.simulation_loop()
-            self.update_temperature_field()
-            self.apply_boundary_conditions()
-            if(self._autosave_flag):
-                if self.time_step_counter % self._autosave_rate == 0:
-                    if(self._uses_gpu):
-                        ppf_gpu_utils.retrieve_fields_from_GPU(self)
-                    self.save_simulation()
+        compiled = ppf_cpu_utils.uses_compiled_loop(self)
+        if not(compiled):
+            #bind everything used per step once, rather than looking it up every step
+            loop = self.simulation_loop
+            update_temperature = self._temperature_updater()
+            apply_boundary_conditions = self.apply_boundary_conditions
+        autosave = self._autosave_flag
+        autosave_rate = self._autosave_rate
+        #run chunks of steps which end exactly on the autosave steps, so only the end of each chunk checks for a checkpoint
+        steps_remaining = number_of_timesteps
+        while(steps_remaining > 0):
+            steps = steps_remaining
+            if(autosave):
+                steps = min(steps, autosave_rate - self.time_step_counter % autosave_rate)
+            if(compiled):
+                ppf_cpu_utils.simulate(self, steps)
+            else:
+                for i in range(steps):
+                    self.time_step_counter += 1
+                    loop()
+                    update_temperature()
+                    apply_boundary_conditions()
+            steps_remaining -= steps
+            if(autosave and (self.time_step_counter % autosave_rate == 0)):
+                self.save_simulation(blocking=False)
+                    
+    def _temperature_updater(self):
+        """
+        Returns a function, taking no arguments, equivalent to self.update_temperature_field() for the current thermal type
+        
+        Constant thermal fields get a function which does nothing, and a linear gradient on the CPU adds a precomputed 
+        increment in place. Subclasses which override update_temperature_field always use their own method
+        """
+        if not(type(self).update_temperature_field is Simulation.update_temperature_field):
+            return self.update_temperature_field
+        if(self._temperature_type is None or self._temperature_type == "ISOTHERMAL"):
+            return _no_temperature_update
+        if(self._temperature_type == "LINEAR_GRADIENT" and not(self._uses_gpu)):
+            array = self.temperature.data
+            increment = self._dTdt*self.dt
+            def update_linear_gradient():
+                np.add(array, increment, out=array)
+            return update_linear_gradient
+        return self.update_temperature_field
                 
     def initialize_fields_and_imported_data(self):
         self._requires_initialization = False
@@ -286,20 +444,197 @@ class Simulation:
         if(self._uses_gpu):
             self.send_fields_to_GPU()
         self.apply_boundary_conditions()
-        assert(self.temperature.data.shape == self.fields[0].data.shape)
+        if not(self.temperature is None):
+            assert(self.temperature.data.shape == self.fields[0].data.shape)
                 
     def simulation_loop(self):
         pass
     
     def add_field(self, array, array_name, colormap="GnBu"):
+        """
+        Adds a field to the simulation. The data of all fields is stored in a single contiguous array,
+        self._field_stack, with shape (nfields, *dims+2). Fields-first layout keeps each field (each 
+        Field.data view) contiguous, which is what the per-field stencil sweeps in the engines want.
+        """
         field = Field(data=array, name=array_name, simulation=self, colormap=colormap)
+        old_stack = self._field_stack
+        self._field_stack = self._allocate_field_stack((len(self.fields)+1,)+field.data.shape)
+        if not(old_stack is None):
+            self._field_stack[:-1] = old_stack
+        self._field_stack[-1] = field.data
+        self._field_stack_out = None
         self.fields.append(field)
+        for i in range(len(self.fields)):
+            self.fields[i]._set_view(self._field_stack[i])
+            
+    def _add_fields(self, arrays):
+        """
+        Equivalent to calling add_field(array, name) for each name, array in the dictionary arrays, but the stacked 
+        fields array is only reallocated once, and each array is copied straight into it
+        """
+        names = list(arrays.keys())
+        if(len(names) == 0):
+            return
+        shape = tuple(np.array(arrays[names[0]].shape)+2)
+        old_stack = self._field_stack
+        self._field_stack = self._allocate_field_stack((len(self.fields)+len(names),)+shape)
+        if not(old_stack is None):
+            self._field_stack[:len(self.fields)] = old_stack
+        self._field_stack_out = None
+        for i in range(len(self.fields)):
+            self.fields[i]._set_view(self._field_stack[i])
+        for name in names:
+            view = self._field_stack[len(self.fields)]
+            self.fields.append(Field(data=arrays[name], name=name, simulation=self, view=view))
+            
+    def _allocate_field_stack(self, shape):
+        """
+        Allocates an (uninitialized) array for stacked fields, aligned to a cache line so compiled kernels
+        get aligned vector loads. Arrays larger than a huge page are huge page aligned as well.
+        For CPU_PARALLEL, the array is zeroed by the compiled kernel threads (first touch), so its pages are 
+        spread across the NUMA nodes the same way the parallel stencil sweeps are.
+        """
+        hugepages = (int(np.prod(shape))*8 >= ppf_cpu_utils.HUGEPAGE_SIZE)
+        stack = ppf_cpu_utils.aligned_empty(shape, dtype=np.float64, hugepages=hugepages)
+        if(self._framework == "CPU_PARALLEL" and ppf_cpu_utils.numba_enabled):
+            with ppf_cpu_utils.simulation_threads_set(self):
+                ppf_cpu_utils.first_touch_fill(stack, 0.)
+        return stack
+        
+    def _swap_field_stacks(self):
+        """
+        Swaps self._field_stack with self._field_stack_out, and points each Field.data at the new stack
+        Used after an engine step writes the new values of the fields into self._field_stack_out
+        """
+        self._field_stack, self._field_stack_out = self._field_stack_out, self._field_stack
+        for i in range(len(self.fields)):
+            self.fields[i]._set_view(self._field_stack[i])
         
     def default_value(self, var, value):
         original = getattr(self, var, None)
         if(original is None):
             setattr(self, var, value)
 
+    def _open_t_file_reader(self):
+        """Returns the reader of the xdmf thermal history, which is opened once and kept until close_simulation"""
+        if(self._t_file_reader is None):
+            self._t_file_reader = mio.xdmf.TimeSeriesReader(self._temperature_path)
+            #read_data requires the cells of the mesh, which are set by read_points_cells
+            self._t_file_reader.read_points_cells()
+        return self._t_file_reader
+    
+    def _read_t_file(self, index, slot):
+        """
+        Reads step index of the thermal history into self._t_file_arrays[slot], returns the time of the step
+        
+        The two arrays are allocated on the first read (page-locked if the simulation uses a GPU, so they can be 
+        uploaded directly) and reused afterwards, steps are copied into them rather than kept as new arrays
+        """
+        if not(self._t_file_lut is None) and (0 <= index-self._t_file_lut_start < len(self._t_file_lut)):
+            #preloaded, the slot becomes a view of the step
+            self._t_file_arrays[slot] = self._t_file_lut[index-self._t_file_lut_start]
+            return self._t_file_lut_times[index-self._t_file_lut_start]
+        time, point_data, cell_data = self._open_t_file_reader().read_data(index)
+        data = np.squeeze(point_data['T'])
+        array = self._t_file_arrays[slot]
+        if(array is None or array.shape != data.shape or self._in_t_file_lut(array)):
+            if(self._uses_gpu):
+                array = ppf_gpu_utils.pinned_empty(data.shape)
+            else:
+                array = np.empty(data.shape)
+            self._t_file_arrays[slot] = array
+        np.copyto(array, data)
+        return time
+    
+    def _in_t_file_lut(self, array):
+        return not(self._t_file_lut is None) and (array.base is self._t_file_lut)
+    
+    def preload_temperature_file(self, number_of_timesteps=None):
+        """
+        Reads the steps of the xdmf thermal history needed for the next number_of_timesteps simulation steps (or all of 
+        them, if None) into a single array, held for the rest of the simulation (or until this is called again)
+        
+        Steps of the history are then never read from the file while simulating, advancing to the next step only 
+        points at the next entry of the array, and on GPUs the array is uploaded once, rather than one step at a time. 
+        Uses memory for every preloaded step, so is best for histories with few steps relative to the simulation length
+        """
+        if not(self._temperature_type == "XDMF_FILE"):
+            raise ValueError("Only xdmf thermal histories can be preloaded!")
+        reader = self._open_t_file_reader()
+        start = self._t_file_index-1
+        end_time = None if (number_of_timesteps is None) else self.dt*(self.time_step_counter+number_of_timesteps)
+        #the current pair of steps is already in memory, as are the steps of an earlier preload, only the other 
+        #steps are read from the file, each one once
+        times = [self._t_file_bounds[0], self._t_file_bounds[1]]
+        steps = [self._t_file_arrays[0], self._t_file_arrays[1]]
+        old_lut = self._t_file_lut
+        index = start+2
+        while(index < reader.num_steps and (end_time is None or times[-1] < end_time)):
+            if not(old_lut is None) and (0 <= index-self._t_file_lut_start < len(old_lut)):
+                times.append(self._t_file_lut_times[index-self._t_file_lut_start])
+                steps.append(old_lut[index-self._t_file_lut_start])
+            else:
+                time, point_data, cell_data = reader.read_data(index)
+                times.append(time)
+                steps.append(np.squeeze(point_data['T']))
+            index += 1
+        if(self._uses_gpu):
+            lut = ppf_gpu_utils.pinned_empty((len(steps),)+steps[0].shape)
+        else:
+            lut = np.empty((len(steps),)+steps[0].shape)
+        for i in range(len(steps)):
+            np.copyto(lut[i], steps[i])
+        times = np.array(times)
+        self._t_file_lut = lut
+        self._t_file_lut_times = times
+        self._t_file_lut_start = start
+        self._t_file_lut_gpu_device = None
+        #point the current pair of steps at the preloaded array
+        self._t_file_bounds[0] = self._read_t_file(self._t_file_index-1, 0)
+        self._t_file_bounds[1] = self._read_t_file(self._t_file_index, 1)
+        if(self._uses_gpu and not(self._fields_gpu_device is None)):
+            ppf_gpu_utils.send_temperature_lut_to_GPU(self)
+    
+    def _advance_t_file(self, time):
+        """
+        Reads thermal history steps until time is between self._t_file_bounds[0] and self._t_file_bounds[1]
+        Returns the number of steps read
+        """
+        steps = 0
+        while(time > self._t_file_bounds[1]):
+            #the arrays are used as a ring buffer, the newer step becomes the older one and its array is refilled
+            self._t_file_bounds[0] = self._t_file_bounds[1]
+            self._t_file_arrays[0], self._t_file_arrays[1] = self._t_file_arrays[1], self._t_file_arrays[0]
+            self._t_file_index += 1
+            self._t_file_bounds[1] = self._read_t_file(self._t_file_index, 1)
+            self._t_file_inverse_interval = 1./(self._t_file_bounds[1]-self._t_file_bounds[0])
+            steps += 1
+        return steps
+            
+    def _interpolate_t_file(self, time, out):
+        """Writes the thermal history, linearly interpolated to time, into out, without allocating temporary arrays"""
+        w0 = (self._t_file_bounds[1] - time)*self._t_file_inverse_interval
+        w1 = (time - self._t_file_bounds[0])*self._t_file_inverse_interval
+        if(self._t_file_buffer is None or self._t_file_buffer.shape != out.shape):
+            self._t_file_buffer = np.empty(out.shape)
+        np.multiply(self._t_file_arrays[0], w0, out=out)
+        np.multiply(self._t_file_arrays[1], w1, out=self._t_file_buffer)
+        out += self._t_file_buffer
+    
+    def close_simulation(self):
+        """
+        Waits for checkpoints still being written, stops the thread writing them, and closes files kept open by the 
+        simulation (the xdmf thermal history). The simulation may still be used afterwards, files are reopened (and 
+        the checkpoint writer recreated) when needed
+        """
+        if not(self._checkpoint_writer is None):
+            writer = self._checkpoint_writer
+            self._checkpoint_writer = None
+            writer.close()
+        if not(self._t_file_reader is None):
+            self._t_file_reader.__exit__(None, None, None)
+            self._t_file_reader = None
+        
     def update_temperature_field(self, force_cpu=False):
         """Updates the thermal field, method assumes only one timestep has passed"""
         if(self._uses_gpu and (not(force_cpu))):
@@ -316,17 +651,8 @@ class Simulation:
         elif(self._temperature_type == "XDMF_FILE"):
             dt = self.get_time_step_length()
             step = self.get_time_step_counter()
-            while(dt*step > self._t_file_bounds[1]):
-                with mio.xdmf.TimeSeriesReader(self._temperature_path) as reader:
-                    reader.cells=[]
-                    self._t_file_bounds[0] = self._t_file_bounds[1]
-                    self._t_file_arrays[0] = self._t_file_arrays[1]
-                    self._t_file_index += 1
-                    self._t_file_bounds[1], point_data1, cell_data0 = reader.read_data(self._t_file_index)
-                    self._t_file_arrays[1] = np.squeeze(point_data1['T'])
-            array = self.temperature.get_cells()
-            array[:] = 0
-            array += self._t_file_arrays[0]*(self._t_file_bounds[1] - dt*step)/(self._t_file_bounds[1]-self._t_file_bounds[0]) + self._t_file_arrays[1]*(dt*step-self._t_file_bounds[0])/(self._t_file_bounds[1]-self._t_file_bounds[0])
+            self._advance_t_file(dt*step)
+            self._interpolate_t_file(dt*step, self.temperature.get_cells())
             return
         else:
             raise ValueError("Unknown temperature profile.")
@@ -338,8 +664,16 @@ class Simulation:
             If no filename is specified, a file with the specified step number is loaded from
             the _save_path.
         """
+        # Make sure checkpoints still being written are finished first
+        self.wait_for_saves()
+        # Later delta checkpoints must not be based on checkpoints of the fields being replaced
+        if not(self._checkpoint_writer is None):
+            self._checkpoint_writer.reset_delta_base()
+        
         # Clear fields list
         self.fields = []
+        self._field_stack = None
+        self._field_stack_out = None
         
         if file_path is None:
             file_path = self._save_path
@@ -366,12 +700,11 @@ class Simulation:
         if(self._save_path is None):
             self._save_path = str(file_path.parent)
 
-        # Load array
-        fields_dict = np.load(file_path, allow_pickle=True)
+        # Load array (rebuilds delta checkpoints from the chain of checkpoints they are based on)
+        fields_dict = ppf_utils.load_checkpoint(file_path)
 
         # Add arrays self.fields as Field objects
-        for key, value in fields_dict.items():
-            self.add_field(value, key)
+        self._add_fields(fields_dict)
             
         # Set dimensions of simulation
         self.dimensions = list(self.fields[0].get_cells().shape)
@@ -396,30 +729,71 @@ class Simulation:
         self._begun_simulation = False
         return 0
     
-    def save_simulation(self):
+    def save_simulation(self, blocking=True):
         """
         Saves all fields in a .npz in either the user-specified save path or a default path. Step number is saved
         in the file name.
+        The file is written by a background thread (ppf_utils.CheckpointWriter). If blocking is False, the method 
+        returns as soon as a copy of the fields has been made (or, on a GPU, queued), allowing the simulation to 
+        continue while saving.
         TODO: save data for simulation instance in header file
         """
-        save_dict = dict()
-        for i in range(len(self.fields)):
-            tmp = self.fields[i]
-            save_dict[tmp.name] = tmp.get_cells()
-
         # Save array with path
         if not self._save_path:
             #if save path is not defined, do not save, just return
             print("self._save_path not defined, aborting save!")
             return
-        else:
+        #the folder is only created (and its Path built) again if the save path changed since the last checkpoint
+        if(self._save_loc is None or self._save_loc[0] != self._save_path):
             save_loc = Path(self._save_path)
-        save_loc.mkdir(parents=True, exist_ok=True)
-
-        np.savez(str(save_loc) + "/step_" + str(self.time_step_counter), **save_dict)
+            save_loc.mkdir(parents=True, exist_ok=True)
+            self._save_loc = (self._save_path, save_loc)
+        save_loc = self._save_loc[1]
+        
+        if(self._checkpoint_writer is None):
+            self._checkpoint_writer = ppf_utils.CheckpointWriter(delta=self._delta_checkpoints_flag, dtype=self._checkpoint_dtype, 
+                                                                 compress=self._checkpoint_compression_flag)
+        names = []
+        for i in range(len(self.fields)):
+            names.append(self.fields[i].name)
+        path = save_loc / ("step_" + str(self.time_step_counter) + ".npz")
+        if(self._uses_gpu):
+            #fields are saved from the GPU directly, the copy to the host overlaps with the next steps
+            ppf_gpu_utils.write_checkpoint_from_GPU(self, self._checkpoint_writer, path, names)
+        else:
+            self._checkpoint_writer.write(path, self._field_stack, names, self.fields[0]._slice)
+        if(blocking):
+            self._checkpoint_writer.wait()
         return 0
     
-    def plot_simulation(self, fields=None, interpolation="bicubic", units="cells", save_images=False, size=None, norm=False):
+    def wait_for_saves(self):
+        """Blocks until all checkpoints queued by save_simulation have been written"""
+        if not(self._checkpoint_writer is None):
+            self._checkpoint_writer.wait()
+            
+    def flush_async(self):
+        """
+        Starts copying the fields (and thermal field) from the GPU to the host, without waiting for the copy 
+        The simulation may keep running meanwhile. wait_for_flush then puts the copy, i.e. the fields as they were 
+        when flush_async was called, into the Field arrays, for plotting or analysis. Does nothing on the CPU
+        """
+        if(self._uses_gpu):
+            ppf_gpu_utils.flush_fields_from_GPU_async(self)
+            
+    def wait_for_flush(self):
+        """Blocks until the copy started by the last call of flush_async is done, and writes it into the Field arrays"""
+        if(self._uses_gpu):
+            ppf_gpu_utils.finish_flush_from_GPU(self)
+    
+    def plot_simulation(self, fields=None, interpolation="bicubic", units="cells", save_images=False, size=None, norm=False, 
+                        limits=None):
+        """
+        Plots the given fields (all of them by default)
+        
+        2D fields are colored from their own minimum and maximum, or from limits = (vmin, vmax) if given. Images 
+        are cached between calls, and only the changed tiles are recolored if the limits stay the same, so fixed 
+        limits (or norm=True, fixed at 0 to 1 for the first field) make repeated plots of a large field much faster
+        """
         if(self._uses_gpu):
             ppf_gpu_utils.retrieve_fields_from_GPU(self)
         if fields is None:
@@ -438,37 +812,93 @@ class Simulation:
             plt.legend(legend)
             plt.show()
         else:
+            #every field has the same shape, so the extent is the same for all of them
+            shape = self.fields[0].data.shape
+            if(units == "cells"):
+                scale = 1.
+            elif(units == "cm"):
+                scale = self.get_cell_spacing()
+            elif(units == "m"):
+                scale = self.get_cell_spacing()/100.
+            else:
+                raise ValueError("Unknown units: "+str(units))
+            extent = [0, shape[1]*scale, 0, shape[0]*scale]
             for i in fields:
+                if(norm and (i == 0)):
+                    color_norm = PowerNorm(10, vmin=0, vmax=1)
+                elif not(limits is None):
+                    color_norm = Normalize(vmin=limits[0], vmax=limits[1])
+                else:
+                    vmin, vmax = ppf_cpu_utils.min_max(self.fields[i].data)
+                    color_norm = Normalize(vmin=vmin, vmax=vmax)
+                colormap = plt.get_cmap(self.fields[i].colormap)
+                mappable = cm.ScalarMappable(norm=color_norm, cmap=colormap)
+                image = self._field_image(i, colormap, color_norm)
+                figure = self._plot_figure
+                if(figure is None or not(plt.fignum_exists(figure[0].number))):
+                    fig, ax = plt.subplots(figsize=size)
+                    im = ax.imshow(image, interpolation=interpolation, extent=extent)
+                    colorbar = fig.colorbar(mappable, ax=ax)
+                    self._plot_figure = (fig, ax, im, colorbar)
+                else:
+                    #reuse the open figure, only the image data, extent, and colorbar change
+                    fig, ax, im, colorbar = figure
+                    plt.figure(fig.number)
+                    if not(size is None):
+                        fig.set_size_inches(size)
+                    im.set_data(image)
+                    im.set_extent(extent)
+                    im.set_interpolation(interpolation)
+                    colorbar.update_normal(mappable)
+                ax.set_title(self.fields[i].name)
                 if(units == "cells"):
-                    extent = [0, self.fields[i].data.shape[1], 0, self.fields[i].data.shape[0]]
-                elif(units == "cm"):
-                    extent = [0, self.fields[i].data.shape[1]*self.get_cell_spacing(), 0, self.fields[i].data.shape[0]*self.get_cell_spacing()]
-                elif(units == "m"):
-                    extent = [0, self.fields[i].data.shape[1]*self.get_cell_spacing()/100., 0, self.fields[i].data.shape[0]*self.get_cell_spacing()/100.]
-                if not (size is None):
-                    plt.figure(figsize=size)
-                if(norm):
-                    if(i == 0):
-                        plt.imshow(self.fields[i].data, interpolation=interpolation, cmap=self.fields[i].colormap, extent=extent, norm=PowerNorm(10, vmin=0, vmax=1))
-                    else:
-                        plt.imshow(self.fields[i].data, interpolation=interpolation, cmap=self.fields[i].colormap, extent=extent)
+                    ax.set_xlabel("")
+                    ax.set_ylabel("")
                 else:
-                    plt.imshow(self.fields[i].data, interpolation=interpolation, cmap=self.fields[i].colormap, extent=extent)
-                plt.title(self.fields[i].name)
-                plt.colorbar()
-                if(units == "cm"):
-                    plt.xlabel("cm")
-                    plt.ylabel("cm")
-                elif(units == "m"):
-                    plt.xlabel("m")
-                    plt.ylabel("m")
+                    ax.set_xlabel(units)
+                    ax.set_ylabel(units)
                 if(save_images):
-                    plt.savefig(self._save_path+"/"+self.fields[i].name+"_"+str(self.get_time_step_counter())+".png")
+                    fig.savefig(self._save_path+"/"+self.fields[i].name+"_"+str(self.get_time_step_counter())+".png")
                 plt.show()
                 
 
+    def _field_image(self, i, colormap, color_norm):
+        """
+        Returns the RGBA (uint8) image of field i, colored using colormap and color_norm
+        
+        The image and a copy of the data are kept between calls. If the colormap and the limits of the normalization 
+        are unchanged, only the tiles of the field which changed since the last call are recolored, often a small 
+        fraction of the field (e.g. around a growing interface). Limits taken from the data itself usually change 
+        every call, which recolors everything, so the copy of the data is only kept for fixed limits
+        """
+        data = self.fields[i].data
+        key = (data.shape, colormap.name, type(color_norm), color_norm.vmin, color_norm.vmax, getattr(color_norm, "gamma", None))
+        cache = self._plot_cache.get(i)
+        if(cache is None or cache[0] != key):
+            image = colormap(color_norm(data), bytes=True)
+            if(cache is None or cache[0][1:] == key[1:]):
+                #first plot, or same limits as last time (fixed limits, or a new shape): keep the data to compare against
+                self._plot_cache[i] = (key, image, data.copy())
+            else:
+                #limits changed, likely the data min/max: keep the key to notice if they settle, not the data
+                self._plot_cache[i] = (key, None, None)
+            return image
+        if(cache[1] is None):
+            image = colormap(color_norm(data), bytes=True)
+            self._plot_cache[i] = (key, image, data.copy())
+            return image
+        key, image, previous = cache
+        t = self._plot_tile_size
+        for y in range(0, data.shape[0], t):
+            for x in range(0, data.shape[1], t):
+                tile = (slice(y, y+t), slice(x, x+t))
+                if not np.array_equal(data[tile], previous[tile]):
+                    image[tile] = colormap(color_norm(data[tile]), bytes=True)
+                    previous[tile] = data[tile]
+        return image
+
     def set_dimensions(self, dimensions):
-        self.dimensions = dimensions
+        self.dimensions = _normalize_dimensions(dimensions)
     def get_dimensions(self):
         return self.dimensions
     
@@ -477,6 +907,11 @@ class Simulation:
     def get_framework(self):
         return self._framework
     
+    def set_num_threads(self, num_threads):
+        self._num_threads = num_threads
+    def get_num_threads(self):
+        return self._num_threads
+    
     def set_dx(self, dx):
         self.dx = dx
     def set_cell_spacing(self, dx):
@@ -542,9 +977,23 @@ class Simulation:
         self._autosave_save_images_flag = autosave_save_images_flag
     def set_autosave_rate(self, autosave_rate):
         self._autosave_rate = autosave_rate
+    def set_delta_checkpoints_flag(self, delta_checkpoints_flag):
+        self._delta_checkpoints_flag = delta_checkpoints_flag
+        if not(self._checkpoint_writer is None):
+            self._checkpoint_writer.delta = delta_checkpoints_flag
+    def set_checkpoint_dtype(self, checkpoint_dtype):
+        self._checkpoint_dtype = checkpoint_dtype
+        if not(self._checkpoint_writer is None):
+            self._checkpoint_writer.dtype = checkpoint_dtype
+    def set_checkpoint_compression_flag(self, checkpoint_compression_flag):
+        self._checkpoint_compression_flag = checkpoint_compression_flag
+        if not(self._checkpoint_writer is None):
+            self._checkpoint_writer.compress = checkpoint_compression_flag
         
     def set_boundary_conditions(self, boundary_conditions_type):
         self._boundary_conditions_type = boundary_conditions_type
+        if not(self.dimensions is None):
+            self._bc_codes = ppf_cpu_utils.boundary_condition_codes(self)
         
     def set_user_data(self, data):
         self.user_data = data
@@ -558,72 +1007,77 @@ class Simulation:
     
 
     def apply_boundary_conditions(self):
-        neumann_slices_1 = [[(0), (None, 0), (None, None, 0)], [(1), (None, 1), (None, None, 1)]]
-        neumann_slices_2 = [[(-1), (None, -1), (None, None, -1)], [(-2), (None, -2), (None, None, -2)]]
-        periodic_slices_1 = [[(0), (None, 0), (None, None, 0)], [(-2), (None, -2), (None, None, -2)]]
-        periodic_slices_2 = [[(-1), (None, -1), (None, None, -1)], [(1), (None, 1), (None, None, 1)]]
-        dirchlet_slices_1 = [(0), (None, 0), (None, None, 0)]
-        dirchlet_slices_2 = [(-1), (None, -1), (None, None, -1)]
+        """
+        Sets the boundary (ghost) cells of every field, and of the thermal field
+        
+        If numba is installed, the fields are done by one compiled call (ppf_cpu_utils.apply_boundary_conditions_compiled, 
+        also used by the compiled step loops), otherwise each face is a single slice assignment on self._field_stack, 
+        so it is applied to all fields at once
+        """
         if(self._uses_gpu):
             ppf_gpu_utils.apply_boundary_conditions(self)
             return
-        if(self._boundary_conditions_type == "PERIODIC"):
-            dims = len(self.fields[0].data.shape)
-            for i in range(dims):
-                if not(self.temperature is None):
-                    self.temperature.data[periodic_slices_1[0][i]] = self.temperature.data[periodic_slices_1[1][i]]
-                for j in range(len(self.fields)):
-                    self.fields[j].data[periodic_slices_1[0][i]] = self.fields[j].data[periodic_slices_1[1][i]]
-                    self.fields[j].data[periodic_slices_2[0][i]] = self.fields[j].data[periodic_slices_2[1][i]]
-        elif(self._boundary_conditions_type == "NEUMANN"):
-            dims = len(self.fields[0].data.shape)
-            _slice = []
-            for i in range(dims):
-                if not(self.temperature is None):
-                    self.temperature.data[neumann_slices_1[0][i]] = self.temperature.data[neumann_slices_1[1][i]]
-                for j in range(len(self.fields)):
-                    self.fields[j].data[neumann_slices_1[0][i]] = self.fields[j].data[neumann_slices_1[1][i]] - self.dx*self._boundary_conditions_array[j][neumann_slices_1[0][i]]
-                    self.fields[j].data[neumann_slices_2[0][i]] = self.fields[j].data[neumann_slices_2[1][i]] + self.dx*self._boundary_conditions_array[j][neumann_slices_2[0][i]]
-        elif(self._boundary_conditions_type == "DIRCHLET"):
-            dims = len(self.fields[0].data.shape)
-            _slice = []
-            for i in range(dims):
-                if not(self.temperature is None):
-                    #use neumann boundary conditions for temperature field if using dirchlet boundary conditions
-                    self.temperature.data[neumann_slices_1[0][i]] = self.temperature.data[neumann_slices_1[1][i]]
-                for j in range(len(self.fields)):
-                    self.fields[j].data[dirchlet_slices_1[i]] = self._boundary_conditions_array[j][dirchlet_slices_1[i]]
-                    self.fields[j].data[dirchlet_slices_2[i]] = self._boundary_conditions_array[j][dirchlet_slices_2[i]]
-        else: #is array
-            for i in range(len(self._boundary_conditions_type)):
-                if(self._boundary_conditions_type[i] == "PERIODIC"):
-                    if not(self.temperature is None):
-                        self.temperature.data[periodic_slices_1[0][i]] = self.temperature.data[periodic_slices_1[1][i]]
-                    for j in range(len(self.fields)):
-                        self.fields[j].data[periodic_slices_1[0][i]] = self.fields[j].data[periodic_slices_1[1][i]]
-                        self.fields[j].data[periodic_slices_2[0][i]] = self.fields[j].data[periodic_slices_2[1][i]]
-                elif(self._boundary_conditions_type[i] == "NEUMANN"):
-                    if not(self.temperature is None):
-                        self.temperature.data[neumann_slices_1[0][i]] = self.temperature.data[neumann_slices_1[1][i]]
-                    for j in range(len(self.fields)):
-                        self.fields[j].data[neumann_slices_1[0][i]] = self.fields[j].data[neumann_slices_1[1][i]] - self.dx*self._boundary_conditions_array[j][neumann_slices_1[0][i]]
-                        self.fields[j].data[neumann_slices_2[0][i]] = self.fields[j].data[neumann_slices_2[1][i]] + self.dx*self._boundary_conditions_array[j][neumann_slices_2[0][i]]
-                elif(self._boundary_conditions_type[i] == "DIRCHLET"):
-                    if not(self.temperature is None):
-                        #use neumann boundary conditions for temperature field if using dirchlet boundary conditions
-                        self.temperature.data[neumann_slices_1[0][i]] = self.temperature.data[neumann_slices_1[1][i]]
-                    for j in range(len(self.fields)):
-                        self.fields[j].data[dirchlet_slices_1[i]] = self._boundary_conditions_array[j][dirchlet_slices_1[i]]
-                        self.fields[j].data[dirchlet_slices_2[i]] = self._boundary_conditions_array[j][dirchlet_slices_2[i]]
+        #constant thermal fields never need boundary conditions applied
+        temperature = None
+        if not(self.temperature is None) and not(self._temperature_is_scalar):
+            temperature = self.temperature.data
+        fields = self._field_stack
+        if(self._bc_codes is None or len(self._bc_codes) != len(self.dimensions)):
+            self._init_boundary_slices()
+        if(ppf_cpu_utils.numba_enabled and not(fields is None)):
+            #dx is only used by neumann boundary conditions, and may not be set otherwise
+            dx = 0. if (self.dx is None) else float(self.dx)
+            ppf_cpu_utils.apply_boundary_conditions_compiled(fields, self._boundary_conditions_array, self._bc_codes, dx)
+            if(temperature is None):
+                return
+            fields = None
+        appliers = self._bc_appliers
+        for i, code in enumerate(self._bc_codes):
+            appliers[code](i, fields, temperature)
         return
     
+    #single axis boundary condition appliers, used by apply_boundary_conditions
+    #fields is self._field_stack (None if already done), temperature is self.temperature.data (None if not needed)
+    def _apply_periodic_axis(self, i, fields, temperature):
+        low, low_interior, high, high_interior = self._boundary_slices[i]
+        if not(fields is None):
+            fields[low] = fields[high_interior]
+            fields[high] = fields[low_interior]
+        if not(temperature is None):
+            temperature[low[1:]] = temperature[high_interior[1:]]
+            temperature[high[1:]] = temperature[low_interior[1:]]
+            
+    def _apply_neumann_axis(self, i, fields, temperature):
+        low, low_interior, high, high_interior = self._boundary_slices[i]
+        if not(fields is None):
+            bcarray = self._boundary_conditions_array
+            fields[low] = fields[low_interior] - self.dx*bcarray[low]
+            fields[high] = fields[high_interior] + self.dx*bcarray[high]
+        if not(temperature is None):
+            temperature[low[1:]] = temperature[low_interior[1:]]
+            temperature[high[1:]] = temperature[high_interior[1:]]
+            
+    def _apply_dirchlet_axis(self, i, fields, temperature):
+        low, low_interior, high, high_interior = self._boundary_slices[i]
+        if not(fields is None):
+            bcarray = self._boundary_conditions_array
+            fields[low] = bcarray[low]
+            fields[high] = bcarray[high]
+        if not(temperature is None):
+            #use neumann boundary conditions for temperature field if using dirchlet boundary conditions
+            temperature[low[1:]] = temperature[low_interior[1:]]
+            temperature[high[1:]] = temperature[high_interior[1:]]
+            
+    def _apply_no_axis(self, i, fields, temperature):
+        pass
+    
     def send_fields_to_GPU(self):
-        if(ppf_utils.successfully_imported_numba()):
+        if _require_numba():
             ppf_gpu_utils.send_fields_to_GPU(self)
         return
     
     def retrieve_fields_from_GPU(self):
-        if(ppf_utils.successfully_imported_numba()):
+        if _require_numba():
             ppf_gpu_utils.retrieve_fields_from_GPU(self)
         return
 
@@ -632,7 +1086,7 @@ class Simulation:
         Plots each field in self.fields and saves them to the save_path in a separate dir
         Recommended for when the number of fields used would clutter the data folder
         """
-        image_folder = "images_step_" + str(self._time_step_counter) + "/"
+        image_folder = "images_step_" + str(self.time_step_counter) + "/"
         save_path = Path(self._save_path).joinpath(image_folder)
         save_path.mkdir(parents=True, exist_ok=True)
         for i in range(len(self.fields)):
@@ -651,11 +1105,12 @@ class Simulation:
         fig, ax = plt.subplots()
         c = plt.imshow(f.data, interpolation='nearest', cmap=f.colormap)
 
-        title = "Field: " + f.name + ", Step: " + str(self._time_step_counter)
+        title = "Field: " + f.name + ", Step: " + str(self.time_step_counter)
         plt.title(title)
-        fig.colorbar(c, ticks=np.linspace(np.min(f.data), np.max(f.data), 5))
+        vmin, vmax = ppf_cpu_utils.min_max(f.data)
+        fig.colorbar(c, ticks=np.linspace(vmin, vmax, 5))
         # Save image to save_path dir
-        filename = f.name + "Plot_step_" + str(self._time_step_counter) + ".png"
+        filename = f.name + "Plot_step_" + str(self.time_step_counter) + ".png"
         plt.savefig(Path(save_path).joinpath(filename))
         return 0
 
@@ -665,59 +1120,42 @@ class Simulation:
     def generate_python_script(self):
         return
     
-    #import statements, specific to built-in Engines *TO BE REMOVED*
-
-    def init_sim_Diffusion(self, dim=[200], solver="explicit", gmres=False, adi=False):
-        Engines.init_Diffusion(self, dim, solver=solver, gmres=gmres, adi=adi)
-        return
-    
-    def init_sim_DiffusionGPU(self, dim=[200, 200], cuda_blocks=(16,16), cuda_threads_per_block=(256,1)):
-        if not ppf_utils.successfully_imported_numba():
-            return
-        Engines.init_DiffusionGPU(self, dim=dim, cuda_blocks=cuda_blocks, cuda_threads_per_block=cuda_threads_per_block)
-        return
-    
-    def init_sim_CahnAllen(self, dim=[200], solver="explicit", gmres=False, adi=False):
-        Engines.init_CahnAllen(self, dim, solver=solver, gmres=gmres, adi=adi)
-        return
-    
-    def init_sim_CahnHilliard(self, dim=[200], solver="explicit", gmres=False, adi=False):
-        Engines.init_CahnHilliard(self, dim, solver=solver, gmres=gmres, adi=adi)
-        return
-
-    def init_sim_Warren1995(self, dim=[200, 200], diamond_size=15):
-        Engines.init_Warren1995(self, dim=dim, diamond_size=diamond_size)
-        return
-
-    def init_sim_NComponent(self, dim=[200, 200], sim_type="seed", number_of_seeds=1, tdb_path="Ni-Cu_Ideal.tdb",
-                            temperature_type="isothermal",
-                            initial_temperature=1574, temperature_gradient=0, cooling_rate=0, temperature_file_path="T.xdmf",
-                            initial_concentration_array=[0.40831], cell_spacing=0.0000046, d_ratio=1/0.94, solver="explicit", 
-                            nbc=["periodic", "periodic"]):
-        #initializes a Multicomponent simulation, using the NComponent model
-        if not ppf_utils.successfully_imported_pycalphad():
-            return
-        Engines.init_NComponent(self, dim=dim, sim_type=sim_type, number_of_seeds=number_of_seeds, 
-                                tdb_path=tdb_path, temperature_type=temperature_type, 
-                                initial_temperature=initial_temperature, temperature_gradient=temperature_gradient, 
-                                cooling_rate=cooling_rate, temperature_file_path=temperature_file_path, 
-                                cell_spacing=cell_spacing, d_ratio=d_ratio, initial_concentration_array=initial_concentration_array, 
-                                solver=solver, nbc=nbc)
-        return
+    def init_sim(self, model, *args, **kwargs):
+        """
+        Deprecated, create the engine class instead: get_engine(model)(dimensions=..., ...)
+        Turns this simulation into one of the given model (keeping only its save path) and initializes its fields, e.g. 
+        sim.init_sim("Warren1995", [200, 200], dx=4.6e-8, diamond_size=10). The old keyword names (dim, cell_spacing, 
+        initial_temperature, temperature_type="isothermal", nbc, ...) are translated, parameters of Simulation.__init__ 
+        are passed to it, and any other keyword argument goes into user_data
+        sim.init_sim_X(...) is the same as sim.init_sim("X", ...)
+        """
+        warnings.warn("init_sim is deprecated, create the engine class instead, e.g. get_engine(\""+str(model)+
+                      "\")(dimensions=..., dx=..., user_data={...})", DeprecationWarning, stacklevel=2)
+        engine = get_engine(model)
+        if(len(args) > 0):
+            kwargs["dim"] = args[0]
+        parameters = inspect.signature(Simulation.__init__).parameters
+        sim_kwargs = {"save_path": self._save_path, "user_data": {}}
+        for key, value in kwargs.items():
+            key = _LEGACY_INIT_KEYWORDS.get(key, key)
+            if(key == "temperature_type"):
+                value = _LEGACY_TEMPERATURE_TYPES.get(value, value)
+            elif(key == "boundary_conditions"):
+                value = [bc.upper() for bc in value] if isinstance(value, (list, tuple)) else value.upper()
+            if(key == "user_data"):
+                sim_kwargs["user_data"].update(value)
+            elif(key in parameters):
+                sim_kwargs[key] = value
+            else:
+                sim_kwargs["user_data"][key] = value
+        self.__class__ = engine
+        engine.__init__(self, **sim_kwargs)
+        self.initialize_fields_and_imported_data()
     
-    def init_sim_NCGPU(self, dim=[200, 200], sim_type="seed", number_of_seeds=1, tdb_path="Ni-Cu_Ideal.tdb",
-                            temperature_type="isothermal",
-                            initial_temperature=1574, temperature_gradient=0, cooling_rate=0, temperature_file_path="T.xdmf",
-                            initial_concentration_array=[0.40831], cell_spacing=0.0000046, d_ratio=1/0.94, solver="explicit", 
-                            nbc=["periodic", "periodic"], cuda_blocks = (16,16), cuda_threads_per_block = (256,1)):
-        if not ppf_utils.successfully_imported_pycalphad():
-            return
-        if not ppf_utils.successfully_imported_numba():
-            return
-        
-        Engines.init_NCGPU(self, dim=dim, sim_type=sim_type, number_of_seeds=number_of_seeds, 
-                                tdb_path=tdb_path, temperature_type=temperature_type, 
-                                initial_temperature=initial_temperature, temperature_gradient=temperature_gradient, 
-                                cooling_rate=cooling_rate, temperature_file_path=temperature_file_path, 
-                                cell_spacing=cell_spacing, d_ratio=d_ratio, initial_concentration_array=initial_concentration_array, 
-                                solver=solver, nbc=nbc, cuda_blocks=cuda_blocks, cuda_threads_per_block=cuda_threads_per_block)
+    init_sim_Diffusion = partialmethod(init_sim, "Diffusion")
+    init_sim_DiffusionGPU = partialmethod(init_sim, "DiffusionGPU")
+    init_sim_CahnAllen = partialmethod(init_sim, "CahnAllen")
+    init_sim_CahnHilliard = partialmethod(init_sim, "CahnHilliard")
+    init_sim_Warren1995 = partialmethod(init_sim, "Warren1995")
+    init_sim_NComponent = partialmethod(init_sim, "NComponent")
+    init_sim_NCGPU = partialmethod(init_sim, "NCGPU")
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from pyphasefield import ppf_cpu_utils
+from pyphasefield.Engines import CahnAllen
+
+def make_cahn_allen(dimensions, boundary_conditions="PERIODIC", **user_data):
+    np.random.seed(0)
+    sim = CahnAllen(dimensions=dimensions, dx=1., dt=0.5, boundary_conditions=boundary_conditions, user_data=user_data)
+    sim.initialize_fields_and_imported_data()
+    return sim
+
+@pytest.mark.parametrize("boundary_conditions", ["PERIODIC", "NEUMANN", "DIRCHLET"])
+def test_cahn_allen_gmres_matches_direct_solve(boundary_conditions):
+    "The matrix-free GMRES step against the assembled 1D system, including nonzero boundary values"
+    sim = make_cahn_allen([40], boundary_conditions, solver="implicit", gmres=True)
+    sim._boundary_conditions_array[0, 0] = 0.8
+    sim._boundary_conditions_array[0, -1] = 0.1
+    sim.apply_boundary_conditions()
+    old = sim.fields[0].get_cells().copy()
+    n = len(old)
+    M, W, epsilon = sim.user_data["M"], sim.user_data["W"], sim.user_data["epsilon"]
+    alpha = M*sim.dt*epsilon**2
+    matrix = np.diag(1. + 16.*W*M*sim.dt*(4.*old**2 - 6.*old + 2.) + 2.*alpha)
+    rhs = old.copy()
+    for i in range(n-1):
+        matrix[i, i+1] = matrix[i+1, i] = -alpha
+    if(boundary_conditions == "PERIODIC"):
+        matrix[0, -1] = matrix[-1, 0] = -alpha
+    elif(boundary_conditions == "NEUMANN"):
+        #ghost cells are the neighbor -/+ dx*flux
+        matrix[0, 0] -= alpha
+        matrix[-1, -1] -= alpha
+        rhs[0] -= alpha*0.8
+        rhs[-1] += alpha*0.1
+    else:
+        rhs[0] += alpha*0.8
+        rhs[-1] += alpha*0.1
+    sim.simulate(1)
+    assert(np.allclose(sim.fields[0].get_cells(), np.linalg.solve(matrix, rhs), rtol=0., atol=1e-7))
+    #the stencil is kept on the simulation, not in user_data
+    assert(isinstance(sim._gmres_laplacian, ppf_cpu_utils.HomogeneousLaplacian))
+    assert not("gmres_laplacian" in sim.user_data)
+
+def test_gmres_solve_reports_failures(monkeypatch):
+    import scipy.sparse.linalg
+    rhs = np.ones(8)
+    monkeypatch.setattr(scipy.sparse.linalg, "gmres", lambda A, b, **kwargs: (b, 40))
+    with pytest.warns(RuntimeWarning):
+        x, exit_code = ppf_cpu_utils.gmres_solve(lambda x: x, rhs, 1.)
+    assert(exit_code == 40)
+    monkeypatch.setattr(scipy.sparse.linalg, "gmres", lambda A, b, **kwargs: (b, -1))
+    with pytest.raises(ValueError):
+        ppf_cpu_utils.gmres_solve(lambda x: x, rhs, 1.)
+
+def dense_line_solve(line, alpha, source, periodic):
+    "The implicit Cahn-Allen system of one line, assembled, see _cahn_allen_line_solve"
+    n = len(line)
+    matrix = np.diag(1. + 2.*alpha + source*(4.*line**2 - 6.*line + 2.))
+    matrix -= alpha*(np.eye(n, k=1) + np.eye(n, k=-1))
+    if(periodic):
+        matrix[0, -1] = matrix[-1, 0] = -alpha
+    else:
+        matrix[0, 0] -= alpha
+        matrix[-1, -1] -= alpha
+    return np.linalg.solve(matrix, line)
+
+@pytest.mark.parametrize("boundary_conditions", ["PERIODIC", "NEUMANN", ["PERIODIC", "NEUMANN"], ["NEUMANN", "PERIODIC"]])
+def test_cahn_allen_adi_matches_dense_line_solves(boundary_conditions):
+    pytest.importorskip("numba")
+    sim = make_cahn_allen([20, 24], boundary_conditions, solver="implicit")
+    sim.fields[0].get_cells()[...] = np.random.default_rng(4).random((20, 24))
+    sim.apply_boundary_conditions()
+    expected = sim.fields[0].get_cells().copy()
+    M, W, epsilon = sim.user_data["M"], sim.user_data["W"], sim.user_data["epsilon"]
+    alpha = M*sim.dt*epsilon**2
+    source = 8.*W*M*sim.dt
+    periodic = [(bc == "PERIODIC") for bc in (boundary_conditions if isinstance(boundary_conditions, list) else [boundary_conditions]*2)]
+    #x lines (along axis 1) first, then y lines
+    for i in range(expected.shape[0]):
+        expected[i] = dense_line_solve(expected[i], alpha, source, periodic[1])
+    for j in range(expected.shape[1]):
+        expected[:, j] = dense_line_solve(expected[:, j], alpha, source, periodic[0])
+    sim.simulate(1)
+    assert(np.allclose(sim.fields[0].get_cells(), expected, rtol=0., atol=1e-14))
+
+def test_cahn_allen_adi_gpu_matches_cpu():
+    numba = pytest.importorskip("numba")
+    from numba import cuda
+    if not(cuda.is_available() or numba.config.ENABLE_CUDASIM):
+        pytest.skip("no GPU or CUDA simulator")
+    results = []
+    for framework in [None, "GPU_SERIAL"]:
+        np.random.seed(0)
+        sim = CahnAllen(dimensions=[20, 24], dx=1., dt=0.5, boundary_conditions=["PERIODIC", "NEUMANN"], 
+                        framework=framework, user_data={"solver":"implicit"})
+        sim.initialize_fields_and_imported_data()
+        sim.simulate(2)
+        if(sim._uses_gpu):
+            sim.retrieve_fields_from_GPU()
+        results.append(sim.fields[0].get_cells().copy())
+    assert(np.allclose(results[1], results[0], rtol=0., atol=1e-14))
+    #other solvers have no GPU version
+    sim = CahnAllen(dimensions=[20, 24], dx=1., dt=0.5, framework="GPU_SERIAL", user_data={"solver":"explicit"})
+    sim.initialize_fields_and_imported_data()
+    with pytest.raises(ValueError):
+        sim.simulate(1)
@@ -0,0 +1,159 @@
+import numpy as np
+import pytest
+from pyphasefield.field import Field
+from pyphasefield.Engines import CahnHilliard, CahnHilliardBatch
+
+def make_cahn_hilliard(dimensions, **user_data):
+    np.random.seed(0)
+    sim = CahnHilliard(dimensions=dimensions, dx=1., dt=0.1, boundary_conditions="PERIODIC", user_data=user_data)
+    sim.initialize_fields_and_imported_data()
+    return sim
+
+def test_cahn_hilliard_crank_nicolson_boundary_laplacian(monkeypatch):
+    "The Crank-Nicolson step applies a second stencil to the whole laplacian, including its boundary cells"
+    results = []
+    for use_roll in [False, True]:
+        if(use_roll):
+            def roll_laplacian(self, out=None):
+                result = 0
+                for i in range(self.data.ndim):
+                    result = result+(np.roll(self.data, -1, i)+np.roll(self.data, 1, i)-2*self.data)
+                return result/self._simulation.get_cell_spacing()**2
+            monkeypatch.setattr(Field, "laplacian", roll_laplacian)
+        sim = make_cahn_hilliard([32], solver="crank-nicolson", gmres=True)
+        sim.simulate(1)
+        results.append(sim.fields[0].get_cells().copy())
+    assert(abs(results[0]-results[1]).max() < 1e-12)
+
+def test_cahn_hilliard_compiled_threads():
+    "Simulations run on their own thread count, and leave numba's setting as they found it"
+    numba = pytest.importorskip("numba")
+    results = []
+    for framework, threads in [("CPU_SERIAL", None), ("CPU_PARALLEL", 1), ("CPU_PARALLEL", None)]:
+        np.random.seed(0)
+        sim = CahnHilliard(dimensions=[32, 32], dx=1., dt=0.1, boundary_conditions="PERIODIC", framework=framework)
+        sim.set_num_threads(threads)
+        before = numba.get_num_threads()
+        sim.initialize_fields_and_imported_data()
+        sim.simulate(20)
+        assert(numba.get_num_threads() == before)
+        results.append(sim.fields[0].get_cells().copy())
+    assert(np.array_equal(results[0], results[1]))
+    assert(abs(results[0]-results[2]).max() < 1e-12)
+
+def test_cahn_hilliard_gmres_matches_direct_solve():
+    "The matrix-free GMRES step against the assembled periodic 1D system"
+    sim = make_cahn_hilliard([32], solver="implicit", gmres=True)
+    old = sim.fields[0].get_cells().copy()
+    n = len(old)
+    alpha = sim.user_data["M"]*sim.dt
+    beta = alpha*sim.user_data["epsilon"]**2
+    laplacian = np.zeros((n, n))
+    for i in range(n):
+        laplacian[i, i] = -2.
+        laplacian[i, (i+1)%n] = laplacian[i, (i-1)%n] = 1.
+    matrix = np.eye(n) - alpha*laplacian@np.diag(4.*old**2 - 6.*old + 2.) + beta*laplacian@laplacian
+    sim.simulate(1)
+    assert(np.allclose(sim.fields[0].get_cells(), np.linalg.solve(matrix, old), rtol=0., atol=1e-7))
+
+def test_cahn_hilliard_gmres_rejects_boundary_values():
+    np.random.seed(0)
+    sim = CahnHilliard(dimensions=[32], dx=1., dt=0.1, boundary_conditions="DIRCHLET", 
+                       user_data={"solver":"implicit", "gmres":True})
+    sim.initialize_fields_and_imported_data()
+    sim._boundary_conditions_array[0, 0] = 0.5
+    with pytest.raises(ValueError):
+        sim.simulate(1)
+
+def test_cahn_hilliard_fields_after_buffer_swap():
+    "After an odd number of compiled steps the fields are views of the second buffer, and stay usable"
+    pytest.importorskip("numba")
+    sims = []
+    for i in range(2):
+        np.random.seed(0)
+        sims.append(CahnHilliard(dimensions=[24, 24], dx=1., dt=0.1, boundary_conditions="PERIODIC", framework="CPU_SERIAL"))
+        sims[i].initialize_fields_and_imported_data()
+    stepped, sim = sims
+    for i in range(3):
+        stepped.simulate(1)
+    field = sim.fields[0]
+    before = field.data
+    sim.simulate(3)
+    assert(sim.fields[0] is field)
+    assert not(np.shares_memory(field.data, before)) and np.shares_memory(field.data, sim._field_stack)
+    assert(np.array_equal(field.get_cells(), stepped.fields[0].get_cells()))
+    #assigning to the field writes into the simulated buffer, which the next steps start from
+    new = np.full(field.data.shape, 0.5)
+    field.data = new
+    assert(np.array_equal(sim._field_stack[0], new))
+    sim.simulate(1)
+    assert(abs(field.get_cells()-0.5).max() < 1e-12)
+
+@pytest.mark.parametrize("dimensions", [[40], [24, 20], [10, 12, 8]])
+@pytest.mark.parametrize("boundary_conditions", ["PERIODIC", "NEUMANN"])
+def test_cahn_hilliard_fused_kernel_matches_numpy(dimensions, boundary_conditions):
+    "The compiled explicit step (mu kept per block) against the numpy engine"
+    pytest.importorskip("numba")
+    results = []
+    for framework in [None, "CPU_SERIAL", "CPU_PARALLEL"]:
+        np.random.seed(0)
+        sim = CahnHilliard(dimensions=dimensions, dx=1., dt=0.01, boundary_conditions=boundary_conditions, 
+                           framework=framework, user_data={"M":1.})
+        sim.initialize_fields_and_imported_data()
+        sim.simulate(20)
+        results.append(sim.fields[0].get_cells().copy())
+    assert(abs(results[1]-results[0]).max() < 1e-14)
+    assert(abs(results[2]-results[0]).max() < 1e-14)
+    #zero flux and periodic boundaries conserve the total concentration
+    np.random.seed(0)
+    assert(abs(results[1].sum()-(0.001*np.random.random(dimensions)+0.4995).sum()) < 1e-10)
+
+def make_batch(framework=None, **user_data):
+    np.random.seed(0)
+    sim = CahnHilliardBatch(dimensions=[48], dx=1., dt=0.5, framework=framework, user_data={"batch_size":6, **user_data})
+    sim.initialize_fields_and_imported_data()
+    return sim
+
+def test_cahn_hilliard_batch_matches_dense_solve():
+    pytest.importorskip("numba")
+    sim = make_batch()
+    old = sim.fields[0].get_cells().copy()
+    n = old.shape[0]
+    alpha = sim.user_data["M"]*sim.dt
+    beta = alpha*sim.user_data["epsilon"]**2
+    #zero flux laplacian, mirrored ends
+    D2 = np.diag(np.full(n, -2.)) + np.diag(np.ones(n-1), 1) + np.diag(np.ones(n-1), -1)
+    D2[0, 0] = D2[-1, -1] = -1.
+    matrix = np.eye(n) + beta*D2@D2
+    sim.simulate(1)
+    for m in range(old.shape[1]):
+        c = old[:, m]
+        expected = np.linalg.solve(matrix, c + alpha*D2@(c*(4.*c*c - 6.*c + 2.)))
+        assert(np.allclose(sim.fields[0].get_cells()[:, m], expected, rtol=0., atol=1e-14))
+
+def test_cahn_hilliard_batch_conserves_mass():
+    pytest.importorskip("numba")
+    sim = make_batch()
+    mass = sim.fields[0].get_cells().sum(axis=0)
+    sim.simulate(500)
+    assert(abs(sim.fields[0].get_cells().sum(axis=0)-mass).max() < 1e-11)
+
+def test_cahn_hilliard_batch_gpu_matches_cpu():
+    numba = pytest.importorskip("numba")
+    from numba import cuda
+    if not(cuda.is_available() or numba.config.ENABLE_CUDASIM):
+        pytest.skip("no GPU or CUDA simulator")
+    cpu = make_batch()
+    gpu = make_batch(framework="GPU_SERIAL")
+    cpu.simulate(3)
+    gpu.simulate(3)
+    gpu.retrieve_fields_from_GPU()
+    assert(np.allclose(gpu.fields[0].get_cells(), cpu.fields[0].get_cells(), rtol=0., atol=1e-14))
+
+def test_cahn_hilliard_batch_validation():
+    with pytest.raises(ValueError):
+        CahnHilliardBatch(dimensions=[48], user_data={"solver":"explicit"})
+    with pytest.raises(ValueError):
+        sim = CahnHilliardBatch(dimensions=[3], dx=1., dt=0.1, user_data={"batch_size":2})
+        sim.initialize_fields_and_imported_data()
+        sim.simulate(1)
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from pyphasefield import ppf_utils
+from pyphasefield.Engines import Diffusion
+
+def make_diffusion(tmp_path, **kwargs):
+    sim = Diffusion(dimensions=[16, 16], dx=1., dt=0.1, save_path=str(tmp_path), **kwargs)
+    sim.initialize_fields_and_imported_data()
+    return sim
+
+def test_async_writer_copies_before_returning(tmp_path):
+    writer = ppf_utils.CheckpointWriter()
+    fields = np.arange(2*6*7, dtype=np.float64).reshape(2, 6, 7)
+    index = (slice(1, -1), slice(1, -1))
+    writer.write(tmp_path/"a.npz", fields, ["x", "y"], index)
+    expected = fields[:, 1:-1, 1:-1].copy()
+    #the shadow buffer is written, not the array still being simulated
+    fields += 100.
+    writer.wait()
+    loaded = ppf_utils.load_checkpoint(tmp_path/"a.npz")
+    assert(np.array_equal(loaded["x"], expected[0]) and np.array_equal(loaded["y"], expected[1]))
+    assert(list(tmp_path.glob("*.tmp")) == [])
+    writer.close()
+
+def test_writer_close_stops_thread(tmp_path):
+    writer = ppf_utils.CheckpointWriter()
+    thread = writer._thread
+    for i in range(4):
+        writer.write(tmp_path/("step_"+str(i)+".npz"), np.zeros((1, 5)), ["c"], (slice(1, -1),))
+    writer.close()
+    #queued checkpoints were written first
+    assert(sorted(p.name for p in tmp_path.glob("*.npz")) == ["step_0.npz", "step_1.npz", "step_2.npz", "step_3.npz"])
+    assert not(thread.is_alive())
+    assert(writer._free_buffers.empty())
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.write(tmp_path/"late.npz", np.zeros((1, 5)), ["c"], (slice(1, -1),))
+
+def test_close_simulation_releases_writer(tmp_path):
+    sim = make_diffusion(tmp_path)
+    sim.save_simulation(blocking=False)
+    thread = sim._checkpoint_writer._thread
+    sim.close_simulation()
+    assert(sim._checkpoint_writer is None and not thread.is_alive())
+    #saving again creates a new writer
+    sim.simulate(2)
+    sim.save_simulation()
+    assert((tmp_path/"step_2.npz").exists())
+    sim.close_simulation()
+
+def test_delta_checkpoints_roundtrip(tmp_path):
+    sim = make_diffusion(tmp_path, autosave=True, autosave_rate=5)
+    sim.set_delta_checkpoints_flag(True)
+    sim._checkpoint_writer = ppf_utils.CheckpointWriter(delta=True, chunk_bytes=256)
+    states = {}
+    for step in [5, 10, 15]:
+        sim.simulate(5)
+        states[step] = sim.fields[0].get_cells().copy()
+    sim.wait_for_saves()
+    first = np.load(tmp_path/"step_5.npz")
+    later = np.load(tmp_path/"step_10.npz")
+    assert not("_delta_base" in first.files)
+    assert(later["_delta_base"].item() == "step_5.npz")
+    for step in [5, 10, 15]:
+        assert(np.array_equal(ppf_utils.load_checkpoint(tmp_path/("step_"+str(step)+".npz"))["c"], states[step]))
+    sim.close_simulation()
+    
+def test_delta_checkpoints_after_loading(tmp_path):
+    "save -> load an earlier step -> save -> load, the new checkpoints must not be based on the pre-load ones"
+    sim = make_diffusion(tmp_path, autosave=True, autosave_rate=5)
+    sim._checkpoint_writer = ppf_utils.CheckpointWriter(delta=True, chunk_bytes=256)
+    sim.simulate(10)
+    sim.load_simulation(step=5)
+    sim.fields[0].get_cells()[...] = 0.5 #diverge from the run that wrote step_10
+    sim.simulate(5)
+    expected = sim.fields[0].get_cells().copy()
+    sim.wait_for_saves()
+    #step_10 was written again, as a complete checkpoint rather than a delta based on the old step_10 (itself)
+    assert not("_delta_base" in np.load(tmp_path/"step_10.npz").files)
+    sim.load_simulation(step=10)
+    assert(np.array_equal(sim.fields[0].get_cells(), expected))
+    #saving the same step twice does not make a checkpoint based on itself either
+    sim.save_simulation()
+    sim.save_simulation()
+    sim.load_simulation(step=10)
+    assert(np.array_equal(sim.fields[0].get_cells(), expected))
+    sim.close_simulation()
+
+def test_delta_checkpoints_after_changing_save_path(tmp_path):
+    "the base of a delta is stored by file name, so a checkpoint in a new folder must be a complete one"
+    first_folder = tmp_path/"first"
+    second_folder = tmp_path/"second"
+    sim = make_diffusion(first_folder, autosave=True, autosave_rate=5)
+    sim._checkpoint_writer = ppf_utils.CheckpointWriter(delta=True, chunk_bytes=256)
+    sim.simulate(5)
+    sim.set_save_path(str(second_folder))
+    sim.simulate(10)
+    expected = sim.fields[0].get_cells().copy()
+    sim.wait_for_saves()
+    assert not("_delta_base" in np.load(second_folder/"step_10.npz").files)
+    assert(np.load(second_folder/"step_15.npz")["_delta_base"].item() == "step_10.npz")
+    #the new folder can be loaded on its own
+    for p in first_folder.glob("*.npz"):
+        p.unlink()
+    assert(np.array_equal(ppf_utils.load_checkpoint(second_folder/"step_15.npz")["c"], expected))
+    sim.close_simulation()
+
+def test_checkpoint_dtype(tmp_path):
+    sim = make_diffusion(tmp_path)
+    sim.simulate(3)
+    sim.set_checkpoint_dtype(np.float32)
+    sim.save_simulation()
+    on_disk = np.load(tmp_path/"step_3.npz")["c"]
+    assert(on_disk.dtype == np.float32)
+    assert(np.array_equal(on_disk, sim.fields[0].get_cells().astype(np.float32)))
+    #computation is unaffected
+    assert(sim.fields[0].data.dtype == np.float64)
+    sim.close_simulation()
+
+@pytest.mark.parametrize("compression", [True, "zstd"])
+def test_compressed_checkpoints(tmp_path, compression):
+    if(compression == "zstd"):
+        pytest.importorskip("zstandard")
+    sim = make_diffusion(tmp_path, autosave=True, autosave_rate=2)
+    sim.set_checkpoint_compression_flag(compression)
+    sim.set_delta_checkpoints_flag(True)
+    sim.simulate(4)
+    expected = sim.fields[0].get_cells().copy()
+    sim.wait_for_saves()
+    with open(tmp_path/"step_4.npz", "rb") as f:
+        assert((f.read(4) == ppf_utils.ZSTD_MAGIC) == (compression == "zstd"))
+    #delta chains of zstd files are rebuilt too
+    assert(np.array_equal(ppf_utils.load_checkpoint(tmp_path/"step_4.npz")["c"], expected))
+    sim.load_simulation(step=4)
+    assert(np.array_equal(sim.fields[0].get_cells(), expected))
+    sim.close_simulation()
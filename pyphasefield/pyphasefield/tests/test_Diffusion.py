@@ -1,116 +1,106 @@
-import pyphasefield as ppf
+from pyphasefield.Engines import Diffusion
 
-def test_diffusion_default1dexplicit():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10])
+def run_diffusion(dimensions, **user_data):
+    sim = Diffusion(dimensions=dimensions, dx=1., dt=0.1, user_data=user_data)
+    sim.initialize_fields_and_imported_data()
     sim.simulate(2)
-    
+    return sim
+
+def test_diffusion_default1dexplicit():
+    run_diffusion([10])
+
 def test_diffusion_default2dexplicit():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10])
-    sim.simulate(2)
-    
+    run_diffusion([10, 10])
+
 def test_diffusion_default3dexplicit():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10, 10])
-    sim.simulate(2)
-    
+    run_diffusion([10, 10, 10])
+
 def test_diffusion_Implicit1D():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10], solver="implicit")
-    sim.simulate(2)
-    
+    run_diffusion([10], solver="implicit")
+
 def test_diffusion_Implicit1D_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10], solver="implicit", gmres=True)
-    sim.simulate(2)
-    
+    run_diffusion([10], solver="implicit", gmres=True)
+
 def test_diffusion_Implicit2D():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="implicit")
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="implicit")
+
 def test_diffusion_Implicit2D_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="implicit", gmres=True)
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="implicit", gmres=True)
+
 def test_diffusion_Implicit2D_ADI():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="implicit", adi=True)
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="implicit", adi=True)
+
 def test_diffusion_Implicit2D_ADI_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="implicit", gmres=True, adi=True)
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="implicit", gmres=True, adi=True)
+
 def test_diffusion_Implicit3D():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="implicit")
-    sim.simulate(2)
-    
+    run_diffusion([5, 5, 5], solver="implicit")
+
 def test_diffusion_Implicit3D_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="implicit", gmres=True)
-    sim.simulate(2)
-    
+    run_diffusion([5, 5, 5], solver="implicit", gmres=True)
+
 def test_diffusion_Implicit3D_ADI():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="implicit", adi=True)
-    sim.simulate(2)
-    
+    run_diffusion([5, 5, 5], solver="implicit", adi=True)
+
 def test_diffusion_Implicit3D_ADI_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="implicit", gmres=True, adi=True)
-    sim.simulate(2)
-    
+    run_diffusion([5, 5, 5], solver="implicit", gmres=True, adi=True)
+
 def test_diffusion_CrankNicolson1D():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10], solver="crank-nicolson")
-    sim.simulate(2)
-    
+    run_diffusion([10], solver="crank-nicolson")
+
 def test_diffusion_CrankNicolson1D_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10], solver="crank-nicolson", gmres=True)
-    sim.simulate(2)
-    
+    run_diffusion([10], solver="crank-nicolson", gmres=True)
+
 def test_diffusion_CrankNicolson2D():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="crank-nicolson")
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="crank-nicolson")
+
 def test_diffusion_CrankNicolson2D_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="crank-nicolson", gmres=True)
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="crank-nicolson", gmres=True)
+
 def test_diffusion_CrankNicolson2D_ADI():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="crank-nicolson", adi=True)
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="crank-nicolson", adi=True)
+
 def test_diffusion_CrankNicolson2D_ADI_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([10, 10], solver="crank-nicolson", gmres=True, adi=True)
-    sim.simulate(2)
-    
+    run_diffusion([10, 10], solver="crank-nicolson", gmres=True, adi=True)
+
 def test_diffusion_CrankNicolson3D():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="crank-nicolson")
-    sim.simulate(2)
-    
+    run_diffusion([5, 5, 5], solver="crank-nicolson")
+
 def test_diffusion_CrankNicolson3D_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="crank-nicolson", gmres=True)
-    sim.simulate(2)
-    
+    run_diffusion([5, 5, 5], solver="crank-nicolson", gmres=True)
+
 def test_diffusion_CrankNicolson3D_ADI():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="crank-nicolson", adi=True)
-    sim.simulate(2)
-    
+    run_diffusion([5, 5, 5], solver="crank-nicolson", adi=True)
+
 def test_diffusion_CrankNicolson3D_ADI_GMRES():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Diffusion([5, 5, 5], solver="crank-nicolson", gmres=True, adi=True)
-    sim.simulate(2)
\ No newline at end of file
+    run_diffusion([5, 5, 5], solver="crank-nicolson", gmres=True, adi=True)
+
+def test_diffusion_compiled_matches_numpy():
+    results = []
+    for framework in [None, "CPU_PARALLEL"]:
+        sim = Diffusion(dimensions=[20], framework=framework, dx=1., dt=0.1, boundary_conditions="PERIODIC", user_data={"D":1.})
+        sim.initialize_fields_and_imported_data()
+        sim.simulate(5)
+        results.append(sim.fields[0].get_cells())
+    assert(abs(results[0]-results[1]).max() < 1e-12)
+    
+def test_diffusion_compiled_matches_numpy_mixed_bcs():
+    results = []
+    for framework in [None, "CPU_PARALLEL"]:
+        sim = Diffusion(dimensions=[8, 9, 10], framework=framework, dx=1., dt=0.1, 
+                        boundary_conditions=["PERIODIC", "DIRCHLET", "NEUMANN"], user_data={"D":1.})
+        sim.initialize_fields_and_imported_data()
+        sim.simulate(5)
+        results.append(sim.fields[0].data)
+    assert(abs(results[0]-results[1]).max() < 1e-12)
+
+def test_diffusion_implicit_solvers_agree():
+    "Direct and GMRES solves of the same scheme agree, and diffusion with periodic boundaries conserves mass"
+    for solver in ["implicit", "crank-nicolson"]:
+        for dimensions in [[10], [10, 10], [5, 5, 5]]:
+            direct = run_diffusion(dimensions, solver=solver).fields[0].get_cells()
+            approximate = run_diffusion(dimensions, solver=solver, gmres=True).fields[0].get_cells()
+            assert(abs(direct-approximate).max() < 1e-4)
+            initial = Diffusion(dimensions=dimensions, dx=1., dt=0.1)
+            initial.initialize_fields_and_imported_data()
+            assert(abs(direct.sum()-initial.fields[0].get_cells().sum()) < 1e-10)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from pyphasefield.Engines import NCGPU
+
+def run_ncgpu(dimensions, **user_data):
+    pytest.importorskip("pycalphad")
+    sim = NCGPU(dimensions=dimensions, dx=4.6e-6, temperature_type="ISOTHERMAL", initial_T=1574., 
+                tdb_path="./tests/Ni-Cu_Ideal.tdb", tdb_phases=["FCC_A1", "LIQUID"], boundary_conditions="PERIODIC", 
+                user_data={"sim_type":"seed", "initial_concentration_array":[0.40831], **user_data})
+    sim.initialize_fields_and_imported_data()
+    sim.simulate(2)
+    sim.retrieve_fields_from_GPU()
+    return sim
+
+def test_ncgpu():
+    "Simple Test of the GPU N-Component model, minimum size to avoid seed overstepping bounds"
+    run_ncgpu([10, 10])
+    
+def test_ncgpu_very_small():
+    "Tests what happens when the seed exceeds the size of the sim region"
+    "Doesnt normally happen, but may for the multiple seeds case when a seed is near the edge, or for a 1d simulation"
+    run_ncgpu([5, 5])
+    
+def test_ncgpu_1d():
+    "Tests a 2d sim, but with one dimension of length 1, equivalent to a 1d simulation"
+    run_ncgpu([20, 1])
+    
+def test_ncgpu_1d_actual():
+    "Tests a 1d sim"
+    run_ncgpu([20])
+
+def test_ncgpu_options():
+    sim = NCGPU(dimensions=[16, 16], user_data={"precision":"fp32", "cuda_threads_per_block":(32, 8)})
+    assert(sim.user_data["precision"] == "fp32")
+    assert(sim.user_data["cuda_threads_per_block"] == (32, 8))
+    sim = NCGPU(dimensions=[16, 16])
+    assert(sim.user_data["precision"] == "fp64")
+    #benchmarking block shapes is opt-in
+    assert(sim.user_data["cuda_threads_per_block"] is None)
+    NCGPU(dimensions=[16, 16], user_data={"cuda_threads_per_block":"auto"})
+
+@pytest.mark.parametrize("user_data", [{"precision":"fp16"}, {"cuda_threads_per_block":(64, 32)}, 
+                                       {"cuda_threads_per_block":(16, 0)}, {"cuda_threads_per_block":(16.5, 16)}, 
+                                       {"cuda_threads_per_block":"fastest"}])
+def test_ncgpu_rejects_options(user_data):
+    with pytest.raises(ValueError):
+        NCGPU(dimensions=[16, 16], user_data=user_data)
+
+def test_block_autotune_cache(tmp_path, monkeypatch):
+    cuda = pytest.importorskip("numba.cuda")
+    if not(cuda.is_available()):
+        pytest.skip("no CUDA device (or simulator)")
+    from pyphasefield import ppf_gpu_utils
+    monkeypatch.setattr(ppf_gpu_utils, "BLOCK_CACHE_PATH", tmp_path/"blocks.json")
+    launches = []
+    best = ppf_gpu_utils.autotune_threads_per_block(launches.append, [(16, 16), (32, 8), (64, 32)], "test", repeats=2)
+    assert(best in [(16, 16), (32, 8)])
+    #(64, 32) exceeds the device limit and is skipped, each other shape gets a warm-up launch and the timed ones
+    assert(sorted(set(launches)) == [(16, 16), (32, 8)] and len(launches) == 6)
+    assert(ppf_gpu_utils.autotune_threads_per_block(launches.append, [(16, 16), (32, 8)], "test") == best)
+    assert(len(launches) == 6)
+    assert(ppf_gpu_utils.clamp_threads_per_block((64, 32)) == (32, 32))
+    assert(ppf_gpu_utils.clamp_threads_per_block([16, 16]) == (16, 16))
+
+def test_ncgpu_tiled_kernel_matches_untiled():
+    "(16, 16) blocks use the shared memory tiled kernel, other shapes the plain one"
+    tiled = run_ncgpu([21, 37], cuda_threads_per_block=(16, 16))
+    untiled = run_ncgpu([21, 37], cuda_threads_per_block=(32, 8))
+    for a, b in zip(tiled.fields, untiled.fields):
+        assert(np.array_equal(a.get_cells(), b.get_cells()))
+
+@pytest.mark.parametrize("precision", ["mixed", "fp32"])
+def test_ncgpu_reduced_precision(precision):
+    reference = run_ncgpu([21, 37], cuda_threads_per_block=(16, 16))
+    reduced = run_ncgpu([21, 37], cuda_threads_per_block=(16, 16), precision=precision)
+    for a, b in zip(reference.fields, reduced.fields):
+        assert(abs(b.get_cells()-a.get_cells()).max() <= 1e-4*max(abs(a.get_cells()).max(), 1e-300))
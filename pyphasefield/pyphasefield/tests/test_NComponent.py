@@ -1,31 +1,93 @@
+import importlib
+import numpy as np
+import pytest
 import pyphasefield as ppf
-import os
+from pyphasefield import ppf_utils
+from pyphasefield.Engines import NComponent
+from pyphasefield.Engines.NComponent import divagradb, interdiffusion
+
+def run_ncomponent(dimensions, **user_data):
+    pytest.importorskip("pycalphad")
+    sim = NComponent(dimensions=dimensions, dx=4.6e-6, temperature_type="ISOTHERMAL", initial_T=1574., 
+                     tdb_path="./tests/Ni-Cu_Ideal.tdb", tdb_phases=["FCC_A1", "LIQUID"], boundary_conditions="PERIODIC", 
+                     user_data={"sim_type":"seed", "initial_concentration_array":[0.40831], **user_data})
+    sim.initialize_fields_and_imported_data()
+    sim.simulate(2)
+    return sim
 
 def test_ncomponent():
     "Simple Test of N-Component model, minimum size to avoid seed overstepping bounds"
-    sim = ppf.Simulation("test")
-    print("Current directory is: "+os.getcwd())
-    sim.init_sim_NComponent([10, 10], tdb_path="./tests/Ni-Cu_Ideal.tdb")
-    sim.simulate(2)
+    sim = run_ncomponent([10, 10])
+    assert(len(sim.fields) == 4)
+    for field in sim.fields:
+        assert(np.all(np.isfinite(field.get_cells())))
     
 def test_ncomponent_very_small():
     "Tests what happens when the seed exceeds the size of the sim region"
-    "Doesnt normally happen, but may for the multiple seeds case when a seed is near the edge, or for a 1d simulation"
-    sim = ppf.Simulation("test")
-    print("Current directory is: "+os.getcwd())
-    sim.init_sim_NComponent([5, 5], tdb_path="./tests/Ni-Cu_Ideal.tdb")
-    sim.simulate(2)
-    
-def test_ncomponent_1d():
-    "Tests a 2d sim, but with one dimension of length 1, equivalent to a 1d simulation"
-    sim = ppf.Simulation("test")
-    print("Current directory is: "+os.getcwd())
-    sim.init_sim_NComponent([20, 1], tdb_path="./tests/Ni-Cu_Ideal.tdb")
-    sim.simulate(2)
+    run_ncomponent([5, 5])
     
-def test_ncomponent_1d_actual():
-    "Tests a 1d sim"
-    sim = ppf.Simulation("test")
-    print("Current directory is: "+os.getcwd())
-    sim.init_sim_NComponent([20], tdb_path="./tests/Ni-Cu_Ideal.tdb")
-    sim.simulate(2)
\ No newline at end of file
+@pytest.mark.parametrize("solver", ["frozenorientation", "aniso_m", "adi"])
+def test_ncomponent_solvers(solver):
+    run_ncomponent([10, 10], solver=solver)
+
+def test_ncomponent_rejects_unknown_solver():
+    with pytest.raises(ValueError, match="explicit"):
+        NComponent(dimensions=[10, 10], user_data={"solver":"implicit"})
+    assert(NComponent(dimensions=[10, 10]).user_data["solver"] == "explicit")
+
+def pairwise_interdiffusion(M_c, c, dFdc, dx, dim):
+    "The per-pair divagradb sum interdiffusion replaced"
+    deltac = []
+    for j in range(len(c)):
+        deltac.append(divagradb(M_c[j]*(1-c[j]), dFdc[j], dx, dim))
+        for k in range(len(c)):
+            if not (j == k):
+                deltac[j] -= divagradb(M_c[j]*c[k], dFdc[k], dx, dim)
+    return deltac
+
+@pytest.mark.parametrize("shape", [[17], [9, 12], [5, 6, 7]])
+@pytest.mark.parametrize("components", [2, 3, 5])
+def test_interdiffusion_matches_pairwise_sum(shape, components):
+    rng = np.random.default_rng(components)
+    #one field per component but the last (c_N = 1-sum(c))
+    c = list(rng.uniform(0., 1./components, [components-1]+shape))
+    M_c = list(rng.uniform(0.5, 2., [components-1]+shape)*1e-3)
+    dFdc = list(rng.normal(0., 1e4, [components-1]+shape))
+    dx = 0.25
+    expected = pairwise_interdiffusion(M_c, c, dFdc, dx, len(shape))
+    result = interdiffusion(M_c, c, dFdc, dx, len(shape))
+    assert(result.shape == tuple([components-1]+shape))
+    scale = max(abs(e).max() for e in expected)
+    for j in range(components-1):
+        assert(np.allclose(result[j], expected[j], rtol=0., atol=1e-12*scale))
+
+def test_tdb_functions_match_lambdify(monkeypatch):
+    "The free energies (and their derivatives) compiled to C, against the sp.lambdify ones used without a C compiler"
+    pyc = pytest.importorskip("pycalphad")
+    nc = importlib.import_module("pyphasefield.Engines.NComponent")
+    for name in ("ufunc_g_s", "ufunc_g_l", "ufunc_dgdc_s", "ufunc_dgdc_l"):
+        monkeypatch.setattr(nc, name, getattr(nc, name)) #restored afterwards
+    def load():
+        sim = ppf.Simulation(dx=4.6e-6)
+        sim._tdb = pyc.Database("./tests/Ni-Cu_Ideal.tdb")
+        sim._components = ["CU", "NI"]
+        sim.d = sim.get_cell_spacing()/0.94
+        assert(nc.init_tdb_parameters(sim))
+        return [nc.ufunc_g_s, nc.ufunc_g_l], [nc.ufunc_dgdc_s, nc.ufunc_dgdc_l]
+    compiled, compiled_derivatives = load()
+    assert(all(isinstance(f, ppf_utils.TDBCFunction) for f in compiled))
+    def no_compiler(source, number_of_arguments):
+        raise OSError("no C compiler")
+    monkeypatch.setattr(ppf_utils, "make_tdb_c_function", no_compiler)
+    lambdified, lambdified_derivatives = load()
+    c = np.array([0.1, 0.40831, 0.9])
+    T = np.array([1500., 1574., 1700.])
+    h = 1e-7
+    for i in range(2):
+        assert(len(compiled_derivatives[i]) == len(lambdified_derivatives[i]) == 1)
+        assert(np.allclose(compiled[i](c, 1-c, T), lambdified[i](c, 1-c, T), rtol=1e-12, atol=0.))
+        dgdc = compiled_derivatives[i][0](c, 1-c, T)
+        assert(np.allclose(dgdc, lambdified_derivatives[i][0](c, 1-c, T), rtol=1e-12, atol=1e-9))
+        #c_CU increases as c_NI (the implicit last component) decreases
+        finite_difference = (compiled[i](c+h, 1-c-h, T)-compiled[i](c, 1-c, T))/h
+        assert(np.allclose(dgdc, finite_difference, rtol=1e-4, atol=1e-2))
@@ -0,0 +1,192 @@
+import numpy as np
+import pytest
+import pyphasefield as ppf
+from pyphasefield.simulation import _normalize_dimensions
+
+def test_normalize_dimensions_sequences():
+    assert(_normalize_dimensions([10, 20]) == [10, 20])
+    assert(_normalize_dimensions((10, 20, 30)) == [10, 20, 30])
+    assert(_normalize_dimensions(np.zeros((4, 5)).shape) == [4, 5])
+    assert(_normalize_dimensions(np.array([7], dtype=np.int32)) == [7])
+    assert(all(type(n) is int for n in _normalize_dimensions(np.array([3, 4]))))
+    assert(_normalize_dimensions(None) is None)
+
+@pytest.mark.parametrize("dimensions", [[], [1, 2, 3, 4], [10, 0], [10, -1], [1.5, 2], [[10, 10]]])
+def test_normalize_dimensions_rejects(dimensions):
+    with pytest.raises(ValueError):
+        _normalize_dimensions(dimensions)
+
+def test_simulation_dimensions():
+    sim = ppf.Simulation(dimensions=np.array([8, 9]))
+    assert(sim.dimensions == [8, 9])
+    assert(ppf.Simulation().dimensions is None)
+
+def test_simulation_positional_save_path():
+    "Simulation(save_path) of the old API"
+    sim = ppf.Simulation("save_folder")
+    assert(sim.dimensions is None)
+    assert(sim._save_path == "save_folder")
+    assert(ppf.Simulation("ignored", save_path="other")._save_path == "other")
+
+def roll_laplacian(data, dx):
+    "The np.roll laplacian Field.laplacian replaced"
+    result = (np.roll(data, -1, 0) + np.roll(data, 1, 0) - 2*data)/dx**2
+    for i in range(1, data.ndim):
+        result += (np.roll(data, -1, i) + np.roll(data, 1, i) - 2*data)/dx**2
+    return result
+
+@pytest.mark.parametrize("dimensions", [[7], [6, 9], [4, 5, 6]])
+def test_field_laplacian_matches_roll(dimensions):
+    sim = ppf.Simulation(dimensions=dimensions, dx=0.5)
+    rng = np.random.default_rng(1)
+    sim.add_field(rng.random(dimensions), "c")
+    field = sim.fields[0]
+    field.data[...] = rng.random(field.data.shape) #boundary cells too
+    expected = roll_laplacian(field.data, 0.5)
+    assert(np.allclose(field.laplacian(), expected, rtol=1e-12, atol=1e-12))
+    out = np.full(field.data.shape, np.nan)
+    assert(field.laplacian(out=out) is out)
+    assert(np.allclose(out, expected, rtol=1e-12, atol=1e-12))
+
+def test_plot_simulation_recolors_changed_tiles(monkeypatch):
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    monkeypatch.setattr(plt, "show", lambda: None)
+    sim = ppf.Simulation(dimensions=[100, 130])
+    sim.add_field(np.linspace(0., 1., 100*130).reshape(100, 130), "c")
+    sim._plot_tile_size = 16
+    colormap = plt.get_cmap(sim.fields[0].colormap)
+    sim.plot_simulation(limits=(0., 1.))
+    image = sim._plot_cache[0][1]
+    calls = []
+    original = type(colormap).__call__
+    def counting_call(self, X, *args, **kwargs):
+        calls.append(np.shape(X))
+        return original(self, X, *args, **kwargs)
+    monkeypatch.setattr(type(colormap), "__call__", counting_call)
+    sim.fields[0].data[20:24, 40:44] = 0.25
+    sim.plot_simulation(limits=(0., 1.))
+    #only the tile containing the change is recolored, in place
+    assert(calls == [(16, 16)])
+    assert(sim._plot_cache[0][1] is image)
+    assert(np.array_equal(image, original(colormap, sim.fields[0].data, bytes=True)))
+    #limits from the data change when the data does, everything is recolored
+    calls.clear()
+    sim.fields[0].data[0, 0] = -1.
+    sim.plot_simulation()
+    assert(calls == [sim.fields[0].data.shape])
+    plt.close("all")
+
+@pytest.fixture
+def thermal_history(tmp_path, monkeypatch):
+    "A 6 step xdmf thermal history of random 6x8 temperatures at t = 0, 1, ..., 5, and a log of the steps read"
+    meshio = pytest.importorskip("meshio")
+    monkeypatch.chdir(tmp_path) #the heavy data is written next to the working directory
+    rng = np.random.default_rng(3)
+    history = [1000.+rng.random((6, 8)) for i in range(6)]
+    with meshio.xdmf.TimeSeriesWriter("T.xdmf") as writer:
+        writer.write_points_cells(np.array([[[0, 0], [0, 0]], [[0, 0], [0, 0]]]), {})
+        for i in range(len(history)):
+            writer.write_data(float(i), point_data={"T":history[i][..., None]})
+    reads = []
+    read_data = meshio.xdmf.TimeSeriesReader.read_data
+    def logged_read_data(self, k):
+        reads.append(k)
+        return read_data(self, k)
+    monkeypatch.setattr(meshio.xdmf.TimeSeriesReader, "read_data", logged_read_data)
+    return history, reads
+
+def make_thermal_simulation():
+    from pyphasefield.Engines import Diffusion
+    sim = Diffusion(dimensions=[6, 8], dx=1., dt=0.25, temperature_type="XDMF_FILE", temperature_path="T.xdmf")
+    sim.initialize_fields_and_imported_data()
+    return sim
+
+@pytest.mark.parametrize("preload", [None, 8, 100])
+def test_xdmf_temperature_interpolation(thermal_history, preload):
+    history, reads = thermal_history
+    sim = make_thermal_simulation()
+    if not(preload is None):
+        sim.preload_temperature_file(preload)
+    for step in range(1, 21):
+        sim.simulate(1)
+        time = 0.25*step
+        i = min(int(np.ceil(time))-1, 4)
+        expected = history[i]*(i+1-time) + history[i+1]*(time-i)
+        assert(np.allclose(sim.temperature.get_cells(), expected, rtol=0., atol=1e-9))
+    #every step of the history is read from the file once, preloaded or not
+    assert(sorted(reads) == list(range(6)))
+    sim.close_simulation()
+
+def test_xdmf_preload_reuses_loaded_steps(thermal_history):
+    history, reads = thermal_history
+    sim = make_thermal_simulation()
+    sim.simulate(6) #t = 1.5, between steps 1 and 2
+    assert(reads == [0, 1, 2])
+    sim.preload_temperature_file(4) #up to t = 2.5
+    assert(reads == [0, 1, 2, 3])
+    assert(np.array_equal(sim._t_file_lut_times, [1., 2., 3.]))
+    sim.preload_temperature_file()
+    assert(reads == [0, 1, 2, 3, 4, 5])
+    assert(np.array_equal(sim._t_file_lut[2], history[3]))
+    sim.close_simulation()
+
+class FakeEntryPoint:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.loads = 0
+    def load(self):
+        self.loads += 1
+        return self.engine
+
+def test_get_engine_entry_points(monkeypatch):
+    from pyphasefield import simulation
+    class PluginEngine(ppf.Simulation):
+        pass
+    plugin = FakeEntryPoint("PluginModel", PluginEngine)
+    shadowing = FakeEntryPoint("Diffusion", PluginEngine)
+    monkeypatch.setattr(simulation, "_MODEL_ENGINES", dict(simulation._MODEL_ENGINES))
+    monkeypatch.setattr(simulation, "_plugin_models", {"PluginModel":plugin, "Diffusion":shadowing})
+    assert(ppf.get_engine("PluginModel") is PluginEngine)
+    #loaded once, then kept with the built-in models
+    assert(ppf.get_engine("PluginModel") is PluginEngine and plugin.loads == 1)
+    #built-in models take precedence
+    from pyphasefield.Engines import Diffusion
+    assert(ppf.get_engine("Diffusion") is Diffusion and shadowing.loads == 0)
+    with pytest.raises(ValueError, match="PluginModel"):
+        ppf.get_engine("NotAModel")
+
+def test_get_engine_scans_entry_points_once(monkeypatch):
+    from pyphasefield import simulation
+    import importlib.metadata
+    scans = []
+    def entry_points(**kwargs):
+        scans.append(kwargs)
+        return importlib.metadata.EntryPoints([])
+    monkeypatch.setattr(importlib.metadata, "entry_points", entry_points)
+    monkeypatch.setattr(simulation, "_plugin_models", None)
+    ppf.get_engine("CahnAllen")
+    assert(scans == [])
+    for i in range(2):
+        with pytest.raises(ValueError):
+            ppf.get_engine("NotAModel")
+    assert(len(scans) == 1)
+
+def test_init_sim_deprecated():
+    from pyphasefield.Engines import Diffusion, Warren1995
+    sim = ppf.Simulation("save_folder")
+    with pytest.warns(DeprecationWarning, match="Diffusion"):
+        sim.init_sim_Diffusion([10], dx=1., dt=0.1, D=0.2)
+    assert(type(sim) is Diffusion and sim._save_path == "save_folder")
+    assert(sim.dimensions == [10] and sim.user_data["D"] == 0.2 and len(sim.fields) == 1)
+    sim.simulate(2)
+    #old keyword names
+    sim = ppf.Simulation()
+    with pytest.warns(DeprecationWarning):
+        sim.init_sim("Warren1995", dim=[20, 20], cell_spacing=4.6e-8, nbc=["periodic", "periodic"], diamond_size=5)
+    assert(type(sim) is Warren1995 and sim.dx == 4.6e-8 and sim.user_data["diamond_size"] == 5)
+    assert(sim._boundary_conditions_type == ["PERIODIC", "PERIODIC"])
+    with pytest.warns(DeprecationWarning), pytest.raises(ValueError):
+        ppf.Simulation().init_sim("NotAModel", [10])
@@ -0,0 +1,141 @@
+import os
+import shutil
+import numpy as np
+import pytest
+import sympy as sp
+from pyphasefield import ppf_utils
+
+needs_compiler = pytest.mark.skipif(shutil.which(ppf_utils.TDB_C_COMPILER) is None, reason="no C compiler")
+
+def sample_free_energy():
+    "Ideal mixing, a Redlich-Kister term and a piecewise T term, like the Gibbs energies of a TDB phase"
+    x, y, T = sp.symbols("x y T")
+    expression = (8.314*T*(x*sp.log(x)+y*sp.log(y)) + x*y*(-5000.+3.*T+(1200.-T)*(x-y)) + 
+                  sp.Piecewise((-3000.+2.*T, T < 1000.), (-1000.-T*sp.log(T), True)))
+    return [x, y, T], expression
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYPHASEFIELD_CACHE_DIR", str(tmp_path))
+    ppf_utils.make_tdb_c_function.cache_clear()
+    yield tmp_path
+    ppf_utils.make_tdb_c_function.cache_clear()
+
+@needs_compiler
+def test_tdb_c_function_matches_lambdify(cache_dir):
+    symbols, expression = sample_free_energy()
+    compiled = ppf_utils.make_tdb_c_function(ppf_utils.tdb_function_c_source(symbols, expression), len(symbols))
+    reference = sp.lambdify(symbols, expression, "numpy")
+    rng = np.random.default_rng(2)
+    x = rng.uniform(1e-6, 1-1e-6, (64, 64))
+    T = rng.uniform(500., 2000., (64, 64))
+    expected = reference(x, 1-x, T)
+    result = compiled(x, 1-x, T)
+    assert(result.shape == expected.shape)
+    #without -ffast-math, only the rounding of the (differently ordered) arithmetic differs
+    assert(abs(result-expected).max() <= 1e-12*abs(expected).max())
+    #scalars broadcast against arrays, and scalar calls return a scalar
+    assert(np.allclose(compiled(0.3, 0.7, T), reference(0.3, 0.7, T), rtol=1e-12, atol=0.))
+    assert(np.ndim(compiled(0.3, 0.7, 1200.)) == 0)
+    with pytest.raises(TypeError):
+        compiled(0.3, 0.7)
+
+@needs_compiler
+def test_tdb_c_cache_key_includes_cpu(cache_dir, monkeypatch):
+    symbols, expression = sample_free_energy()
+    source = ppf_utils.tdb_function_c_source(symbols, expression)
+    ppf_utils.make_tdb_c_function(source, len(symbols))
+    libraries = set(cache_dir.glob("tdb_*.so"))
+    assert(len(libraries) == 1)
+    #the same source compiled on another CPU model is a different library
+    monkeypatch.setattr(ppf_utils, "host_cpu_signature", lambda: "another cpu")
+    ppf_utils.make_tdb_c_function.cache_clear()
+    ppf_utils.make_tdb_c_function(source, len(symbols))
+    assert(len(set(cache_dir.glob("tdb_*.so"))-libraries) == 1)
+
+@needs_compiler
+def test_tdb_c_broken_library_removed_by_another_process(cache_dir, monkeypatch):
+    import ctypes
+    symbols, expression = sample_free_energy()
+    source = ppf_utils.tdb_function_c_source(symbols, expression)
+    def load_fails(path):
+        os.remove(path) #e.g. another process also failed to load it, and removed it first
+        raise OSError("invalid ELF header")
+    monkeypatch.setattr(ctypes, "CDLL", load_fails)
+    #the original error is raised, not a FileNotFoundError from removing the library again
+    with pytest.raises(OSError, match="invalid ELF header"):
+        ppf_utils.make_tdb_c_function(source, len(symbols))
+    assert(list(cache_dir.glob("tdb_*.so")) == [])
+
+def test_host_cpu_signature():
+    import platform
+    assert(ppf_utils.host_cpu_signature().startswith(platform.machine()))
+
+@pytest.fixture
+def fake_pycalphad(monkeypatch):
+    "tdb_phase_function_source, with a stand-in pycalphad module and phase expression"
+    import sys, types
+    module = types.ModuleType("pycalphad")
+    module.__version__ = "1.0"
+    monkeypatch.setitem(sys.modules, "pycalphad", module)
+    calls = []
+    def phase_expression(tdb, phase_id, components):
+        calls.append(phase_id)
+        return sample_free_energy()
+    monkeypatch.setattr(ppf_utils, "tdb_phase_expression", phase_expression)
+    monkeypatch.setattr(ppf_utils, "_tdb_sources", {})
+    return module, calls
+
+def test_tdb_source_cache_key(cache_dir, fake_pycalphad):
+    module, calls = fake_pycalphad
+    tdb_path = cache_dir/"test.tdb"
+    tdb_path.write_text("$ test database\n")
+    source = ppf_utils.tdb_phase_function_source(None, str(tdb_path), "LIQUID", ["X", "Y"], module="numpy")
+    assert(calls == ["LIQUID"] and len(list(cache_dir.glob("tdb_*.py"))) == 1)
+    #read from disk by a later process
+    ppf_utils._tdb_sources.clear()
+    assert(ppf_utils.tdb_phase_function_source(None, str(tdb_path), "LIQUID", ["X", "Y"], module="numpy") == source)
+    assert(calls == ["LIQUID"])
+    #another pycalphad version may build a different expression from the same file
+    module.__version__ = "2.0"
+    ppf_utils.tdb_phase_function_source(None, str(tdb_path), "LIQUID", ["X", "Y"], module="numpy")
+    assert(calls == ["LIQUID", "LIQUID"] and len(list(cache_dir.glob("tdb_*.py"))) == 2)
+
+def test_tdb_source_without_file(cache_dir, fake_pycalphad):
+    module, calls = fake_pycalphad
+    source = ppf_utils.tdb_phase_function_source(None, str(cache_dir/"missing.tdb"), "LIQUID", ["X", "Y"])
+    symbols, expression = sample_free_energy()
+    assert(source == ppf_utils.tdb_function_source(symbols, expression))
+    assert(list(cache_dir.glob("tdb_*.py")) == [])
+
+def test_tdb_container_and_simulation_functions(cache_dir, fake_pycalphad, monkeypatch):
+    "TDBContainer and Simulation build the free energies of each phase with the same helper"
+    from pyphasefield import simulation
+    module, calls = fake_pycalphad
+    class Database:
+        def __init__(self, path):
+            self.phases = {"LIQUID": None, "FCC_A1": None}
+            self.elements = {"Y", "X"}
+    module.Database = Database
+    monkeypatch.setattr(simulation, "_HAS_PYCALPHAD", True)
+    tdb_path = cache_dir/"test.tdb"
+    tdb_path.write_text("$ test database\n")
+    container = ppf_utils.TDBContainer(str(tdb_path))
+    assert(container._tdb_phases == ("FCC_A1", "LIQUID") and container._tdb_components == ("X", "Y"))
+    #numpy sources, then math sources for the device functions
+    assert(calls == ["FCC_A1", "LIQUID", "FCC_A1", "LIQUID"])
+    #device functions, only callable from CUDA kernels
+    assert(len(container._tdb_device_ufuncs) == 2)
+    sim = simulation.Simulation(framework="CPU_SERIAL", tdb_path=str(tdb_path))
+    sim.init_tdb_params()
+    from_container = simulation.Simulation(framework="CPU_SERIAL", tdb_container=container)
+    from_container.init_tdb_params()
+    #the numpy sources were already generated for the container
+    assert(len(calls) == 4)
+    symbols, expression = sample_free_energy()
+    values = [0.3, 0.7, 1200.]
+    expected = sp.lambdify(symbols, expression, "numpy")(*values)
+    for functions in (container._tdb_cpu_ufuncs, sim._tdb_ufuncs, from_container._tdb_ufuncs):
+        assert(len(functions) == 2)
+        for f in functions:
+            assert(np.isclose(f(values), expected, rtol=1e-12, atol=0.))
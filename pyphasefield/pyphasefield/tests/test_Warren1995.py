@@ -1,6 +1,61 @@
-import pyphasefield as ppf
+import numpy as np
+import pytest
+from pyphasefield.Engines import Warren1995
+from pyphasefield.Engines.Warren1995 import diamond_seeds, rasterize_seeds
 
 def test_warren1995():
-    sim = ppf.Simulation("test")
-    sim.init_sim_Warren1995([20,20])
-    sim.simulate(2)
\ No newline at end of file
+    sim = Warren1995(dimensions=[20, 20], dx=4.6e-8)
+    sim.initialize_fields_and_imported_data()
+    sim.simulate(2)
+
+def diamond_slice_loop(dim, diamond_size, y, x):
+    "The slice loop rasterize_seeds replaced, for a diamond around the grid point (y, x)"
+    phi = np.full(dim, 1.)
+    for i in range(diamond_size):
+        phi[max(y-i, 0):max(y+i, 0), max(x-(diamond_size-i), 0):max(x+(diamond_size-i), 0)] = 0
+    return phi
+
+def test_warren1995_default_seed_matches_slice_loop():
+    for dim, diamond_size in [([20, 20], 5), ([31, 40], 15), ([200, 200], 15), ([10, 10], 15)]:
+        phi = rasterize_seeds(dim, diamond_seeds(dim, diamond_size))
+        assert(np.array_equal(phi, diamond_slice_loop(dim, diamond_size, dim[0]//2, dim[1]//2)))
+
+def test_warren1995_many_seeds_match_per_seed_loop():
+    dim = [64, 80]
+    rng = np.random.default_rng(0)
+    xs = rng.integers(0, dim[1], 50).astype(np.int32)
+    ys = rng.integers(0, dim[0], 50).astype(np.int32)
+    radii = rng.integers(1, 8, 50).astype(np.float32)
+    expected = np.full(dim, 1.)
+    for x, y, r in zip(xs, ys, radii):
+        expected = np.minimum(expected, diamond_slice_loop(dim, int(r), y, x))
+    assert(np.array_equal(rasterize_seeds(dim, (xs, ys, radii)), expected))
+    assert(np.array_equal(rasterize_seeds(dim, ([], [], [])), np.ones(dim)))
+    with pytest.raises(ValueError):
+        rasterize_seeds(dim, ([1, 2], [1], [3.]))
+
+def test_warren1995_seed_soa_user_data():
+    seeds = (np.array([5, 15], dtype=np.int32), np.array([10, 10], dtype=np.int32), np.array([3, 4], dtype=np.float32))
+    sim = Warren1995(dimensions=[20, 20], dx=4.6e-8, user_data={"seed_soa":seeds})
+    sim.initialize_fields_and_imported_data()
+    assert(np.array_equal(sim.fields[0].get_cells(), rasterize_seeds([20, 20], seeds)))
+    sim = Warren1995(dimensions=[20, 20], dx=4.6e-8, user_data={"diamond_size":5})
+    sim.initialize_fields_and_imported_data()
+    assert(np.array_equal(sim.fields[0].get_cells(), diamond_slice_loop([20, 20], 5, 10, 10)))
+
+@pytest.mark.parametrize("boundary_conditions", ["PERIODIC", "NEUMANN"])
+def test_warren1995_fused_kernel_matches_numpy(boundary_conditions):
+    "The compiled step against the numpy engine, with the noise off"
+    pytest.importorskip("numba")
+    results = []
+    for framework in [None, "CPU_SERIAL", "CPU_PARALLEL"]:
+        sim = Warren1995(dimensions=[40, 48], dx=4.6e-8, boundary_conditions=boundary_conditions, framework=framework, 
+                         user_data={"alpha":0., "diamond_size":8})
+        sim.initialize_fields_and_imported_data()
+        sim.simulate(10)
+        results.append([field.get_cells().copy() for field in sim.fields])
+    for result in results[1:]:
+        for field, expected in zip(result, results[0]):
+            assert(abs(field-expected).max() < 1e-14)
+    #the interface has moved
+    assert not(np.array_equal(results[0][0], diamond_slice_loop([40, 48], 8, 20, 24)))